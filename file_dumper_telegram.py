@@ -1,22 +1,75 @@
 import tkinter as tk
-from tkinter import ttk, messagebox, filedialog, scrolledtext
+from tkinter import ttk, messagebox, filedialog, scrolledtext, simpledialog
 from tkinter.font import Font
 import asyncio
 import threading
 import json
 import os
 import re
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from telethon import TelegramClient, errors
-from telethon.tl.types import MessageMediaDocument, DocumentAttributeFilename
+from telethon import TelegramClient, errors, events, utils
+from telethon.tl.types import (MessageMediaDocument, DocumentAttributeFilename, Channel, PeerChannel,
+                               User, ChatPhotoEmpty)
+from telethon.tl import functions
+from telethon.tl.alltlobjects import LAYER
+from telethon.network import MTProtoSender
 import sys
 import webbrowser
-from typing import List, Dict, Optional, Set
+from typing import List, Dict, Optional, Set, Tuple
 from dataclasses import dataclass
 import queue
+import sqlite3
 import time
+from collections import deque
+from array import array
+import heapq
+import itertools
 import traceback
+import copy
+import hashlib
+import argparse
+import struct
+import csv
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import zipfile
+import tarfile
+import gzip
+import bz2
+import lzma
+import shutil
+import shlex
+import subprocess
+import socket
+import tempfile
+import contextvars
+import multiprocessing
+
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+try:
+    from PIL import Image, ImageTk
+except ImportError:
+    Image = ImageTk = None
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+try:
+    import cryptg
+except ImportError:
+    cryptg = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
 
 # ========== КОНСТАНТЫ ==========
 ALL_EXTENSIONS = {
@@ -77,6 +130,112 @@ EXTENSION_CATEGORIES = {
     '.csv': 'Другие'
 }
 
+# Пул соединений к чужим DC
+DC_POOL_MAX_SENDERS = 4
+DC_POOL_IDLE_TIMEOUT = 120
+
+# Загрузка документов частями: размер части (кратен 4 КБ и делит 1 МБ - ограничения
+# upload.getFile) и окно одновременных запросов частей на один файл
+TRANSFER_PART_MIN = 4 * 1024
+TRANSFER_PART_MAX = 512 * 1024
+TRANSFER_WINDOW_START = 2
+TRANSFER_WINDOW_MAX = 8
+# Ответ дольше минимального RTT во столько раз - канал забит, окно сужается
+TRANSFER_QUEUE_FACTOR = 2.0
+
+# Стадия записи на диск
+WRITE_BLOCK_SIZE = 1024 * 1024
+WRITE_QUEUE_BLOCKS = 8
+WRITE_THREADS = 4
+
+# Чтение диапазонов документов (оглавления архивов)
+RANGE_REQUEST_SIZE = 64 * 1024
+ZIP_TAIL_SIZE = 64 * 1024
+
+# Миниатюры для предпросмотра
+THUMB_CACHE_DIR = 'tg_thumbs'
+THUMB_CACHE_MAX_BYTES = 200 * 1024 * 1024
+THUMB_CONCURRENCY = 8
+PREVIEW_MAX_ITEMS = 200
+
+# Постобработка скачанных файлов в пуле процессов
+POSTPROCESS_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+POSTPROCESS_MAX_PENDING = 2 * POSTPROCESS_WORKERS
+# Куда класть результат: рядом с файлом / в папку с именем файла / в отдельное дерево
+POSTPROCESS_LAYOUTS = ('subfolder', 'beside', 'separate')
+POSTPROCESS_SEPARATE_DIR = '_extracted'
+TAR_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+# Режим наблюдения: предельная пауза между попытками переподключения, с
+WATCH_RECONNECT_MAX_DELAY = 60
+
+# Сортировка таблицы файлов: сколько перестановок держать в кеше
+SORT_CACHE_SIZE = 8
+# Колонка таблицы -> колонка каталога (None - отметка выбора, есть только в таблице)
+TREE_SORT_COLUMNS = {
+    'Выбор': None,
+    'Имя файла': 'filename',
+    'Размер': 'size',
+    'Тип': 'extension',
+    'Категория': 'category',
+    'Дата': 'date',
+}
+
+# Event loop фонового потока и самопроверка производительности
+EVENT_LOOP_BACKENDS = ('auto', 'asyncio', 'uvloop')
+BENCH_LOOP_ITERATIONS = 20000
+BENCH_DECRYPT_MIN_SECONDS = 0.5
+# Монитор задержек цикла: шаг замера, порог блокировки, окно выборки (~1 мин) и глубина стека
+LOOP_MONITOR_INTERVAL = 0.05
+LOOP_SLOW_CALLBACK = 0.1
+LOOP_LAG_SAMPLES = 1200
+LOOP_STALLS_KEPT = 20
+LOOP_STACK_DEPTH = 15
+
+# Экспорт каталога
+EXPORT_CHUNK_SIZE = 10000
+
+# Конвейерное чтение истории: размер страницы (предел API - 100),
+# сколько страниц запрашивать наперёд и порог медленной страницы, с
+HISTORY_PAGE_MIN = 20
+HISTORY_PAGE_MAX = 100
+HISTORY_PREFETCH_DEPTH = 2
+HISTORY_SLOW_PAGE = 3.0
+# Пауза между запросами после FloodWait: доля от ожидания и предел, с
+HISTORY_FLOOD_BACKOFF = 0.1
+HISTORY_MAX_DELAY = 5.0
+
+# Упаковка в tar-шарды: папка, предел размера шарда, сколько файла держать в памяти до записи,
+# сколько пробных файлов создать для оценки накладных расходов файловой системы
+SHARD_DIR = '_shards'
+SHARD_INDEX = 'index.jsonl'
+SHARD_MAX_BYTES = 1024 * 1024 * 1024
+SHARD_SPOOL_BYTES = 8 * 1024 * 1024
+SHARD_PROBE_FILES = 20
+
+# Распределённая загрузка: аренда файла воркером, продление аренды, попытки на файл, опрос хранилища, с
+LEASE_SECONDS = 120
+HEARTBEAT_INTERVAL = 30
+LEASE_MAX_ATTEMPTS = 3
+WORKER_POLL_INTERVAL = 10
+
+# Контрольные точки сканирования: как часто сохранять (сообщений / секунд) и сколько хранить, с
+SCAN_CHECKPOINT_MESSAGES = 1000
+SCAN_CHECKPOINT_SECONDS = 10
+SCAN_CHECKPOINT_TTL = 7 * 24 * 3600
+
+# Глобальный поиск по всем просканированным чатам
+SEARCH_DB = 'tg_downloader_search.db'
+SEARCH_LIMIT = 500
+
+SETTINGS_FILE = 'tg_downloader_settings.json'
+SESSION_NAME = 'tg_session'
+
+# Кеш сущностей чатов: через сколько секунд запись обновляется в фоне
+PEER_CACHE_TTL = 7 * 24 * 3600
+# Пауза между сетевыми разрешениями username при пакетной загрузке чатов, с
+RESOLVE_INTERVAL = 1.0
+
 MIME_TO_EXT = {
     'application/zip': '.zip',
     'application/x-rar-compressed': '.rar',
@@ -135,6 +294,2919 @@ class FileInfo:
     category: str
 
 
+class StringDictionary:
+    """Словарное кодирование повторяющихся строк (расширения, категории, MIME)"""
+
+    __slots__ = ('values', '_codes')
+
+    def __init__(self):
+        self.values: List[str] = []
+        self._codes: Dict[str, int] = {}
+
+    def encode(self, value: str) -> int:
+        """Код строки (новая строка добавляется в словарь)"""
+        code = self._codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.values.append(sys.intern(value))
+            self._codes[value] = code
+        return code
+
+    def lookup(self, value: str) -> Optional[int]:
+        """Код строки без добавления в словарь"""
+        return self._codes.get(value)
+
+
+class _Descending:
+    """Обёртка ключа сортировки для обратного порядка строк"""
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+class FileView:
+    """Лёгкое представление строки каталога с интерфейсом FileInfo"""
+
+    __slots__ = ('_catalog', '_index')
+
+    def __init__(self, catalog: 'FileCatalog', index: int):
+        self._catalog = catalog
+        self._index = index
+
+    @property
+    def id(self) -> int:
+        return self._catalog.ids[self._index]
+
+    @property
+    def filename(self) -> str:
+        return self._catalog.filename_at(self._index)
+
+    @property
+    def size_bytes(self) -> int:
+        return self._catalog.sizes[self._index]
+
+    @property
+    def date(self) -> datetime:
+        return datetime.fromtimestamp(self._catalog.timestamps[self._index], timezone.utc)
+
+    @property
+    def mime_type(self) -> str:
+        return self._catalog.mime_types.values[self._catalog.mime_codes[self._index]]
+
+    @property
+    def extension(self) -> str:
+        return self._catalog.extensions.values[self._catalog.extension_codes[self._index]]
+
+    @property
+    def category(self) -> str:
+        return self._catalog.categories.values[self._catalog.category_codes[self._index]]
+
+    def to_file_info(self) -> FileInfo:
+        """Полноценный FileInfo для этой строки"""
+        return FileInfo(self.id, self.filename, self.size_bytes, self.date,
+                        self.mime_type, self.extension, self.category)
+
+    def __repr__(self):
+        return f"FileView(id={self.id}, filename={self.filename!r}, size_bytes={self.size_bytes})"
+
+
+class FileCatalog:
+    """Компактный колоночный каталог результатов сканирования
+
+    Вместо объекта FileInfo на файл хранятся массивы: id и размеры (int64),
+    даты (секунды эпохи), коды расширения/категории/MIME из общих словарей
+    и одна таблица имён в UTF-8 со смещениями. Строки отдаются как FileView.
+    """
+
+    def __init__(self, files=None):
+        self.ids = array('q')
+        self.sizes = array('q')
+        self.timestamps = array('q')
+        self.extension_codes = array('H')
+        self.category_codes = array('H')
+        self.mime_codes = array('H')
+        self.extensions = StringDictionary()
+        self.categories = StringDictionary()
+        self.mime_types = StringDictionary()
+        self._names = bytearray()
+        self._name_offsets = array('Q', [0])
+        self._index_by_id = None
+        # (колонка, по убыванию)... -> перестановка строк
+        self._sort_cache: Dict[tuple, array] = {}
+
+        if files:
+            self.extend(files)
+
+    def append(self, file):
+        """Добавление файла (FileInfo или FileView)"""
+        self.ids.append(file.id)
+        self.sizes.append(file.size_bytes)
+        self.timestamps.append(int(file.date.timestamp()))
+        self.extension_codes.append(self.extensions.encode(file.extension))
+        self.category_codes.append(self.categories.encode(file.category))
+        self.mime_codes.append(self.mime_types.encode(file.mime_type))
+        self._names += file.filename.encode('utf-8')
+        self._name_offsets.append(len(self._names))
+        if self._index_by_id is not None:
+            self._index_by_id[file.id] = len(self.ids) - 1
+
+    def extend(self, files):
+        """Добавление нескольких файлов"""
+        for file in files:
+            self.append(file)
+
+    def filename_at(self, index: int) -> str:
+        """Имя файла по номеру строки"""
+        return self._names[self._name_offsets[index]:self._name_offsets[index + 1]].decode('utf-8')
+
+    def get(self, message_id: int) -> Optional[FileView]:
+        """Строка по id сообщения (индекс строится при первом обращении)"""
+        if self._index_by_id is None:
+            self._index_by_id = {file_id: index for index, file_id in enumerate(self.ids)}
+        index = self._index_by_id.get(message_id)
+        return FileView(self, index) if index is not None else None
+
+    def sort_key(self, column: str, descending: bool = False):
+        """Функция ключа сортировки строки (по номеру) для колонки каталога
+
+        Числовые колонки сравниваются напрямую, словарные - по алфавитному
+        рангу кода, поэтому отформатированные строки таблицы не нужны.
+        """
+        if column in ('id', 'size', 'date'):
+            values = {'id': self.ids, 'size': self.sizes, 'date': self.timestamps}[column]
+            if descending:
+                return lambda index: -values[index]
+            return values.__getitem__
+
+        if column in ('extension', 'category', 'mime_type'):
+            dictionary, codes = {
+                'extension': (self.extensions, self.extension_codes),
+                'category': (self.categories, self.category_codes),
+                'mime_type': (self.mime_types, self.mime_codes),
+            }[column]
+            ranks = [0] * len(dictionary.values)
+            for rank, code in enumerate(sorted(range(len(dictionary.values)),
+                                               key=lambda c: dictionary.values[c].casefold())):
+                ranks[code] = -rank if descending else rank
+            return lambda index: ranks[codes[index]]
+
+        if column == 'filename':
+            if descending:
+                return lambda index: _Descending(self.filename_at(index).casefold())
+            return lambda index: self.filename_at(index).casefold()
+
+        raise ValueError(f"Неизвестная колонка сортировки: {column}")
+
+    def sort_permutation(self, keys) -> array:
+        """Порядок строк для многоключевой сортировки [(колонка, по убыванию), ...]
+
+        Перестановки кешируются; при добавлении строк новые строки сортируются
+        отдельно и сливаются с уже готовой перестановкой.
+        """
+        keys = tuple(keys)
+        functions = [self.sort_key(column, descending) for column, descending in keys]
+        if len(functions) == 1:
+            key = functions[0]
+        else:
+            key = lambda index: tuple(function(index) for function in functions)
+
+        count = len(self.ids)
+        cached = self._sort_cache.pop(keys, None)
+        if cached is not None and len(cached) == count:
+            permutation = cached
+        elif cached is not None and len(cached) < count:
+            added = sorted(range(len(cached), count), key=key)
+            permutation = array('q', heapq.merge(cached, added, key=key))
+        else:
+            permutation = array('q', sorted(range(count), key=key))
+
+        # Последняя использованная сортировка - в конце словаря
+        self._sort_cache[keys] = permutation
+        while len(self._sort_cache) > SORT_CACHE_SIZE:
+            self._sort_cache.pop(next(iter(self._sort_cache)))
+        return permutation
+
+    @property
+    def total_size(self) -> int:
+        """Суммарный размер файлов"""
+        return sum(self.sizes)
+
+    def memory_usage(self) -> int:
+        """Примерный объём памяти под данные каталога, байт"""
+        columns = (self.ids, self.sizes, self.timestamps, self.extension_codes,
+                   self.category_codes, self.mime_codes, self._name_offsets)
+        return sum(column.itemsize * len(column) for column in columns) + len(self._names)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __bool__(self):
+        return len(self.ids) > 0
+
+    def __getitem__(self, index: int) -> FileView:
+        if index < 0:
+            index += len(self.ids)
+        if not 0 <= index < len(self.ids):
+            raise IndexError(index)
+        return FileView(self, index)
+
+    def __iter__(self):
+        for index in range(len(self.ids)):
+            yield FileView(self, index)
+
+
+@dataclass
+class ScanFilters:
+    """Фильтры сканирования по дате и размеру
+
+    date_to передаётся в историю как offset_date, а по date_from перебор
+    останавливается: история идёт от новых сообщений к старым.
+    """
+    date_from: Optional[datetime] = None
+    date_to: Optional[datetime] = None
+    min_size: Optional[int] = None
+    max_size: Optional[int] = None
+
+    def accepts_size(self, size_bytes: int) -> bool:
+        """Подходит ли размер файла"""
+        if self.min_size is not None and size_bytes < self.min_size:
+            return False
+        if self.max_size is not None and size_bytes > self.max_size:
+            return False
+        return True
+
+    def accepts_date(self, date: datetime) -> bool:
+        """Попадает ли дата в диапазон"""
+        if self.date_from is not None and date < self.date_from:
+            return False
+        if self.date_to is not None and date >= self.date_to:
+            return False
+        return True
+
+
+def parse_date_bound(value: str, end_of_day: bool = False) -> Optional[datetime]:
+    """Граница диапазона дат из строки ГГГГ-ММ-ДД (в локальном часовом поясе)
+
+    Для верхней границы берётся начало следующего дня, чтобы день входил в диапазон.
+    """
+    if not value:
+        return None
+    date = datetime.strptime(value.strip(), '%Y-%m-%d')
+    if end_of_day:
+        date += timedelta(days=1)
+    return date.astimezone()
+
+
+class HistoryReader:
+    """Конвейерное чтение истории чата страницами от новых к старым
+
+    Пока разбирается одна страница, следующие HISTORY_PREFETCH_DEPTH уже
+    запрошены: каждая отсчитывается от последней полученной страницы через
+    add_offset. Размер страницы растёт с первой (маленькой, чтобы быстро
+    показать результат) до предела API и уменьшается на медленных страницах;
+    после FloodWait запросы идут по одному с паузой, которая затем затухает.
+    Настройки живут в объекте и переживают переключение аккаунтов пула.
+    """
+
+    def __init__(self, depth: int = HISTORY_PREFETCH_DEPTH):
+        self.max_depth = max(1, depth)
+        self.depth = self.max_depth
+        self.page_size = HISTORY_PAGE_MIN
+        self.delay = 0.0
+        self.pages = 0
+        self.latency = None  # EMA времени ответа на страницу, с
+
+    def on_flood(self, seconds: int):
+        """FloodWait: без упреждения и с паузой между запросами"""
+        self.depth = 1
+        self.delay = min(HISTORY_MAX_DELAY, max(self.delay * 2, seconds * HISTORY_FLOOD_BACKOFF, 0.5))
+
+    def _on_page(self, elapsed: float):
+        """Подстройка размера страницы и паузы по времени ответа"""
+        self.pages += 1
+        self.latency = elapsed if self.latency is None else 0.8 * self.latency + 0.2 * elapsed
+        if elapsed > HISTORY_SLOW_PAGE:
+            self.page_size = max(HISTORY_PAGE_MIN, self.page_size // 2)
+        else:
+            self.page_size = min(HISTORY_PAGE_MAX, self.page_size * 2)
+        if self.delay:
+            self.delay = self.delay / 2 if self.delay > 0.05 else 0.0
+            if not self.delay:
+                self.depth = self.max_depth
+
+    async def _fetch(self, client, chat, offset_id, offset_date, add_offset, size):
+        started = time.monotonic()
+        messages = await client.get_messages(chat, limit=size, offset_id=offset_id,
+                                             offset_date=offset_date, add_offset=add_offset)
+        return list(messages), time.monotonic() - started
+
+    async def messages(self, client, chat, offset_id: int = 0, offset_date: datetime = None,
+                       limit: int = None):
+        """Сообщения истории подряд, страницы запрашиваются наперёд
+
+        offset_date действует, пока не получена первая страница; дальше чтение
+        идёт по offset_id. Ошибки запросов (в том числе FloodWait) пробрасываются,
+        незавершённые запросы при этом отменяются.
+        """
+        pending = deque()  # (size, task) в порядке истории
+        ahead = 0          # сколько сообщений запрошено дальше offset_id
+        remaining = limit
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(pending) < self.depth and (remaining is None or ahead < remaining):
+                    if pending and self.delay:
+                        break
+                    size = self.page_size if remaining is None else min(self.page_size, remaining - ahead)
+                    date = offset_date if not offset_id else None
+                    pending.append((size, asyncio.ensure_future(
+                        self._fetch(client, chat, offset_id, date, ahead, size))))
+                    ahead += size
+                if not pending:
+                    return
+
+                size, task = pending.popleft()
+                page, elapsed = await task
+                self._on_page(elapsed)
+                ahead -= size
+                if len(page) < size:
+                    exhausted = True
+                    for _, other in pending:
+                        other.cancel()
+                    pending.clear()
+                    ahead = 0
+
+                for message in page:
+                    # Упреждающие страницы могли сместиться из-за удалений - без повторов
+                    if offset_id and message.id >= offset_id:
+                        continue
+                    offset_id = message.id
+                    if remaining is not None:
+                        remaining -= 1
+                    yield message
+                    if remaining == 0:
+                        return
+
+                if self.delay and not exhausted:
+                    await asyncio.sleep(self.delay)
+        finally:
+            for _, task in pending:
+                task.cancel()
+
+
+def format_size(size_bytes: float) -> str:
+    """Человекочитаемый размер"""
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(size_bytes) < 1024:
+            return f"{size_bytes:.1f} {unit}"
+        size_bytes /= 1024
+    return f"{size_bytes:.1f} TB"
+
+
+def format_eta(seconds: Optional[float]) -> str:
+    """Человекочитаемое оставшееся время"""
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{secs:02d}"
+    return f"{minutes:02d}:{secs:02d}"
+
+
+class TransferProgress:
+    """Побайтовый прогресс загрузки: текущие файлы, задача целиком, скорость и ETA.
+
+    Скорость считается по скользящему окну отсчётов и сглаживается EMA.
+    Одновременно может качаться несколько файлов (ключ - id сообщения).
+    Обновляется из потока event loop, читается из GUI/headless через snapshot().
+    """
+
+    def __init__(self, total_bytes: int = 0, total_files: int = 0,
+                 window: float = 5.0, alpha: float = 0.3):
+        self.total_bytes = total_bytes
+        self.total_files = total_files
+        self.window = window
+        self.alpha = alpha
+
+        self.done_bytes = 0
+        self.done_files = 0
+        # key -> [имя файла, получено байт, размер файла]
+        self.active = {}
+
+        self.started_at = time.monotonic()
+        self.speed = 0.0
+        self._samples = deque()
+        self._lock = threading.Lock()
+
+    def start_file(self, file_name: str, file_total: int, key=None):
+        """Начало загрузки очередного файла"""
+        with self._lock:
+            self.active[key] = [file_name, 0, file_total]
+
+    def update_file(self, current: int, total: int = None, key=None):
+        """Callback прогресса от транспорта (current, total)"""
+        with self._lock:
+            entry = self.active.get(key)
+            if entry is None:
+                return
+            if total:
+                entry[2] = total
+            entry[1] = current
+            self._add_sample()
+
+    def finish_file(self, success: bool = True, key=None):
+        """Завершение файла: его байты переходят в общий счётчик"""
+        with self._lock:
+            _, file_bytes, file_total = self.active.pop(key, ('', 0, 0))
+            if success:
+                self.done_bytes += max(file_bytes, file_total)
+            else:
+                # Неудачный файл не должен держать ETA: убираем его из общего объёма
+                self.total_bytes = max(self.total_bytes - file_total, self.done_bytes)
+            self.done_files += 1
+            self._add_sample()
+
+    def _transferred(self) -> int:
+        """Всего получено байт, включая файлы в процессе"""
+        return self.done_bytes + sum(entry[1] for entry in self.active.values())
+
+    def _add_sample(self):
+        """Добавить отсчёт и пересчитать сглаженную скорость"""
+        now = time.monotonic()
+        transferred = self._transferred()
+        self._samples.append((now, transferred))
+        while len(self._samples) > 2 and now - self._samples[0][0] > self.window:
+            self._samples.popleft()
+
+        first_time, first_bytes = self._samples[0]
+        elapsed = now - first_time
+        if elapsed > 0:
+            current_speed = (transferred - first_bytes) / elapsed
+            if self.speed:
+                self.speed = self.alpha * current_speed + (1 - self.alpha) * self.speed
+            else:
+                self.speed = current_speed
+
+    def snapshot(self) -> Dict:
+        """Текущее состояние прогресса в виде словаря"""
+        with self._lock:
+            transferred = self._transferred()
+            remaining = max(self.total_bytes - transferred, 0)
+            eta = remaining / self.speed if self.speed > 0 else None
+            percent = transferred / self.total_bytes * 100 if self.total_bytes else 0.0
+
+            active = [
+                {'file_name': name, 'file_bytes': done, 'file_total': total,
+                 'file_percent': min(done / total * 100, 100.0) if total else 0.0}
+                for name, done, total in self.active.values()
+            ]
+            # Поля file_* описывают последний начатый файл
+            current = active[-1] if active else {'file_name': '', 'file_bytes': 0,
+                                                 'file_total': 0, 'file_percent': 0.0}
+            return {
+                **current,
+                'active': active,
+                'done_files': self.done_files,
+                'total_files': self.total_files,
+                'transferred_bytes': transferred,
+                'total_bytes': self.total_bytes,
+                'percent': min(percent, 100.0),
+                'speed': self.speed,
+                'eta': eta,
+                'elapsed': time.monotonic() - self.started_at,
+            }
+
+
+class StreamHasher:
+    """Потоковое хеширование данных по мере их записи на диск"""
+
+    def __init__(self, algorithms=('sha256',)):
+        self.algorithms = list(algorithms)
+        self.reset()
+
+    def reset(self):
+        """Начать хеширование заново (повторная загрузка файла)"""
+        self.hashers = {}
+        for name in self.algorithms:
+            if name == 'blake3':
+                if blake3 is None:
+                    continue
+                self.hashers[name] = blake3.blake3()
+            else:
+                self.hashers[name] = hashlib.new(name)
+        self.size = 0
+
+    def update(self, data: bytes):
+        """Добавить очередной блок данных"""
+        for hasher in self.hashers.values():
+            hasher.update(data)
+        self.size += len(data)
+
+    def hexdigests(self) -> Dict[str, str]:
+        """Итоговые хеши по алгоритмам"""
+        return {name: hasher.hexdigest() for name, hasher in self.hashers.items()}
+
+
+class AsyncFileWriter:
+    """Стадия записи на диск, отвязанная от сетевого event loop.
+
+    Данные от сети копятся в буфере и уходят крупными выровненными блоками
+    в ограниченную очередь; блоки пишет поток из пула, поэтому медленный диск
+    не останавливает остальные загрузки. Известный размер заранее резервируется
+    через posix_fallocate, файл пишется во временный .part и по завершении
+    синхронизируется (fsync) и атомарно переименовывается.
+    """
+
+    def __init__(self, final_path: str, executor, size: int = None, hasher: StreamHasher = None,
+                 block_size: int = WRITE_BLOCK_SIZE, max_pending: int = WRITE_QUEUE_BLOCKS):
+        self.final_path = final_path
+        self.temp_path = final_path + '.part'
+        self.executor = executor
+        self.size = size
+        self.hasher = hasher
+        self.block_size = block_size
+        self.written = 0
+
+        self._buffer = bytearray()
+        self._queue = asyncio.Queue(maxsize=max_pending)
+        self._file = None
+        self._consumer = None
+        self._inflight = None  # блок, который сейчас пишет поток
+
+    async def open(self):
+        """Подготовка файла в потоке записи"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self._open_sync)
+        self._consumer = asyncio.ensure_future(self._consume())
+
+    def _open_sync(self):
+        os.makedirs(os.path.dirname(self.final_path) or '.', exist_ok=True)
+        self._file = open(self.temp_path, 'wb')
+        if self.size and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(self._file.fileno(), 0, self.size)
+            except OSError:
+                # Файловая система может не поддерживать резервирование
+                pass
+
+    async def write(self, data: bytes):
+        """Приём очередного блока от сети (Telethon дожидается корутины)"""
+        self._buffer += data
+        if len(self._buffer) >= self.block_size:
+            cut = len(self._buffer) - len(self._buffer) % self.block_size
+            block = bytes(self._buffer[:cut])
+            del self._buffer[:cut]
+            await self._put(block)
+
+    async def _put(self, item):
+        """Передача блока потоку записи; ошибка записи (ENOSPC, EIO) всплывает здесь,
+        а не оставляет загрузку навсегда ждать места в очереди"""
+        if self._consumer.done():
+            self._consumer.result()
+            raise OSError(f"Запись {self.temp_path} уже остановлена")
+        if not self._queue.full():
+            self._queue.put_nowait(item)
+            return
+        put = asyncio.ensure_future(self._queue.put(item))
+        try:
+            await asyncio.wait({put, self._consumer}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            if not put.done():
+                put.cancel()
+        if put.done() and not put.cancelled():
+            return
+        self._consumer.result()
+        raise OSError(f"Запись {self.temp_path} уже остановлена")
+
+    def flush(self):
+        """Сброс выполняется в close(); метод нужен для совместимости с файлом"""
+
+    async def _consume(self):
+        while True:
+            block = await self._queue.get()
+            if block is None:
+                break
+            self._inflight = self.executor.submit(self._write_sync, block)
+            await asyncio.wrap_future(self._inflight)
+
+    def _write_sync(self, block: bytes):
+        if self.hasher:
+            self.hasher.update(block)
+        self._file.write(block)
+        self.written += len(block)
+
+    async def close(self):
+        """Дописать остаток, синхронизировать и переименовать файл"""
+        if self._buffer:
+            await self._put(bytes(self._buffer))
+            self._buffer = bytearray()
+        await self._put(None)
+        await self._consumer
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self._finish_sync)
+
+    def _finish_sync(self):
+        # Зарезервированное место сверх фактического размера отрезаем
+        self._file.truncate(self.written)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self.temp_path, self.final_path)
+
+    async def abort(self):
+        """Прервать запись и удалить временный файл"""
+        if self._consumer:
+            self._consumer.cancel()
+            try:
+                await self._consumer
+            except (asyncio.CancelledError, Exception):
+                pass
+        # Отмена consumer не останавливает блок, который поток уже пишет: ждём его,
+        # иначе файл закроется посреди записи
+        if self._inflight is not None and not self._inflight.done():
+            try:
+                await asyncio.wrap_future(self._inflight)
+            except (asyncio.CancelledError, Exception):
+                pass
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self._abort_sync)
+
+    def _abort_sync(self):
+        if self._file:
+            self._file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+class ManifestWriter:
+    """Манифест задачи загрузки (JSONL): одна строка на скачанный файл"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def add(self, entry: Dict):
+        """Дописать запись о файле"""
+        line = json.dumps(entry, ensure_ascii=False) + '\n'
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line)
+
+
+def verify_manifest(manifest_path: str, workers: int = None) -> List[Dict]:
+    """Параллельная проверка файлов по манифесту: наличие, размер и хеш"""
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+
+    def check(entry):
+        path = entry['output_path']
+        if not os.path.isabs(path):
+            path = os.path.join(base_dir, path)
+        if not os.path.exists(path):
+            return {**entry, 'status': 'missing'}
+        if os.path.getsize(path) != entry['size']:
+            return {**entry, 'status': 'size_mismatch'}
+
+        # BLAKE3 заметно быстрее, если он есть и в манифесте, и в окружении
+        algorithm = 'blake3' if entry.get('blake3') and blake3 is not None else 'sha256'
+        if not entry.get(algorithm):
+            return {**entry, 'status': 'ok'}
+
+        hasher = StreamHasher([algorithm])
+        with open(path, 'rb') as data:
+            for block in iter(lambda: data.read(1024 * 1024), b''):
+                hasher.update(block)
+        status = 'ok' if hasher.hexdigests()[algorithm] == entry[algorithm] else 'hash_mismatch'
+        return {**entry, 'status': status}
+
+    workers = workers or min(32, (os.cpu_count() or 1) * 2)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(check, entries))
+
+
+class TarShardWriter:
+    """Упаковка скачанных файлов в tar-шарды ограниченного размера
+
+    Вместо миллионов мелких файлов в папке SHARD_DIR растут shard-NNNNN.tar
+    (новый шард открывается, когда текущий превысил бы max_bytes) и индекс
+    index.jsonl: по id сообщения - шард, смещение данных, размер и хеши. Члены
+    архива пишутся целиком под блокировкой, поэтому параллельные загрузки не
+    перемешиваются; по индексу любой файл читается одним seek (read_shard_member).
+    Продолжение задачи открывает новый шард, не трогая готовые.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = SHARD_MAX_BYTES, chat_id: int = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.chat_id = chat_id
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        existing = [int(name[6:11]) for name in os.listdir(directory)
+                    if re.fullmatch(r'shard-\d{5}\.tar', name)]
+        self._number = max(existing, default=-1)
+        self._shard = None
+        self._index = open(os.path.join(directory, SHARD_INDEX), 'a', encoding='utf-8')
+
+        self.files = 0
+        self.bytes = 0
+        self.shards = 0
+        self.append_seconds = 0.0
+
+    def _roll(self):
+        """Закрыть текущий шард и открыть следующий"""
+        self._close_shard()
+        self._number += 1
+        self._shard = open(os.path.join(self.directory, f"shard-{self._number:05d}.tar"), 'wb')
+        self.shards += 1
+
+    def _close_shard(self):
+        if self._shard is None:
+            return
+        # Конец архива - два нулевых блока
+        self._shard.write(b'\0' * (2 * tarfile.BLOCKSIZE))
+        self._shard.flush()
+        os.fsync(self._shard.fileno())
+        self._shard.close()
+        self._shard = None
+
+    def add(self, name: str, source, size: int, message_id: int, digests: Dict = None) -> Dict:
+        """Дописать член архива из файлового объекта source (с начала) и запись индекса"""
+        started = time.monotonic()
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        header = info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+        padding = -size % tarfile.BLOCKSIZE
+
+        with self._lock:
+            if self._shard is None or (self._shard.tell() and
+                                       self._shard.tell() + len(header) + size > self.max_bytes):
+                self._roll()
+            self._shard.write(header)
+            offset = self._shard.tell()
+            source.seek(0)
+            shutil.copyfileobj(source, self._shard, WRITE_BLOCK_SIZE)
+            self._shard.write(b'\0' * padding)
+            self._shard.flush()
+
+            entry = {
+                'message_id': message_id,
+                'chat': self.chat_id,
+                'name': name,
+                'shard': os.path.basename(self._shard.name),
+                'offset': offset,
+                'size': size,
+                **(digests or {}),
+                'timestamp': datetime.now().isoformat(),
+            }
+            # Запись индекса - после данных: упоминание в индексе значит, что данные на месте
+            self._index.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            self._index.flush()
+            self.files += 1
+            self.bytes += size
+            self.append_seconds += time.monotonic() - started
+        return entry
+
+    def close(self) -> Dict:
+        """Закрыть шард и индекс; отчёт о сэкономленных файловых операциях"""
+        with self._lock:
+            self._close_shard()
+            os.fsync(self._index.fileno())
+            self._index.close()
+        report = {'files': self.files, 'bytes': self.bytes, 'shards': self.shards,
+                  'append_seconds': self.append_seconds}
+        if self.files:
+            per_file = measure_file_overhead(self.directory)
+            report.update({
+                'inodes_saved': max(0, self.files - self.shards),
+                'per_file_overhead': per_file,
+                'seconds_saved': max(0.0, self.files * per_file - self.append_seconds),
+            })
+        return report
+
+
+class ShardMemberWriter(AsyncFileWriter):
+    """AsyncFileWriter, который вместо отдельного файла дописывает член tar-шарда
+
+    Данные копятся во временном файле в памяти (на диск - только сверх
+    SHARD_SPOOL_BYTES) и попадают в шард одним куском при закрытии.
+    """
+
+    def __init__(self, shards: TarShardWriter, name: str, message_id: int, executor,
+                 size: int = None, hasher: StreamHasher = None):
+        super().__init__(name, executor, size=size, hasher=hasher)
+        self.shards = shards
+        self.message_id = message_id
+        self.entry = None
+
+    def _open_sync(self):
+        self._file = tempfile.SpooledTemporaryFile(max_size=SHARD_SPOOL_BYTES)
+
+    def _finish_sync(self):
+        digests = self.hasher.hexdigests() if self.hasher else None
+        self.entry = self.shards.add(self.final_path, self._file, self.written, self.message_id, digests)
+        self._file.close()
+
+    def _abort_sync(self):
+        if self._file:
+            self._file.close()
+
+
+def shard_member_name(file_info: Dict, options: Dict) -> str:
+    """Имя файла внутри шарда: подпапка категории и id сообщения для уникальности"""
+    filename = f"{file_info['id']}_{options.get('prefix', '')}{file_info['filename']}"
+    extension = file_info.get('extension')
+    if options.get('create_subfolders', True) and extension:
+        return f"{EXTENSION_CATEGORIES.get(extension, 'Другие')}/{filename}"
+    return filename
+
+
+def measure_file_overhead(directory: str, samples: int = SHARD_PROBE_FILES) -> float:
+    """Цена одного отдельного файла на этой файловой системе, с
+
+    Повторяет то, что режим отдельных файлов делает на каждый файл: makedirs,
+    exists, .part-файл с fsync и переименование (и удаление пробы).
+    """
+    probe_dir = os.path.join(directory, '.probe')
+    started = time.perf_counter()
+    for i in range(samples):
+        os.makedirs(probe_dir, exist_ok=True)
+        path = os.path.join(probe_dir, f"probe_{i}")
+        os.path.exists(path)
+        with open(path + '.part', 'wb') as f:
+            f.write(b'\0')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.part', path)
+    elapsed = time.perf_counter() - started
+    shutil.rmtree(probe_dir, ignore_errors=True)
+    return elapsed / samples
+
+
+def read_shard_index(directory: str) -> Dict[int, Dict]:
+    """Индекс шардов: id сообщения -> последняя запись о нём"""
+    entries = {}
+    with open(os.path.join(directory, SHARD_INDEX), 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                entries[entry['message_id']] = entry
+    return entries
+
+
+def read_shard_member(directory: str, entry: Dict) -> bytes:
+    """Содержимое файла из шарда по записи индекса (без чтения остального архива)"""
+    with open(os.path.join(directory, entry['shard']), 'rb') as f:
+        f.seek(entry['offset'])
+        return f.read(entry['size'])
+
+
+def extract_from_shards(directory: str, output_dir: str, message_ids=None) -> List[str]:
+    """Извлечение файлов из шардов по id сообщений (None - все) с сохранением подпапок"""
+    index = read_shard_index(directory)
+    ids = index.keys() if message_ids is None else [i for i in message_ids if i in index]
+    extracted = []
+    for message_id in ids:
+        entry = index[message_id]
+        target = os.path.normpath(os.path.join(output_dir, entry['name']))
+        if not target.startswith(os.path.normpath(output_dir) + os.sep):
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(os.path.join(directory, entry['shard']), 'rb') as src, open(target, 'wb') as dst:
+            src.seek(entry['offset'])
+            remaining = entry['size']
+            while remaining:
+                block = src.read(min(WRITE_BLOCK_SIZE, remaining))
+                if not block:
+                    raise IOError(f"Шард {entry['shard']} обрезан на файле {entry['name']}")
+                dst.write(block)
+                remaining -= len(block)
+        extracted.append(target)
+    return extracted
+
+
+def _strip_archive_suffix(filename: str) -> str:
+    """Имя файла без расширения архива (.tar.gz снимается целиком)"""
+    lower = filename.lower()
+    for suffix in TAR_SUFFIXES + ('.zip', '.gz', '.bz2', '.xz'):
+        if lower.endswith(suffix):
+            return filename[:-len(suffix)]
+    return os.path.splitext(filename)[0]
+
+
+def postprocess_output_dir(file_path: str, download_path: str, layout: str) -> str:
+    """Папка для результатов постобработки файла в заданной раскладке"""
+    folder, filename = os.path.split(file_path)
+    if layout == 'beside':
+        return folder
+    if layout == 'separate':
+        relative = os.path.relpath(folder, download_path)
+        return os.path.normpath(os.path.join(download_path, POSTPROCESS_SEPARATE_DIR, relative,
+                                             _strip_archive_suffix(filename)))
+    return os.path.join(folder, _strip_archive_suffix(filename))
+
+
+def extract_archive(file_path: str, output_dir: str) -> List[str]:
+    """Распаковка ZIP или TAR (в том числе .tar.gz/.bz2/.xz) с защитой от выхода за output_dir"""
+    root = os.path.realpath(output_dir)
+
+    # Папка создаётся только после того, как архив успешно открылся
+    if file_path.lower().endswith('.zip'):
+        with zipfile.ZipFile(file_path) as archive:
+            os.makedirs(output_dir, exist_ok=True)
+            names = [info.filename for info in archive.infolist() if not info.is_dir()]
+            # zipfile сам отбрасывает абсолютные пути и ".."
+            archive.extractall(output_dir)
+    else:
+        with tarfile.open(file_path) as archive:
+            os.makedirs(output_dir, exist_ok=True)
+            members = []
+            for member in archive.getmembers():
+                target = os.path.realpath(os.path.join(output_dir, member.name))
+                if os.path.commonpath([root, target]) != root or member.issym() or member.islnk():
+                    continue
+                if member.isfile() or member.isdir():
+                    members.append(member)
+            if hasattr(tarfile, 'data_filter'):
+                archive.extractall(output_dir, members=members, filter='data')
+            else:
+                archive.extractall(output_dir, members=members)
+            names = [member.name for member in members if member.isfile()]
+
+    return [os.path.join(output_dir, name) for name in names]
+
+
+def decompress_file(file_path: str, output_dir: str) -> List[str]:
+    """Распаковка одиночного .gz/.bz2/.xz файла потоком, без чтения целиком в память"""
+    openers = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+    opener = openers[os.path.splitext(file_path)[1].lower()]
+
+    os.makedirs(output_dir, exist_ok=True)
+    target = os.path.join(output_dir, _strip_archive_suffix(os.path.basename(file_path)))
+    temp_path = target + '.part'
+    with opener(file_path, 'rb') as source, open(temp_path, 'wb') as output:
+        shutil.copyfileobj(source, output, WRITE_BLOCK_SIZE)
+    os.replace(temp_path, target)
+    return [target]
+
+
+def run_command_hook(file_path: str, output_dir: str, command: str) -> List[str]:
+    """Пользовательская команда для файла: {path} и {dir} подставляются в аргументы
+
+    Команда запускается без shell, поэтому имя файла из чата не может
+    превратиться в лишние аргументы или команды.
+    """
+    args = [part.format(path=file_path, dir=output_dir) for part in shlex.split(command)]
+    completed = subprocess.run(args, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"код {completed.returncode}: {(completed.stderr or '').strip()[:200]}")
+    return []
+
+
+# Встроенные шаги: имя -> (подходит ли файл, обработчик(путь, папка) -> созданные файлы)
+POSTPROCESS_STEPS = {
+    'extract': (lambda name: name.endswith(TAR_SUFFIXES + ('.zip',)), extract_archive),
+    'decompress': (lambda name: name.endswith(('.gz', '.bz2', '.xz')) and not name.endswith(TAR_SUFFIXES),
+                   decompress_file),
+}
+
+
+def run_postprocess(file_path: str, download_path: str, steps: List[str], layout: str = 'subfolder',
+                    delete_source: bool = False, command: str = None, hooks=()) -> Dict:
+    """Постобработка одного файла (выполняется в процессе пула)
+
+    steps - имена встроенных шагов из POSTPROCESS_STEPS; hooks - функции
+    hook(file_path, output_dir) -> список файлов уровня модуля (их можно передать
+    в другой процесс); command - внешняя команда, см. run_command_hook.
+    """
+    result = {'source': file_path, 'steps': [], 'outputs': [], 'error': None}
+    name = file_path.lower()
+    try:
+        handled = False
+        # Пользовательские шаги получают папку встроенного шага, иначе - папку файла
+        output_dir = os.path.dirname(file_path)
+        for step in steps:
+            matches, handler = POSTPROCESS_STEPS[step]
+            if matches(name):
+                # Одиночный сжатый файл раскладывать в отдельную папку незачем
+                step_layout = 'beside' if step == 'decompress' and layout == 'subfolder' else layout
+                output_dir = postprocess_output_dir(file_path, download_path, step_layout)
+                result['outputs'] += handler(file_path, output_dir)
+                result['steps'].append(step)
+                handled = True
+                break
+
+        for hook in hooks:
+            result['outputs'] += hook(file_path, output_dir) or []
+            result['steps'].append(getattr(hook, '__name__', 'hook'))
+        if command:
+            result['outputs'] += run_command_hook(file_path, output_dir, command)
+            result['steps'].append('command')
+
+        if handled and delete_source:
+            os.remove(file_path)
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    return result
+
+
+class PostProcessor:
+    """Стадия постобработки скачанных файлов в пуле процессов
+
+    Распаковка и пользовательские шаги идут в отдельных процессах и не держат
+    GIL event loop, поэтому сеть продолжает качать. Очередь ограничена
+    max_pending: когда она заполнена, submit() ждёт, и загрузка притормаживает,
+    а не копит необработанные файлы.
+    on_result(result) вызывается в event loop по завершении каждого файла.
+    keep_source - исходник нельзя удалять: он записан в манифест с хешами,
+    и --verify считал бы его пропавшим.
+    """
+
+    def __init__(self, settings: Dict, download_path: str, on_result=None, hooks=(),
+                 workers: int = POSTPROCESS_WORKERS, max_pending: int = POSTPROCESS_MAX_PENDING,
+                 keep_source: bool = False):
+        self.steps = [step for step in settings.get('steps', []) if step in POSTPROCESS_STEPS]
+        self.layout = settings.get('layout', 'subfolder')
+        self.delete_source = settings.get('delete_source', False) and not keep_source
+        if settings.get('delete_source') and keep_source:
+            print("Удаление исходников после распаковки отключено: файлы проверяются по манифесту")
+        self.command = settings.get('command') or None
+        self.hooks = tuple(hooks)
+        self.download_path = download_path
+        self.on_result = on_result
+        self.workers = workers
+        self._slots = asyncio.Semaphore(max_pending)
+        self._executor = None
+        self._tasks = set()
+        self.results: List[Dict] = []
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.steps or self.command or self.hooks)
+
+    async def submit(self, file_path: str):
+        """Постановка файла в обработку (ждёт свободного места в очереди)"""
+        if not self.enabled:
+            return
+        await self._slots.acquire()
+        if self._executor is None:
+            # spawn, а не fork: форк процесса с Tk, потоком event loop и пулом ввода-вывода
+            # наследует их блокировки; воркерам нужны только переданные аргументы
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+        future = asyncio.get_running_loop().run_in_executor(
+            self._executor, run_postprocess, file_path, self.download_path, self.steps,
+            self.layout, self.delete_source, self.command, self.hooks
+        )
+        task = asyncio.ensure_future(self._collect(future))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _collect(self, future):
+        try:
+            result = await future
+        except Exception as e:
+            # Например, упавший процесс пула
+            result = {'source': None, 'steps': [], 'outputs': [], 'error': str(e)}
+        finally:
+            self._slots.release()
+        self.results.append(result)
+        if self.on_result:
+            self.on_result(result)
+
+    def shutdown(self):
+        """Остановка без ожидания: необработанные файлы из очереди пула отбрасываются"""
+        for task in list(self._tasks):
+            task.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def drain(self) -> List[Dict]:
+        """Ожидание всех поставленных файлов и остановка пула процессов"""
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        return self.results
+
+
+async def read_zip_directory(tail: bytes, tail_offset: int, fetch) -> List[Dict]:
+    """Разбор центрального каталога ZIP по хвосту файла
+
+    tail - последние байты архива, начинающиеся со смещения tail_offset;
+    fetch(offset, length) - корутина для дочитывания недостающих диапазонов.
+    """
+    eocd_pos = tail.rfind(b'PK\x05\x06')
+    if eocd_pos < 0 or len(tail) - eocd_pos < 22:
+        raise ValueError("не найдена запись конца центрального каталога (не ZIP?)")
+
+    _, _, _, _, entries, cd_size, cd_offset, _ = struct.unpack_from('<4sHHHHIIH', tail, eocd_pos)
+
+    # ZIP64: настоящие значения лежат в отдельной записи, на которую указывает локатор
+    if cd_offset == 0xFFFFFFFF or cd_size == 0xFFFFFFFF or entries == 0xFFFF:
+        locator_pos = eocd_pos - 20
+        if locator_pos < 0 or tail[locator_pos:locator_pos + 4] != b'PK\x06\x07':
+            raise ValueError("повреждён локатор ZIP64")
+        _, _, zip64_offset, _ = struct.unpack_from('<4sIQI', tail, locator_pos)
+        if zip64_offset >= tail_offset:
+            record = tail[zip64_offset - tail_offset:zip64_offset - tail_offset + 56]
+        else:
+            record = await fetch(zip64_offset, 56)
+        if record[:4] != b'PK\x06\x06':
+            raise ValueError("повреждена запись ZIP64")
+        entries, cd_size, cd_offset = struct.unpack_from('<QQQ', record, 32)
+
+    if cd_offset >= tail_offset:
+        directory = tail[cd_offset - tail_offset:cd_offset - tail_offset + cd_size]
+    else:
+        directory = await fetch(cd_offset, cd_size)
+
+    members = []
+    pos = 0
+    while pos + 46 <= len(directory) and len(members) < entries:
+        (signature, _, _, flags, method, _, _, crc, compressed, uncompressed,
+         name_len, extra_len, comment_len, _, _, _, local_offset) = struct.unpack_from(
+            '<4sHHHHHHIIIHHHHHII', directory, pos)
+        if signature != b'PK\x01\x02':
+            raise ValueError("повреждён центральный каталог")
+
+        raw_name = directory[pos + 46:pos + 46 + name_len]
+        # Бит 11 - имя в UTF-8, иначе исторически CP437
+        name = raw_name.decode('utf-8' if flags & 0x800 else 'cp437', errors='replace')
+
+        # Размеры больше 4 ГБ хранятся в дополнительном поле ZIP64
+        extra = directory[pos + 46 + name_len:pos + 46 + name_len + extra_len]
+        extra_pos = 0
+        while extra_pos + 4 <= len(extra):
+            header_id, data_size = struct.unpack_from('<HH', extra, extra_pos)
+            if header_id == 0x0001:
+                values = iter(struct.unpack_from(f'<{data_size // 8}Q', extra, extra_pos + 4))
+                if uncompressed == 0xFFFFFFFF:
+                    uncompressed = next(values, uncompressed)
+                if compressed == 0xFFFFFFFF:
+                    compressed = next(values, compressed)
+                if local_offset == 0xFFFFFFFF:
+                    local_offset = next(values, local_offset)
+                break
+            extra_pos += 4 + data_size
+
+        members.append({
+            'name': name,
+            'size': uncompressed,
+            'compressed_size': compressed,
+            'is_dir': name.endswith('/'),
+            'method': method,
+            'crc': crc,
+            'offset': local_offset,
+        })
+        pos += 46 + name_len + extra_len + comment_len
+
+    return members
+
+
+class ArchiveIndex:
+    """Кеш оглавлений архивов (SQLite) с поиском по именам вложенных файлов"""
+
+    def __init__(self, db_path: str = 'tg_downloader_archives.db'):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS archives (
+                document_id INTEGER PRIMARY KEY,
+                chat_id INTEGER,
+                message_id INTEGER,
+                name TEXT,
+                size INTEGER,
+                fetched_bytes INTEGER,
+                indexed_at TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_archives_message ON archives (chat_id, message_id);
+            CREATE TABLE IF NOT EXISTS archive_members (
+                document_id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                size INTEGER,
+                compressed_size INTEGER,
+                is_dir INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS idx_members_document ON archive_members (document_id);
+        ''')
+        self.conn.commit()
+
+    def store(self, listing: Dict):
+        """Сохранение оглавления архива"""
+        with self._lock:
+            self.conn.execute('DELETE FROM archive_members WHERE document_id = ?', (listing['document_id'],))
+            self.conn.execute(
+                'INSERT OR REPLACE INTO archives VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (listing['document_id'], listing['chat_id'], listing['message_id'], listing['name'],
+                 listing['size'], listing['fetched_bytes'], datetime.now().isoformat())
+            )
+            self.conn.executemany(
+                'INSERT INTO archive_members VALUES (?, ?, ?, ?, ?)',
+                [(listing['document_id'], m['name'], m['size'], m['compressed_size'], int(m['is_dir']))
+                 for m in listing['members']]
+            )
+            self.conn.commit()
+
+    def get(self, chat_id: int, message_id: int) -> Optional[Dict]:
+        """Оглавление из кеша по сообщению"""
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT document_id, name, size, fetched_bytes FROM archives WHERE chat_id = ? AND message_id = ?',
+                (chat_id, message_id)
+            ).fetchone()
+            if not row:
+                return None
+            members = self.conn.execute(
+                'SELECT name, size, compressed_size, is_dir FROM archive_members WHERE document_id = ? ORDER BY rowid',
+                (row[0],)
+            ).fetchall()
+        return {
+            'document_id': row[0], 'chat_id': chat_id, 'message_id': message_id,
+            'name': row[1], 'size': row[2], 'fetched_bytes': row[3], 'cached': True,
+            'members': [{'name': n, 'size': s, 'compressed_size': c, 'is_dir': bool(d)} for n, s, c, d in members],
+        }
+
+    def search(self, query: str, limit: int = 1000) -> List[Dict]:
+        """Поиск вложенных файлов по подстроке имени во всех проиндексированных архивах"""
+        pattern = '%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT a.chat_id, a.message_id, a.name, m.name, m.size FROM archive_members m "
+                "JOIN archives a ON a.document_id = m.document_id "
+                "WHERE m.name LIKE ? ESCAPE '\\' AND m.is_dir = 0 LIMIT ?",
+                (pattern, limit)
+            ).fetchall()
+        return [
+            {'chat_id': r[0], 'message_id': r[1], 'archive': r[2], 'name': r[3], 'size': r[4]}
+            for r in rows
+        ]
+
+
+class ThumbnailCache:
+    """Дисковый LRU-кеш миниатюр документов (ключ - id документа)"""
+
+    def __init__(self, directory: str = THUMB_CACHE_DIR, max_bytes: int = THUMB_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, document_id: int) -> str:
+        """Путь миниатюры в кеше"""
+        return os.path.join(self.directory, f"{document_id}.jpg")
+
+    def get(self, document_id: int) -> Optional[str]:
+        """Миниатюра из кеша (с обновлением времени доступа для LRU)"""
+        path = self.path(document_id)
+        if os.path.exists(path):
+            os.utime(path)
+            return path
+        return None
+
+    def put(self, document_id: int, data: bytes) -> str:
+        """Сохранение миниатюры"""
+        path = self.path(document_id)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def trim(self):
+        """Удаление давно не использованных миниатюр сверх лимита"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+
+EXPORT_FORMATS = ('csv', 'jsonl', 'parquet')
+EXPORT_COLUMNS = ('message_id', 'chat_id', 'filename', 'size_bytes', 'date',
+                  'mime_type', 'extension', 'category')
+
+
+def export_catalog(files, path: str, fmt: str = None, chat_id: int = None,
+                   chunk_size: int = EXPORT_CHUNK_SIZE) -> int:
+    """Потоковая выгрузка каталога файлов в CSV, JSONL или Parquet
+
+    files - любой итерируемый набор FileInfo; данные пишутся порциями по
+    chunk_size строк, так что память не зависит от размера каталога.
+    Возвращает количество выгруженных строк.
+    """
+    fmt = (fmt or os.path.splitext(path)[1].lstrip('.')).lower()
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат экспорта: {fmt}")
+    if fmt == 'parquet' and pa is None:
+        raise ValueError("Для экспорта в Parquet установите pyarrow")
+
+    def rows(chunk):
+        for file in chunk:
+            yield (file.id, chat_id, file.filename, file.size_bytes, file.date.isoformat(),
+                   file.mime_type, file.extension, file.category)
+
+    def chunks():
+        chunk = []
+        for file in files:
+            chunk.append(file)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    count = 0
+    if fmt == 'csv':
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(EXPORT_COLUMNS)
+            for chunk in chunks():
+                writer.writerows(rows(chunk))
+                count += len(chunk)
+
+    elif fmt == 'jsonl':
+        # Строка собирается по шаблону: json.dumps на каждую запись в разы медленнее
+        encode = json.JSONEncoder(ensure_ascii=False).encode
+        chat = encode(chat_id)
+        with open(path, 'w', encoding='utf-8') as f:
+            for chunk in chunks():
+                f.write(''.join(
+                    f'{{"message_id": {file.id}, "chat_id": {chat}, "filename": {encode(file.filename)}, '
+                    f'"size_bytes": {file.size_bytes}, "date": "{file.date.isoformat()}", '
+                    f'"mime_type": {encode(file.mime_type)}, "extension": {encode(file.extension)}, '
+                    f'"category": {encode(file.category)}}}\n'
+                    for file in chunk
+                ))
+                count += len(chunk)
+
+    else:
+        schema = pa.schema([
+            ('message_id', pa.int64()), ('chat_id', pa.int64()), ('filename', pa.string()),
+            ('size_bytes', pa.int64()), ('date', pa.timestamp('us', tz='UTC')),
+            ('mime_type', pa.string()), ('extension', pa.dictionary(pa.int32(), pa.string())),
+            ('category', pa.dictionary(pa.int32(), pa.string())),
+        ])
+        with pq.ParquetWriter(path, schema) as writer:
+            for chunk in chunks():
+                columns = {
+                    'message_id': [file.id for file in chunk],
+                    'chat_id': [chat_id] * len(chunk),
+                    'filename': [file.filename for file in chunk],
+                    'size_bytes': [file.size_bytes for file in chunk],
+                    'date': [file.date for file in chunk],
+                    'mime_type': [file.mime_type for file in chunk],
+                    'extension': [file.extension for file in chunk],
+                    'category': [file.category for file in chunk],
+                }
+                writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+                count += len(chunk)
+
+    return count
+
+
+def resolve_output_path(file_info: Dict, download_path: str, options: Dict, reserved_paths=()) -> str:
+    """Путь сохранения файла с учётом префикса, подпапок и перезаписи"""
+    prefix = options.get('prefix', '')
+    extension = file_info.get('extension')
+
+    # Создаем имя файла с префиксом
+    filename = f"{prefix}{file_info['filename']}" if prefix else file_info['filename']
+
+    # Определяем путь для сохранения
+    if options.get('create_subfolders', True) and extension:
+        category = EXTENSION_CATEGORIES.get(extension, 'Другие')
+        category_path = os.path.join(download_path, category)
+        os.makedirs(category_path, exist_ok=True)
+        file_path = os.path.join(category_path, filename)
+    else:
+        file_path = os.path.join(download_path, filename)
+
+    # Проверяем существование файла
+    # (reserved_paths - пути файлов, которые уже качаются параллельно)
+    if (os.path.exists(file_path) and not options.get('overwrite', False)) or file_path in reserved_paths:
+        # Добавляем номер к имени файла
+        base, ext = os.path.splitext(file_path)
+        counter = 1
+        while os.path.exists(f"{base}_{counter}{ext}") or f"{base}_{counter}{ext}" in reserved_paths:
+            counter += 1
+        file_path = f"{base}_{counter}{ext}"
+
+    return file_path
+
+
+# ========== EVENT LOOP И КРИПТОГРАФИЯ ==========
+
+def create_event_loop(backend: str = 'auto'):
+    """Новый event loop выбранной реализации: (loop, имя реализации)
+
+    'auto' берёт uvloop, если он установлен; 'asyncio' - всегда стандартный цикл.
+    """
+    if backend in ('auto', 'uvloop') and uvloop is not None:
+        return uvloop.new_event_loop(), 'uvloop'
+    if backend == 'uvloop':
+        print("uvloop не установлен, используется стандартный asyncio")
+    return asyncio.new_event_loop(), 'asyncio'
+
+
+def run_with_loop(coro, backend: str = 'auto'):
+    """Аналог asyncio.run() с выбором реализации event loop
+
+    По Ctrl+C корутина отменяется и успевает выполнить свои finally.
+    """
+    loop, name = create_event_loop(backend)
+    print(f"Event loop: {name}, расшифровка MTProto: {detect_crypto_backend()}")
+    asyncio.set_event_loop(loop)
+    task = loop.create_task(coro)
+    try:
+        return loop.run_until_complete(task)
+    except KeyboardInterrupt:
+        task.cancel()
+        loop.run_until_complete(asyncio.gather(task, return_exceptions=True))
+        return 130
+    finally:
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def detect_crypto_backend() -> str:
+    """Реализация AES-IGE, которую использует Telethon для расшифровки MTProto"""
+    if cryptg is not None:
+        return 'cryptg'
+    try:
+        from telethon.crypto import libssl
+        if getattr(libssl, 'decrypt_ige', None):
+            return 'libssl'
+    except ImportError:
+        pass
+    return 'python'
+
+
+async def benchmark_event_loop(iterations: int = BENCH_LOOP_ITERATIONS) -> Dict[str, float]:
+    """Накладные расходы цикла: переключение задачи и запуск короткой задачи, мкс"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await asyncio.sleep(0)
+    switch_us = (time.perf_counter() - start) / iterations * 1e6
+
+    async def noop():
+        pass
+
+    start = time.perf_counter()
+    await asyncio.gather(*(noop() for _ in range(iterations)))
+    task_us = (time.perf_counter() - start) / iterations * 1e6
+    return {'switch_us': switch_us, 'task_us': task_us}
+
+
+def benchmark_decryption(min_seconds: float = BENCH_DECRYPT_MIN_SECONDS) -> Optional[float]:
+    """Скорость расшифровки AES-IGE через Telethon, МБ/с (None - Telethon без модуля crypto)"""
+    try:
+        from telethon.crypto import AES
+    except ImportError:
+        return None
+
+    key, iv = os.urandom(32), os.urandom(32)
+    # Чистый Python расшифровывает ~1 МБ/с, поэтому объём растёт, пока замер не станет заметным
+    size = 64 * 1024
+    while True:
+        data = os.urandom(size)
+        start = time.perf_counter()
+        AES.decrypt_ige(data, key, iv)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds or size >= 64 * 1024 * 1024:
+            return size / elapsed / (1024 * 1024)
+        size *= 4
+
+
+class LoopMonitor:
+    """Здоровье event loop: задержка планирования и блокирующие вызовы
+
+    Задача в цикле каждые LOOP_MONITOR_INTERVAL засыпает и меряет, насколько позже
+    срока проснулась - это задержка, которую видит любой колбэк (перцентили по
+    последним LOOP_LAG_SAMPLES замерам). Сторожевой поток следит за её отметками:
+    если цикл не отвечает дольше LOOP_SLOW_CALLBACK, снимает стек потока цикла
+    прямо во время блокировки и сообщает через on_stall(секунды, стек).
+    """
+
+    def __init__(self, interval: float = LOOP_MONITOR_INTERVAL, threshold: float = LOOP_SLOW_CALLBACK,
+                 on_stall=None):
+        self.interval = interval
+        self.threshold = threshold
+        self.on_stall = on_stall
+        self.lags = deque(maxlen=LOOP_LAG_SAMPLES)
+        self.stalls = deque(maxlen=LOOP_STALLS_KEPT)  # {'at', 'duration', 'stack'}
+        self.slow_count = 0
+        self.max_lag = 0.0
+        self._beat = time.monotonic()
+        self._reported = None
+        self._thread_id = None
+        self._task = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self, loop):
+        """Запуск замеров в loop (из любого потока) и сторожевого потока"""
+        self._stop.clear()
+        loop.call_soon_threadsafe(self._start_ticker)
+        threading.Thread(target=self._watch, daemon=True).start()
+
+    def _start_ticker(self):
+        self._task = asyncio.ensure_future(self._tick())
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.get_loop().call_soon_threadsafe(self._task.cancel)
+
+    async def _tick(self):
+        self._thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        while not self._stop.is_set():
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - self._beat - self.interval)
+            with self._lock:
+                self.lags.append(lag)
+                self.max_lag = max(self.max_lag, lag)
+                if lag >= self.threshold:
+                    self.slow_count += 1
+                    # Длительность блокировки, замеченной сторожем, известна только теперь
+                    if self.stalls and self._reported == self._beat:
+                        self.stalls[-1]['duration'] = lag
+            self._beat = now
+
+    def _watch(self):
+        while not self._stop.wait(self.threshold / 4):
+            beat = self._beat
+            stalled = time.monotonic() - beat - self.interval
+            if self._thread_id is None or stalled < self.threshold or self._reported == beat:
+                continue
+            frame = sys._current_frames().get(self._thread_id)
+            stack = ''.join(traceback.format_stack(frame)[-LOOP_STACK_DEPTH:]) if frame is not None else ''
+            del frame
+            with self._lock:
+                self._reported = beat
+                self.stalls.append({'at': time.time(), 'duration': stalled, 'stack': stack})
+            if self.on_stall:
+                try:
+                    self.on_stall(stalled, stack)
+                except Exception as e:
+                    print(f"Ошибка обработчика блокировки цикла: {e}")
+
+    def stats(self) -> Dict:
+        """Перцентили задержки (мс) и последние блокировки"""
+        with self._lock:
+            lags = sorted(self.lags)
+            stalls = list(self.stalls)
+            slow_count, max_lag = self.slow_count, self.max_lag
+
+        def percentile(q):
+            return lags[min(len(lags) - 1, int(q * len(lags)))] * 1000 if lags else 0.0
+
+        return {
+            'samples': len(lags),
+            'p50_ms': percentile(0.5),
+            'p95_ms': percentile(0.95),
+            'p99_ms': percentile(0.99),
+            'max_ms': max_lag * 1000,
+            'threshold_ms': self.threshold * 1000,
+            'slow_callbacks': slow_count,
+            'stalls': stalls,
+        }
+
+
+# ========== ФОНОВЫЕ ЗАДАЧИ ==========
+
+class CancellationToken:
+    """Токен отмены фоновой задачи
+
+    cancel() можно вызывать из любого потока: флаг видят циклы задачи, а сама
+    asyncio-задача отменяется, поэтому текущий запрос к Telegram прерывается
+    сразу, не дожидаясь конца файла или страницы истории.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._task = None
+        self._loop = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def bind(self, task: asyncio.Task):
+        """Привязка к asyncio-задаче (вызывается внутри неё)"""
+        self._task = task
+        self._loop = task.get_loop()
+        if self.cancelled:
+            task.cancel()
+
+    def cancel(self):
+        if self._event.is_set():
+            return
+        self._event.set()
+        if self._task is not None:
+            self._loop.call_soon_threadsafe(self._task.cancel)
+
+    def absorb(self) -> bool:
+        """Погасить CancelledError, пришедший от cancel()
+
+        True - отмена наша, и задача может штатно вернуть частичный результат;
+        False - отменили извне, исключение нужно пробросить.
+        """
+        if not self.cancelled:
+            return False
+        task = asyncio.current_task()
+        if task is not None and hasattr(task, 'uncancel'):
+            task.uncancel()
+        return True
+
+
+class Job:
+    """Фоновая задача GUI: токен отмены и future с результатом"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, name: str):
+        self.id = next(Job._ids)
+        self.name = name
+        self.token = CancellationToken()
+        self.future = None
+        self.started = time.monotonic()
+
+    def cancel(self):
+        self.token.cancel()
+
+    @property
+    def done(self) -> bool:
+        return self.future is not None and self.future.done()
+
+
+# Результаты фоновых задач - по типу результата GUI выбирает обработчик
+
+@dataclass
+class ConnectResult:
+    success: bool
+    message: str
+
+
+@dataclass
+class WarmConnectResult:
+    success: bool
+    message: str
+    chat_name: str = ''
+    elapsed: float = 0.0
+
+
+@dataclass
+class ChatResult:
+    success: bool
+    chat_name: str = ''
+    error: str = ''
+
+
+@dataclass
+class EstimateResult:
+    file_count: int
+    total_mb: float
+
+
+@dataclass
+class ScanResult:
+    files: 'FileCatalog'
+    total_mb: float
+    cancelled: bool = False
+    recovered_files: int = 0     # восстановлено из контрольной точки
+    recovered_messages: int = 0
+
+
+@dataclass
+class DownloadResult:
+    job_id: int
+    downloaded: int
+    total: int
+    cancelled: bool = False
+
+
+@dataclass
+class ThumbnailsResult:
+    thumbs: Dict[int, str]
+
+
+@dataclass
+class ArchiveResult:
+    success: bool
+    listing: Optional[Dict] = None
+    error: str = ''
+
+
+@dataclass
+class ResumeResult:
+    job_id: int
+    chat: object = None
+    error: str = ''
+
+
+@dataclass
+class WatchResult:
+    downloaded: int
+
+
+@dataclass
+class BenchmarkResult:
+    loop_backend: str
+    crypto_backend: str
+    switch_us: float
+    task_us: float
+    decrypt_mbps: Optional[float]
+
+
+class DownloadJournal:
+    """Журнал задач загрузки в SQLite.
+
+    Для каждого файла задачи хранится состояние (pending / in_flight / done / failed)
+    и путь сохранения, поэтому прерванную задачу можно продолжить даже после
+    перезапуска, обрабатывая только незавершённые файлы.
+
+    Задачи со статусом distributed раздаются воркерам (см. run_worker): файл
+    берётся в аренду (lease_owner, lease_until), аренда продлевается, пока воркер
+    жив, а просроченная аренда упавшего воркера переходит к другому.
+    shared=True - база на общем (сетевом) томе: WAL там не работает, поэтому
+    используется обычный журнал отката.
+    """
+
+    PENDING = 'pending'
+    IN_FLIGHT = 'in_flight'
+    DONE = 'done'
+    FAILED = 'failed'
+    DISTRIBUTED = 'distributed'
+
+    def __init__(self, db_path: str = 'tg_downloader_jobs.db', shared: bool = False):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        # Несколько процессов пишут в одну базу - ждём блокировку, а не падаем
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=DELETE' if shared else 'PRAGMA journal_mode=WAL')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER,
+                chat_ref TEXT,
+                download_path TEXT NOT NULL,
+                options TEXT NOT NULL DEFAULT '{}',
+                status TEXT NOT NULL DEFAULT 'active',
+                created_at TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS job_files (
+                job_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                filename TEXT NOT NULL,
+                size_bytes INTEGER NOT NULL DEFAULT 0,
+                extension TEXT,
+                state TEXT NOT NULL DEFAULT 'pending',
+                output_path TEXT,
+                error TEXT,
+                updated_at TEXT,
+                PRIMARY KEY (job_id, message_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_job_files_state ON job_files (job_id, state);
+            CREATE INDEX IF NOT EXISTS idx_job_files_message ON job_files (message_id);
+            CREATE TABLE IF NOT EXISTS watch_state (
+                chat_id INTEGER PRIMARY KEY,
+                last_message_id INTEGER NOT NULL,
+                updated_at TEXT
+            );
+            CREATE TABLE IF NOT EXISTS workers (
+                id TEXT PRIMARY KEY,
+                heartbeat_at REAL NOT NULL,
+                downloaded INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0
+            );
+        ''')
+        # Аренда файлов воркерами - в базах прошлых версий колонок ещё нет
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(job_files)')}
+        for column, ddl in (('lease_owner', 'TEXT'), ('lease_until', 'REAL'),
+                            ('attempts', 'INTEGER NOT NULL DEFAULT 0')):
+            if column not in columns:
+                self.conn.execute(f'ALTER TABLE job_files ADD COLUMN {column} {ddl}')
+        self.conn.commit()
+
+    def create_job(self, chat_id: int, chat_ref: str, download_path: str,
+                   files: List[Dict], options: Dict = None) -> int:
+        """Создание задачи со списком файлов"""
+        now = datetime.now().isoformat()
+        with self._lock:
+            cursor = self.conn.execute(
+                'INSERT INTO jobs (chat_id, chat_ref, download_path, options, created_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (chat_id, chat_ref, download_path, json.dumps(options or {}, ensure_ascii=False), now)
+            )
+            job_id = cursor.lastrowid
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO job_files (job_id, message_id, filename, size_bytes, extension, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [(job_id, f['id'], f['filename'], f.get('size', 0), f.get('extension'), now) for f in files]
+            )
+            self.conn.commit()
+        return job_id
+
+    def watch_job(self, chat_id: int, chat_ref: str, download_path: str, options: Dict = None) -> int:
+        """Задача режима наблюдения за чатом (одна на чат и папку, пополняется новыми файлами)"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT id FROM jobs WHERE chat_id = ? AND download_path = ? AND status = 'watch' "
+                "ORDER BY id DESC LIMIT 1",
+                (chat_id, download_path)
+            ).fetchone()
+            if row:
+                self.conn.execute('UPDATE jobs SET options = ? WHERE id = ?',
+                                  (json.dumps(options or {}, ensure_ascii=False), row[0]))
+                self.conn.commit()
+                return row[0]
+        job_id = self.create_job(chat_id, chat_ref, download_path, [], options)
+        self.set_status(job_id, 'watch')
+        return job_id
+
+    def add_files(self, job_id: int, files: List[Dict]):
+        """Добавление файлов в существующую задачу"""
+        now = datetime.now().isoformat()
+        with self._lock:
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO job_files (job_id, message_id, filename, size_bytes, extension, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [(job_id, f['id'], f['filename'], f.get('size', 0), f.get('extension'), now) for f in files]
+            )
+            self.conn.commit()
+
+    def known_files(self, chat_id: int, job_id: int, message_ids: List[int]) -> Set[int]:
+        """Файлы, которые уже скачаны из чата любой задачей или уже стоят в задаче job_id"""
+        if not message_ids:
+            return set()
+        marks = ','.join('?' * len(message_ids))
+        with self._lock:
+            rows = self.conn.execute(
+                f'SELECT f.message_id FROM job_files f JOIN jobs j ON j.id = f.job_id '
+                f'WHERE f.message_id IN ({marks}) AND j.chat_id = ? AND (f.state = ? OR f.job_id = ?)',
+                (*message_ids, chat_id, self.DONE, job_id)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def watch_position(self, chat_id: int) -> Optional[int]:
+        """Последнее обработанное режимом наблюдения сообщение чата"""
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT last_message_id FROM watch_state WHERE chat_id = ?', (chat_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_watch_position(self, chat_id: int, message_id: int):
+        """Сдвиг позиции наблюдения (только вперёд)"""
+        with self._lock:
+            self.conn.execute(
+                'INSERT INTO watch_state (chat_id, last_message_id, updated_at) VALUES (?, ?, ?) '
+                'ON CONFLICT(chat_id) DO UPDATE SET '
+                'last_message_id = MAX(last_message_id, excluded.last_message_id), '
+                'updated_at = excluded.updated_at',
+                (chat_id, message_id, datetime.now().isoformat())
+            )
+            self.conn.commit()
+
+    def publish_job(self, chat_id: int, chat_ref: str, download_path: str,
+                    files: List[Dict], options: Dict = None) -> int:
+        """Задача для воркеров: файлы раздаются через claim()"""
+        job_id = self.create_job(chat_id, chat_ref, download_path, files, options)
+        self.set_status(job_id, self.DISTRIBUTED)
+        return job_id
+
+    def claim(self, worker_id: str, limit: int, lease_seconds: float = LEASE_SECONDS) -> List[Dict]:
+        """Аренда до limit файлов распределённых задач
+
+        Берутся ожидающие файлы и файлы с просроченной арендой; выборка и аренда -
+        в одной транзакции BEGIN IMMEDIATE, поэтому один файл не достаётся двум
+        воркерам. Файлы, исчерпавшие LEASE_MAX_ATTEMPTS, помечаются failed.
+        """
+        now = time.time()
+        with self._lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                self.conn.execute(
+                    'UPDATE job_files SET state = ?, error = ?, lease_owner = NULL, lease_until = NULL '
+                    'WHERE state = ? AND lease_until < ? AND attempts >= ? '
+                    'AND job_id IN (SELECT id FROM jobs WHERE status = ?)',
+                    (self.FAILED, "Аренда истекла", self.IN_FLIGHT, now, LEASE_MAX_ATTEMPTS, self.DISTRIBUTED)
+                )
+                rows = self.conn.execute(
+                    'SELECT f.job_id, f.message_id, f.filename, f.size_bytes, f.extension, '
+                    'j.chat_id, j.chat_ref, j.download_path, j.options '
+                    'FROM job_files f JOIN jobs j ON j.id = f.job_id '
+                    'WHERE j.status = ? AND (f.state = ? OR (f.state = ? AND f.lease_until < ?)) '
+                    'ORDER BY f.job_id, f.rowid LIMIT ?',
+                    (self.DISTRIBUTED, self.PENDING, self.IN_FLIGHT, now, limit)
+                ).fetchall()
+                self.conn.executemany(
+                    'UPDATE job_files SET state = ?, lease_owner = ?, lease_until = ?, attempts = attempts + 1, '
+                    'updated_at = ? WHERE job_id = ? AND message_id = ?',
+                    [(self.IN_FLIGHT, worker_id, now + lease_seconds, datetime.now().isoformat(), r[0], r[1])
+                     for r in rows]
+                )
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+        return [
+            {'job_id': r[0], 'id': r[1], 'filename': r[2], 'size': r[3], 'extension': r[4],
+             'chat_id': r[5], 'chat_ref': r[6], 'download_path': r[7], 'options': json.loads(r[8] or '{}'),
+             'state': self.PENDING, 'output_path': None}
+            for r in rows
+        ]
+
+    def heartbeat(self, worker_id: str, lease_seconds: float = LEASE_SECONDS,
+                  downloaded: int = 0, failed: int = 0) -> int:
+        """Продление аренды всех файлов воркера; возвращает, сколько файлов продлено"""
+        now = time.time()
+        with self._lock:
+            cursor = self.conn.execute(
+                'UPDATE job_files SET lease_until = ? WHERE lease_owner = ? AND state = ?',
+                (now + lease_seconds, worker_id, self.IN_FLIGHT)
+            )
+            self.conn.execute(
+                'INSERT INTO workers (id, heartbeat_at, downloaded, failed) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at, '
+                'downloaded = excluded.downloaded, failed = excluded.failed',
+                (worker_id, now, downloaded, failed)
+            )
+            self.conn.commit()
+        return cursor.rowcount
+
+    def complete(self, worker_id: str, job_id: int, message_id: int, output_path: str) -> bool:
+        """Файл скачан; False - аренду успели передать другому воркеру"""
+        with self._lock:
+            cursor = self.conn.execute(
+                'UPDATE job_files SET state = ?, output_path = ?, error = NULL, lease_until = NULL, updated_at = ? '
+                'WHERE job_id = ? AND message_id = ? AND lease_owner = ? AND state = ?',
+                (self.DONE, output_path, datetime.now().isoformat(), job_id, message_id, worker_id, self.IN_FLIGHT)
+            )
+            self.conn.commit()
+        return cursor.rowcount == 1
+
+    def release(self, worker_id: str, job_id: int, message_id: int, error: str = None) -> Optional[str]:
+        """Возврат файла после ошибки: снова в очередь или failed после LEASE_MAX_ATTEMPTS
+
+        Возвращает новое состояние (None - файл уже не в аренде у этого воркера).
+        """
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT attempts FROM job_files WHERE job_id = ? AND message_id = ? AND lease_owner = ? AND state = ?',
+                (job_id, message_id, worker_id, self.IN_FLIGHT)
+            ).fetchone()
+            if not row:
+                return None
+            state = self.FAILED if row[0] >= LEASE_MAX_ATTEMPTS else self.PENDING
+            self.conn.execute(
+                'UPDATE job_files SET state = ?, error = ?, lease_owner = NULL, lease_until = NULL, updated_at = ? '
+                'WHERE job_id = ? AND message_id = ?',
+                (state, error, datetime.now().isoformat(), job_id, message_id)
+            )
+            self.conn.commit()
+        return state
+
+    def release_worker(self, worker_id: str):
+        """Остановка воркера: его незаконченные файлы сразу возвращаются в очередь"""
+        with self._lock:
+            self.conn.execute(
+                'UPDATE job_files SET state = ?, lease_owner = NULL, lease_until = NULL, attempts = attempts - 1 '
+                'WHERE lease_owner = ? AND state = ?',
+                (self.PENDING, worker_id, self.IN_FLIGHT)
+            )
+            self.conn.commit()
+
+    def has_distributed_work(self) -> bool:
+        """Остались ли в распределённых задачах файлы в очереди или в аренде"""
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT 1 FROM job_files f JOIN jobs j ON j.id = f.job_id '
+                'WHERE j.status = ? AND f.state IN (?, ?) LIMIT 1',
+                (self.DISTRIBUTED, self.PENDING, self.IN_FLIGHT)
+            ).fetchone()
+        return row is not None
+
+    def get_job(self, job_id: int) -> Optional[Dict]:
+        """Параметры задачи"""
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT id, chat_id, chat_ref, download_path, options, status, created_at FROM jobs WHERE id = ?',
+                (job_id,)
+            ).fetchone()
+        if not row:
+            return None
+        return {
+            'id': row[0], 'chat_id': row[1], 'chat_ref': row[2], 'download_path': row[3],
+            'options': json.loads(row[4] or '{}'), 'status': row[5], 'created_at': row[6]
+        }
+
+    def remaining_files(self, job_id: int) -> List[Dict]:
+        """Файлы задачи, которые ещё не скачаны"""
+        with self._lock:
+            rows = self.conn.execute(
+                'SELECT message_id, filename, size_bytes, extension, state, output_path FROM job_files '
+                'WHERE job_id = ? AND state != ? ORDER BY rowid',
+                (job_id, self.DONE)
+            ).fetchall()
+        return [
+            {'id': r[0], 'filename': r[1], 'size': r[2], 'extension': r[3], 'state': r[4], 'output_path': r[5]}
+            for r in rows
+        ]
+
+    def mark(self, job_id: int, message_id: int, state: str, output_path: str = None, error: str = None):
+        """Обновление состояния файла задачи"""
+        with self._lock:
+            self.conn.execute(
+                'UPDATE job_files SET state = ?, output_path = COALESCE(?, output_path), error = ?, updated_at = ? '
+                'WHERE job_id = ? AND message_id = ?',
+                (state, output_path, error, datetime.now().isoformat(), job_id, message_id)
+            )
+            self.conn.commit()
+
+    def set_status(self, job_id: int, status: str):
+        """Обновление статуса задачи (active / paused / cancelled / done)"""
+        with self._lock:
+            self.conn.execute('UPDATE jobs SET status = ? WHERE id = ?', (status, job_id))
+            self.conn.commit()
+
+    def stats(self, job_id: int) -> Dict[str, int]:
+        """Количество файлов задачи по состояниям"""
+        with self._lock:
+            rows = self.conn.execute(
+                'SELECT state, COUNT(*) FROM job_files WHERE job_id = ? GROUP BY state', (job_id,)
+            ).fetchall()
+        return dict(rows)
+
+    def unfinished_jobs(self) -> List[Dict]:
+        """Незавершённые задачи, начиная с самой свежей"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT j.id FROM jobs j WHERE j.status IN ('active', 'paused') AND EXISTS ("
+                "SELECT 1 FROM job_files f WHERE f.job_id = j.id AND f.state != ?) ORDER BY j.id DESC",
+                (self.DONE,)
+            ).fetchall()
+        return [self.get_job(row[0]) for row in rows]
+
+    def close(self):
+        """Закрытие базы"""
+        with self._lock:
+            self.conn.close()
+
+
+def normalize_chat_ref(chat_input: str) -> str:
+    """Ключ кеша для введённого чата: ссылки, @username и id приводятся к одному виду
+
+    username:<имя> | channel:<id> | id:<число> | raw:<как есть> (например, инвайт-ссылки)
+    """
+    text = chat_input.strip()
+    match = re.match(r'^(?:https?://)?(?:www\.)?(?:t|telegram)\.me/(.+)$', text, re.IGNORECASE)
+    if match:
+        path = match.group(1).split('?')[0].strip('/')
+        parts = path.split('/')
+        if parts[0] == 'c' and len(parts) > 1 and parts[1].isdigit():
+            return f"channel:{parts[1]}"
+        if parts[0].startswith('+') or parts[0] == 'joinchat':
+            return f"raw:{text}"
+        text = '@' + parts[0]
+
+    if text.startswith('@'):
+        return f"username:{text[1:].lower()}"
+    if re.fullmatch(r'-100\d+', text):
+        return f"channel:{text[4:]}"
+    if re.fullmatch(r'-?\d+', text):
+        return f"id:{int(text)}"
+    if re.fullmatch(r'[A-Za-z][A-Za-z0-9_]{3,}', text):
+        return f"username:{text.lower()}"
+    return f"raw:{text}"
+
+
+class PeerCache:
+    """Постоянный кеш разрешённых чатов в SQLite, общий для GUI и headless-режима
+
+    По ключу ввода (см. normalize_chat_ref) хранится тип, id, access hash и
+    название чата. Access hash действителен только для аккаунта, который его
+    получил, поэтому ключ включает имя сессии. Из записи собирается сущность
+    Telethon без сетевого запроса; устаревшие записи обновляются в фоне.
+    """
+
+    def __init__(self, db_path: str = 'tg_downloader_peers.db'):
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS peers (
+                account TEXT NOT NULL,
+                input_key TEXT NOT NULL,
+                peer_type TEXT NOT NULL,
+                peer_id INTEGER NOT NULL,
+                access_hash INTEGER,
+                title TEXT,
+                username TEXT,
+                flags TEXT NOT NULL DEFAULT '{}',
+                resolved_at REAL NOT NULL,
+                PRIMARY KEY (account, input_key)
+            );
+        ''')
+        self.conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, account: str, input_key: str) -> Optional[Dict]:
+        """Запись кеша или None"""
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT peer_type, peer_id, access_hash, title, username, flags, resolved_at '
+                'FROM peers WHERE account = ? AND input_key = ?',
+                (account, input_key)
+            ).fetchone()
+        if not row:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return {
+            'peer_type': row[0], 'peer_id': row[1], 'access_hash': row[2], 'title': row[3],
+            'username': row[4], 'flags': json.loads(row[5]), 'resolved_at': row[6],
+        }
+
+    def put(self, account: str, input_keys, entity):
+        """Сохранение сущности под ключом ввода и под её собственными ключами (username, id)"""
+        if isinstance(entity, Channel):
+            peer_type, flags = 'channel', {'megagroup': bool(entity.megagroup), 'broadcast': bool(entity.broadcast)}
+        elif isinstance(entity, User):
+            peer_type, flags = 'user', {'bot': bool(getattr(entity, 'bot', False))}
+        else:
+            # Обычные группы разрешаются по id без access hash - кешировать нечего
+            return
+        title = getattr(entity, 'title', None) or ' '.join(
+            filter(None, [getattr(entity, 'first_name', None), getattr(entity, 'last_name', None)]))
+        username = getattr(entity, 'username', None)
+
+        keys = set(input_keys)
+        keys.add(f"channel:{entity.id}" if peer_type == 'channel' else f"id:{entity.id}")
+        if username:
+            keys.add(f"username:{username.lower()}")
+        now = time.time()
+        with self._lock:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO peers '
+                '(account, input_key, peer_type, peer_id, access_hash, title, username, flags, resolved_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(account, key, peer_type, entity.id, entity.access_hash, title, username,
+                  json.dumps(flags), now) for key in keys]
+            )
+            self.conn.commit()
+
+    @staticmethod
+    def to_entity(record: Dict):
+        """Сущность Telethon из записи кеша (None - собрать не удалось, нужен сетевой запрос)"""
+        try:
+            if record['peer_type'] == 'channel':
+                return Channel(id=record['peer_id'], title=record['title'] or '', photo=ChatPhotoEmpty(),
+                               date=None, access_hash=record['access_hash'], username=record['username'],
+                               megagroup=record['flags'].get('megagroup'),
+                               broadcast=record['flags'].get('broadcast'))
+            if record['peer_type'] == 'user':
+                return User(id=record['peer_id'], access_hash=record['access_hash'],
+                            username=record['username'], first_name=record['title'],
+                            bot=record['flags'].get('bot'))
+        except TypeError:
+            # Конструктор типа изменился в другом слое схемы
+            return None
+        return None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = self.conn.execute('SELECT COUNT(DISTINCT account || peer_id) FROM peers').fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'peers': entries}
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+class ScanCheckpoints:
+    """Контрольные точки незавершённых сканирований в SQLite
+
+    Сканирование чата с одними и теми же параметрами (расширения, фильтры, лимит)
+    периодически сохраняет позицию (последний обработанный id), самый новый id на
+    момент старта, счётчики и найденные с прошлой точки файлы. Прерванное
+    сканирование (ошибка, FloodWait, остановка, падение процесса) при повторном
+    запуске продолжается с этой позиции; завершённое удаляет свою точку.
+    """
+
+    def __init__(self, db_path: str = 'tg_downloader_scans.db'):
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS scans (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER NOT NULL,
+                params_key TEXT NOT NULL,
+                offset_id INTEGER NOT NULL DEFAULT 0,
+                top_id INTEGER NOT NULL DEFAULT 0,
+                processed INTEGER NOT NULL DEFAULT 0,
+                total_size INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL,
+                UNIQUE (chat_id, params_key)
+            );
+            CREATE TABLE IF NOT EXISTS scan_files (
+                scan_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                filename TEXT NOT NULL,
+                size_bytes INTEGER NOT NULL,
+                date REAL NOT NULL,
+                mime_type TEXT,
+                extension TEXT,
+                caption TEXT,
+                PRIMARY KEY (scan_id, message_id)
+            );
+        ''')
+        self.conn.commit()
+        # Сколько восстановлено последним сканированием: файлов и сообщений
+        self.last_recovered = (0, 0)
+
+    @staticmethod
+    def params_key(selected_extensions, filters: 'ScanFilters', limit) -> str:
+        """Ключ параметров сканирования: точка подходит только тому же набору параметров"""
+        params = {
+            'extensions': sorted(selected_extensions or []),
+            'date_from': filters.date_from.isoformat() if filters.date_from else None,
+            'date_to': filters.date_to.isoformat() if filters.date_to else None,
+            'min_size': filters.min_size,
+            'max_size': filters.max_size,
+            'limit': limit,
+        }
+        return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+    def load(self, chat_id: int, params_key: str) -> Optional[Dict]:
+        """Точка прерванного сканирования с найденными файлами (None - начинать сначала)"""
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT id, offset_id, top_id, processed, total_size, updated_at FROM scans '
+                'WHERE chat_id = ? AND params_key = ?',
+                (chat_id, params_key)
+            ).fetchone()
+            if not row:
+                return None
+            if time.time() - row[5] > SCAN_CHECKPOINT_TTL:
+                self._delete(row[0])
+                return None
+            files = self.conn.execute(
+                'SELECT message_id, filename, size_bytes, date, mime_type, extension, caption FROM scan_files '
+                'WHERE scan_id = ? ORDER BY message_id DESC',
+                (row[0],)
+            ).fetchall()
+        return {
+            'scan_id': row[0], 'offset_id': row[1], 'top_id': row[2], 'processed': row[3], 'total_size': row[4],
+            'files': [
+                (FileInfo(r[0], r[1], r[2], datetime.fromtimestamp(r[3], timezone.utc), r[4] or '', r[5],
+                          EXTENSION_CATEGORIES.get(r[5], 'Другие')), r[6])
+                for r in files
+            ],
+        }
+
+    def save(self, chat_id: int, params_key: str, offset_id: int, top_id: int, processed: int,
+             total_size: int, new_files: List[FileInfo], captions: Dict[int, str] = None):
+        """Сохранение позиции и файлов, найденных после предыдущей точки (одна транзакция)"""
+        captions = captions or {}
+        with self._lock:
+            self.conn.execute(
+                'INSERT INTO scans (chat_id, params_key, offset_id, top_id, processed, total_size, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (chat_id, params_key) DO UPDATE SET '
+                'offset_id = excluded.offset_id, top_id = excluded.top_id, processed = excluded.processed, '
+                'total_size = excluded.total_size, updated_at = excluded.updated_at',
+                (chat_id, params_key, offset_id, top_id, processed, total_size, time.time())
+            )
+            scan_id = self.conn.execute('SELECT id FROM scans WHERE chat_id = ? AND params_key = ?',
+                                        (chat_id, params_key)).fetchone()[0]
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO scan_files '
+                '(scan_id, message_id, filename, size_bytes, date, mime_type, extension, caption) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [(scan_id, f.id, f.filename, f.size_bytes, f.date.timestamp(), f.mime_type, f.extension,
+                  captions.get(f.id)) for f in new_files]
+            )
+            self.conn.commit()
+
+    def finish(self, chat_id: int, params_key: str):
+        """Сканирование завершено - точка больше не нужна"""
+        with self._lock:
+            row = self.conn.execute('SELECT id FROM scans WHERE chat_id = ? AND params_key = ?',
+                                    (chat_id, params_key)).fetchone()
+            if row:
+                self._delete(row[0])
+
+    def _delete(self, scan_id: int):
+        self.conn.execute('DELETE FROM scan_files WHERE scan_id = ?', (scan_id,))
+        self.conn.execute('DELETE FROM scans WHERE id = ?', (scan_id,))
+        self.conn.commit()
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+def build_fts_query(text: str) -> str:
+    """Запрос FTS5 из строки поиска
+
+    Слова ищутся по префиксу (счёт -> счёт*, счета, ...), "текст в кавычках" -
+    как точная фраза; все части должны совпасть.
+    """
+    terms = []
+    for phrase, word in re.findall(r'"([^"]*)"?|(\S+)', text):
+        if phrase.strip():
+            terms.append('"' + phrase.replace('"', '') + '"')
+        word = word.replace('"', '').rstrip('*')
+        if word:
+            terms.append(f'"{word}"*')
+    return ' '.join(terms)
+
+
+class SearchIndex:
+    """Постоянный полнотекстовый индекс файлов всех просканированных чатов (SQLite FTS5)
+
+    Таблица files - по строке на файл (чат, id сообщения, имя, подпись, расширение,
+    размер, дата); files_fts - индекс FTS5 над именем, подписью и названием чата,
+    синхронизируется триггерами. Ранжирование - bm25 с наибольшим весом у имени
+    файла; расширение, размер и дата - фильтры по обычным индексам. Если SQLite
+    собран без FTS5, поиск идёт через LIKE (медленнее, без ранжирования).
+    """
+
+    def __init__(self, db_path: str = SEARCH_DB):
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS files (
+                id INTEGER PRIMARY KEY,
+                chat_id INTEGER NOT NULL,
+                chat_title TEXT,
+                chat_ref TEXT,
+                message_id INTEGER NOT NULL,
+                filename TEXT NOT NULL,
+                caption TEXT,
+                extension TEXT,
+                size_bytes INTEGER NOT NULL DEFAULT 0,
+                date INTEGER,
+                UNIQUE (chat_id, message_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_files_extension ON files (extension);
+            CREATE INDEX IF NOT EXISTS idx_files_size ON files (size_bytes);
+            CREATE INDEX IF NOT EXISTS idx_files_date ON files (date);
+        ''')
+        try:
+            self.conn.executescript('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(
+                    filename, caption, chat_title,
+                    content='files', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+                );
+                CREATE TRIGGER IF NOT EXISTS files_ai AFTER INSERT ON files BEGIN
+                    INSERT INTO files_fts (rowid, filename, caption, chat_title)
+                    VALUES (new.id, new.filename, new.caption, new.chat_title);
+                END;
+                CREATE TRIGGER IF NOT EXISTS files_ad AFTER DELETE ON files BEGIN
+                    INSERT INTO files_fts (files_fts, rowid, filename, caption, chat_title)
+                    VALUES ('delete', old.id, old.filename, old.caption, old.chat_title);
+                END;
+                CREATE TRIGGER IF NOT EXISTS files_au AFTER UPDATE ON files BEGIN
+                    INSERT INTO files_fts (files_fts, rowid, filename, caption, chat_title)
+                    VALUES ('delete', old.id, old.filename, old.caption, old.chat_title);
+                    INSERT INTO files_fts (rowid, filename, caption, chat_title)
+                    VALUES (new.id, new.filename, new.caption, new.chat_title);
+                END;
+            ''')
+            self.fts = True
+        except sqlite3.OperationalError:
+            print("SQLite без FTS5: глобальный поиск работает через LIKE")
+            self.fts = False
+        self.conn.commit()
+
+    def index_chat(self, chat_id: int, chat_title: str, chat_ref: str, files, captions: Dict[int, str] = None) -> int:
+        """Добавление (обновление) файлов просканированного чата; возвращает число строк"""
+        captions = captions or {}
+        rows = [(chat_id, chat_title, chat_ref, f.id, f.filename, captions.get(f.id), f.extension,
+                 f.size_bytes, int(f.date.timestamp()) if f.date else None) for f in files]
+        with self._lock:
+            self.conn.execute(
+                'UPDATE files SET chat_title = ?, chat_ref = ? WHERE chat_id = ? AND chat_title IS NOT ?',
+                (chat_title, chat_ref, chat_id, chat_title)
+            )
+            self.conn.executemany(
+                'INSERT INTO files (chat_id, chat_title, chat_ref, message_id, filename, caption, extension, '
+                'size_bytes, date) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (chat_id, message_id) DO UPDATE SET '
+                'chat_title = excluded.chat_title, chat_ref = excluded.chat_ref, filename = excluded.filename, '
+                'caption = COALESCE(excluded.caption, caption), extension = excluded.extension, '
+                'size_bytes = excluded.size_bytes, date = excluded.date',
+                rows
+            )
+            self.conn.commit()
+        return len(rows)
+
+    def _where(self, query: str, extensions=None, min_size=None, max_size=None,
+               date_from: datetime = None, date_to: datetime = None, chat_id=None):
+        """Условия выборки по фильтрам и запрос FTS5 (None - текст ищется через LIKE или не задан)"""
+        clauses, params = [], []
+        fts_query = build_fts_query(query or '') if self.fts else ''
+        if query and not self.fts:
+            for phrase, word in re.findall(r'"([^"]*)"?|(\S+)', query):
+                text = (phrase or word).strip('*"')
+                if text:
+                    clauses.append('(f.filename LIKE ? OR f.caption LIKE ?)')
+                    params += [f"%{text}%", f"%{text}%"]
+        if extensions:
+            clauses.append(f"f.extension IN ({','.join('?' * len(extensions))})")
+            params += list(extensions)
+        for clause, value in (('f.size_bytes >= ?', min_size), ('f.size_bytes <= ?', max_size),
+                              ('f.chat_id = ?', chat_id)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        if date_from is not None:
+            clauses.append('f.date >= ?')
+            params.append(int(date_from.timestamp()))
+        if date_to is not None:
+            clauses.append('f.date < ?')
+            params.append(int(date_to.timestamp()))
+        return ' AND '.join(clauses) or '1', params, fts_query or None
+
+    def search(self, query: str, limit: int = SEARCH_LIMIT, **facets) -> List[Dict]:
+        """Файлы по запросу, лучшие первыми; facets - extensions, min_size, max_size,
+        date_from, date_to, chat_id
+        """
+        where, params, fts_query = self._where(query, **facets)
+        if fts_query:
+            # Ранжирование по bm25: имя файла весомее подписи, подпись - названия чата
+            sql = ('SELECT f.chat_id, f.chat_title, f.chat_ref, f.message_id, f.filename, f.caption, '
+                   'f.extension, f.size_bytes, f.date FROM files_fts JOIN files f ON f.id = files_fts.rowid '
+                   f'WHERE files_fts MATCH ? AND {where} '
+                   'ORDER BY bm25(files_fts, 10.0, 3.0, 1.0), f.date DESC LIMIT ?')
+            params = [fts_query] + params + [limit]
+        else:
+            sql = ('SELECT f.chat_id, f.chat_title, f.chat_ref, f.message_id, f.filename, f.caption, '
+                   f'f.extension, f.size_bytes, f.date FROM files f WHERE {where} ORDER BY f.date DESC LIMIT ?')
+            params = params + [limit]
+        with self._lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return [
+            {'chat_id': r[0], 'chat_title': r[1], 'chat_ref': r[2], 'id': r[3], 'filename': r[4],
+             'caption': r[5], 'extension': r[6], 'size': r[7],
+             'date': datetime.fromtimestamp(r[8], timezone.utc) if r[8] is not None else None}
+            for r in rows
+        ]
+
+    def facet_counts(self, query: str, **facets) -> Dict[str, int]:
+        """Сколько найденных файлов каждого расширения (для сужения поиска)"""
+        where, params, fts_query = self._where(query, **facets)
+        if fts_query:
+            where = f'f.id IN (SELECT rowid FROM files_fts WHERE files_fts MATCH ?) AND {where}'
+            params = [fts_query] + params
+        with self._lock:
+            rows = self.conn.execute(
+                f'SELECT f.extension, COUNT(*) FROM files f WHERE {where} GROUP BY f.extension ORDER BY 2 DESC',
+                params
+            ).fetchall()
+        return dict(rows)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            files, chats = self.conn.execute('SELECT COUNT(*), COUNT(DISTINCT chat_id) FROM files').fetchone()
+        return {'files': files, 'chats': chats, 'fts': self.fts}
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+def choose_part_size(size: Optional[int]) -> int:
+    """Размер части по размеру файла
+
+    Маленький файл забирается одним запросом наименьшей подходящей части,
+    крупный - частями предельного размера.
+    """
+    if not size:
+        return TRANSFER_PART_MAX
+    part = TRANSFER_PART_MIN
+    while part < size and part < TRANSFER_PART_MAX:
+        part *= 2
+    return part
+
+
+# Время, которое запрос части провёл в ожидании соединения из DcSenderPool
+# (и в его создании): в RTT части оно не входит
+PART_SETUP_TIME = contextvars.ContextVar('part_setup_time', default=None)
+
+
+class TransferTuner:
+    """Подстройка окна одновременных запросов частей по задержке, отдельно для каждого DC
+
+    Пока ответ на часть приходит не дольше TRANSFER_QUEUE_FACTOR минимального RTT
+    для частей того же размера, канал не насыщен и окно растёт на 1 (до max_window);
+    если ответы начинают стоять в очереди - окно уменьшается. Выученное окно
+    становится стартовым для следующих файлов с того же DC.
+    """
+
+    def __init__(self, max_window: int = TRANSFER_WINDOW_MAX):
+        self.max_window = max(1, max_window)
+        self._dcs = {}  # dc_id -> состояние окна и замеров
+        self.part_sizes = {}  # размер части -> сколько файлов
+
+    def _state(self, dc_id) -> Dict:
+        state = self._dcs.get(dc_id)
+        if state is None:
+            state = self._dcs[dc_id] = {
+                'window': min(TRANSFER_WINDOW_START, self.max_window), 'min_rtt': None, 'min_rtts': {}, 'rtt': None,
+                'throughput': None, 'parts': 0, 'bytes': 0, 'grown': 0, 'shrunk': 0,
+            }
+        return state
+
+    def window(self, dc_id) -> int:
+        return max(1, min(self._state(dc_id)['window'], self.max_window))
+
+    def start(self, dc_id, part_size: int) -> int:
+        """Начало загрузки файла: учёт выбранной части, стартовое окно"""
+        self.part_sizes[part_size] = self.part_sizes.get(part_size, 0) + 1
+        return self.window(dc_id)
+
+    def observe(self, dc_id, size: int, elapsed: float, part_size: int = None):
+        """Замер одной части: время от запроса до ответа
+
+        Минимальный RTT свой для каждого размера части: часть в 512 КБ заведомо
+        дольше части в 4 КБ, и сравнивать их - значит видеть очередь там, где её нет.
+        """
+        state = self._state(dc_id)
+        state['parts'] += 1
+        state['bytes'] += size
+        state['rtt'] = elapsed if state['rtt'] is None else 0.8 * state['rtt'] + 0.2 * elapsed
+        min_rtts = state['min_rtts']
+        key = part_size or size
+        if key not in min_rtts or elapsed < min_rtts[key]:
+            min_rtts[key] = elapsed
+        state['min_rtt'] = min_rtts[key]
+        if elapsed <= state['min_rtt'] * TRANSFER_QUEUE_FACTOR:
+            if state['window'] < self.max_window:
+                state['window'] += 1
+                state['grown'] += 1
+        elif state['window'] > 1:
+            state['window'] -= 1
+            state['shrunk'] += 1
+
+    def finish(self, dc_id, size: int, elapsed: float):
+        """Завершение файла: скорость всей передачи (EMA)"""
+        if elapsed <= 0:
+            return
+        state = self._state(dc_id)
+        speed = size / elapsed
+        state['throughput'] = speed if state['throughput'] is None else 0.7 * state['throughput'] + 0.3 * speed
+
+    def stats(self) -> Dict:
+        return {
+            'max_window': self.max_window,
+            'part_sizes': dict(sorted(self.part_sizes.items())),
+            'dcs': {dc_id: {**state, 'min_rtts': dict(state['min_rtts'])} for dc_id, state in sorted(self._dcs.items())},
+        }
+
+
+class DcSenderPool:
+    """Пул прогретых соединений к DC, отличным от домашнего.
+
+    Подменяет _borrow_exported_sender/_return_exported_sender клиента Telethon:
+    на каждый DC держится до max_per_dc соединений, авторизация экспортируется
+    один раз и её ключ используется для новых соединений, простаивающие
+    соединения закрываются по таймауту.
+    """
+
+    def __init__(self, client, max_per_dc: int = DC_POOL_MAX_SENDERS,
+                 idle_timeout: float = DC_POOL_IDLE_TIMEOUT):
+        self.client = client
+        self.max_per_dc = max_per_dc
+        self.idle_timeout = idle_timeout
+
+        self._idle = {}       # dc_id -> [(sender, время возврата)]
+        self._open = {}       # dc_id -> количество открытых соединений
+        self._auth_keys = {}  # dc_id -> ключ с импортированной авторизацией
+        self._cond = None
+        self._reaper = None
+        self._create_exported_sender = None
+
+        self.hits = 0
+        self.misses = 0
+        self.exports = 0
+        self.expired = 0
+
+    def install(self) -> bool:
+        """Подключение пула к клиенту Telethon"""
+        # Точки расширения внутренние: в другой версии Telethon их может не быть
+        if not hasattr(self.client, '_create_exported_sender'):
+            print("Пул соединений к DC недоступен для этой версии Telethon")
+            return False
+        self._create_exported_sender = self.client._create_exported_sender
+        self.client._borrow_exported_sender = self.acquire
+        self.client._return_exported_sender = self.release
+        return True
+
+    async def acquire(self, dc_id: int):
+        """Выдача соединения к DC: из пула или новое
+
+        Время ожидания и создания соединения добавляется к PART_SETUP_TIME
+        запроса части, чтобы не попасть в её RTT.
+        """
+        started = time.monotonic()
+        try:
+            return await self._acquire(dc_id)
+        finally:
+            setup = PART_SETUP_TIME.get()
+            if setup is not None:
+                setup[0] += time.monotonic() - started
+
+    async def _acquire(self, dc_id: int):
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+            self._reaper = asyncio.ensure_future(self._reap_loop())
+
+        async with self._cond:
+            while True:
+                idle = self._idle.get(dc_id)
+                while idle:
+                    sender, _ = idle.pop()
+                    if sender.is_connected():
+                        self.hits += 1
+                        return sender
+                    self._open[dc_id] -= 1
+
+                if self._open.get(dc_id, 0) < self.max_per_dc:
+                    self._open[dc_id] = self._open.get(dc_id, 0) + 1
+                    break
+                await self._cond.wait()
+
+        # Соединение создаётся вне блокировки, чтобы не задерживать другие DC
+        self.misses += 1
+        try:
+            sender = await self._create_sender(dc_id)
+        except BaseException:
+            async with self._cond:
+                self._open[dc_id] -= 1
+                self._cond.notify()
+            raise
+        sender.dc_id = dc_id
+        return sender
+
+    async def release(self, sender):
+        """Возврат соединения в пул"""
+        async with self._cond:
+            self._idle.setdefault(sender.dc_id, []).append((sender, time.monotonic()))
+            self._cond.notify()
+
+    async def _create_sender(self, dc_id: int):
+        """Новое соединение: с сохранённым ключом или с экспортом авторизации"""
+        auth_key = self._auth_keys.get(dc_id)
+        if auth_key is not None:
+            try:
+                return await self._connect_with_key(dc_id, auth_key)
+            except Exception as e:
+                print(f"Сохранённая авторизация для DC {dc_id} не подошла: {e}")
+                self._auth_keys.pop(dc_id, None)
+
+        sender = await self._create_exported_sender(dc_id)
+        self.exports += 1
+        self._auth_keys[dc_id] = sender.auth_key
+        return sender
+
+    async def _connect_with_key(self, dc_id: int, auth_key):
+        """Соединение с DC по уже авторизованному ключу, без повторного экспорта"""
+        client = self.client
+        dc = await client._get_dc(dc_id)
+        sender = MTProtoSender(auth_key, loggers=client._log)
+        await sender.connect(client._connection(
+            dc.ip_address, dc.port, dc.id,
+            loggers=client._log, proxy=client._proxy, local_addr=client._local_addr
+        ))
+        # Копия init-запроса: общий объект клиента могут менять параллельно
+        init_request = copy.copy(client._init_request)
+        init_request.query = functions.help.GetConfigRequest()
+        await sender.send(functions.InvokeWithLayerRequest(LAYER, init_request))
+        return sender
+
+    @property
+    def installed(self) -> bool:
+        return self._create_exported_sender is not None
+
+    def used_dcs(self) -> List[int]:
+        """DC, к которым пул открывал соединения за этот запуск"""
+        return list(self._open)
+
+    async def warm(self, dc_ids):
+        """Заранее открыть соединения к указанным DC"""
+        home_dc = self.client.session.dc_id
+        for dc_id in set(dc_ids):
+            if dc_id and dc_id != home_dc:
+                await self.release(await self.acquire(dc_id))
+
+    async def _reap_loop(self):
+        """Закрытие простаивающих соединений"""
+        while True:
+            await asyncio.sleep(min(self.idle_timeout / 2, 10))
+            expired = []
+            now = time.monotonic()
+            async with self._cond:
+                for dc_id, idle in self._idle.items():
+                    keep = []
+                    for sender, released_at in idle:
+                        if now - released_at > self.idle_timeout:
+                            expired.append(sender)
+                            self._open[dc_id] -= 1
+                        else:
+                            keep.append((sender, released_at))
+                    idle[:] = keep
+                if expired:
+                    self._cond.notify_all()
+            for sender in expired:
+                self.expired += 1
+                await sender.disconnect()
+
+    async def close(self):
+        """Закрытие всех соединений пула"""
+        if self._reaper:
+            self._reaper.cancel()
+        for idle in self._idle.values():
+            for sender, _ in idle:
+                await sender.disconnect()
+        self._idle = {}
+        self._open = {}
+
+    def stats(self) -> Dict:
+        """Статистика попаданий в пул и открытых соединений по DC"""
+        requests = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else 0.0,
+            'exports': self.exports,
+            'expired': self.expired,
+            'dcs': {
+                dc_id: {'open': count, 'idle': len(self._idle.get(dc_id, []))}
+                for dc_id, count in self._open.items()
+            },
+        }
+
+
+class PooledAccount:
+    """Аккаунт пула сессий со своим учётом запросов и FloodWait"""
+
+    def __init__(self, name: str, client, primary: bool = False, peer_cache: PeerCache = None):
+        self.name = name
+        self.client = client
+        self.primary = primary
+        self.peer_cache = peer_cache
+
+        # Соединения к файловым DC этого аккаунта
+        self.dc_pool = DcSenderPool(client)
+        self.dc_pool.install()
+
+        self.in_flight = 0
+        self.requests = 0
+        self.bytes = 0
+        self.flood_waits = 0
+        self.flood_until = 0.0
+        # id чата -> сущность в этом аккаунте (None - аккаунт не состоит в чате)
+        self.entities = {}
+
+    @property
+    def available(self) -> bool:
+        """Аккаунт не находится в FloodWait"""
+        return time.monotonic() >= self.flood_until
+
+    def can_serve(self, chat) -> bool:
+        """Может ли аккаунт обслуживать запросы к чату"""
+        if self.primary:
+            return True
+        # id сообщений общие для аккаунтов только в каналах и супергруппах
+        if not isinstance(chat, Channel):
+            return False
+        return self.entities.get(chat.id, True) is not None
+
+    async def resolve(self, chat):
+        """Сущность чата с access hash этого аккаунта"""
+        if self.primary:
+            return chat
+        if chat.id not in self.entities:
+            key = f"channel:{chat.id}"
+            record = self.peer_cache.get(self.name, key) if self.peer_cache else None
+            entity = PeerCache.to_entity(record) if record else None
+            if entity is not None:
+                self.entities[chat.id] = entity
+                return entity
+            try:
+                self.entities[chat.id] = await self.client.get_entity(
+                    getattr(chat, 'username', None) or PeerChannel(chat.id)
+                )
+                if self.peer_cache:
+                    self.peer_cache.put(self.name, [key], self.entities[chat.id])
+            except (ValueError, errors.RPCError) as e:
+                print(f"Сессия {self.name} не имеет доступа к чату {chat.id}: {e}")
+                self.entities[chat.id] = None
+        return self.entities[chat.id]
+
+
+class SessionPool:
+    """Пул авторизованных сессий для распределения загрузок и сканирования.
+
+    Запрос получает наименее загруженный аккаунт; аккаунт, получивший FloodWait,
+    исключается из выдачи до окончания ожидания, и трафик уходит на остальные.
+    """
+
+    def __init__(self):
+        self.accounts: List[PooledAccount] = []
+
+    @property
+    def size(self) -> int:
+        """Количество аккаунтов в пуле"""
+        return len(self.accounts)
+
+    def add(self, name: str, client, primary: bool = False, peer_cache: PeerCache = None) -> PooledAccount:
+        """Добавление аккаунта в пул"""
+        account = PooledAccount(name, client, primary, peer_cache)
+        self.accounts.append(account)
+        return account
+
+    def clear(self):
+        """Очистка пула"""
+        self.accounts = []
+
+    async def acquire(self, chat=None) -> PooledAccount:
+        """Выбор аккаунта для очередного запроса"""
+        if not self.accounts:
+            raise RuntimeError("Пул сессий пуст")
+
+        while True:
+            suitable = [a for a in self.accounts if chat is None or a.can_serve(chat)]
+            if not suitable:
+                raise RuntimeError("Ни один аккаунт пула не имеет доступа к чату")
+
+            ready = [a for a in suitable if a.available]
+            if ready:
+                account = min(ready, key=lambda a: (a.in_flight, a.requests))
+                account.in_flight += 1
+                account.requests += 1
+                return account
+
+            # Все подходящие аккаунты в FloodWait - ждём ближайшего
+            wait = min(a.flood_until for a in suitable) - time.monotonic()
+            await asyncio.sleep(max(wait, 0.1))
+
+    def release(self, account: PooledAccount, transferred: int = 0):
+        """Возврат аккаунта после запроса"""
+        account.in_flight = max(account.in_flight - 1, 0)
+        account.bytes += transferred
+
+    def report_flood(self, account: PooledAccount, seconds: int):
+        """Учёт FloodWait: аккаунт временно исключается из выдачи"""
+        account.flood_waits += 1
+        account.flood_until = time.monotonic() + seconds
+        print(f"FloodWait {seconds} с для сессии {account.name}, переключение на другие аккаунты")
+
+    def stats(self) -> List[Dict]:
+        """Статистика по аккаунтам пула"""
+        now = time.monotonic()
+        return [
+            {
+                'name': a.name,
+                'primary': a.primary,
+                'in_flight': a.in_flight,
+                'requests': a.requests,
+                'bytes': a.bytes,
+                'flood_waits': a.flood_waits,
+                'flood_remaining': max(a.flood_until - now, 0.0),
+            }
+            for a in self.accounts
+        ]
+
+
 class AsyncTelegramClient:
     """Асинхронный клиент Telegram с правильным управлением event loop"""
 
@@ -143,10 +3215,28 @@ class AsyncTelegramClient:
         self.is_connected = False
         self.code_callback_func = None
         self.loop = None
+        self.api_id = None
+        self.api_hash = None
+        self.pool = SessionPool()
+        # Потоки для записи на диск и файловых операций
+        self.io_executor = ThreadPoolExecutor(max_workers=WRITE_THREADS, thread_name_prefix='tg-io')
+        # Событие остановки режима наблюдения (None - наблюдение не запущено)
+        self._watch_stop = None
+        # Разрешённые чаты между запусками; фоновые обновления устаревших записей
+        self.peer_cache = PeerCache()
+        self._refresh_tasks = set()
+        # Окно одновременных запросов частей при загрузке документов
+        self.transfer_tuner = TransferTuner()
+        # Монитор задержек цикла, в котором работает клиент (задаёт владелец цикла)
+        self.loop_monitor: Optional[LoopMonitor] = None
 
     def create_client(self, api_id: int, api_hash: str):
         """Создание клиента Telegram"""
-        self.client = TelegramClient('tg_session', api_id, api_hash)
+        self.api_id = api_id
+        self.api_hash = api_hash
+        self.client = TelegramClient(SESSION_NAME, api_id, api_hash)
+        self.pool.clear()
+        self.pool.add(SESSION_NAME, self.client, primary=True, peer_cache=self.peer_cache)
 
     async def connect(self, phone: str, password: str = None, code_callback=None):
         """Подключение к Telegram"""
@@ -171,6 +3261,67 @@ class AsyncTelegramClient:
         except Exception as e:
             return False, f"Ошибка подключения: {str(e)}"
 
+    async def warm_connect(self, dc_ids=()):
+        """Фоновое подключение по уже авторизованной сессии, без интерактивного входа
+
+        Домашний DC открывается подключением, соединения к файловым DC из dc_ids
+        прогреваются в фоне, не задерживая результат.
+        """
+        try:
+            await self.client.connect()
+            if not await self.client.is_user_authorized():
+                await self.client.disconnect()
+                return False, "Сохранённая сессия не авторизована"
+        except Exception as e:
+            return False, f"Ошибка подключения: {str(e)}"
+
+        self.is_connected = True
+        primary = self.pool.accounts[0]
+        if dc_ids and primary.dc_pool.installed:
+            task = asyncio.ensure_future(primary.dc_pool.warm(dc_ids))
+            self._refresh_tasks.add(task)
+            task.add_done_callback(self._refresh_tasks.discard)
+        return True, "Подключено по сохранённой сессии"
+
+    def recent_dcs(self) -> List[int]:
+        """Файловые DC, к которым подключались аккаунты пула"""
+        return sorted({dc for account in self.pool.accounts for dc in account.dc_pool.used_dcs()})
+
+    async def add_pool_sessions(self, session_names: List[str]) -> List[str]:
+        """Подключение дополнительных авторизованных сессий к пулу"""
+        added = []
+        for name in session_names:
+            if name in (a.name for a in self.pool.accounts):
+                continue
+            client = TelegramClient(name, self.api_id, self.api_hash)
+            try:
+                await client.connect()
+                if not await client.is_user_authorized():
+                    print(f"Сессия {name} не авторизована, пропущена")
+                    await client.disconnect()
+                    continue
+            except Exception as e:
+                print(f"Не удалось подключить сессию {name}: {e}")
+                continue
+            self.pool.add(name, client, peer_cache=self.peer_cache)
+            added.append(name)
+
+        # С несколькими аккаунтами FloodWait не пересиживаем, а переключаемся
+        if self.pool.size > 1:
+            for account in self.pool.accounts:
+                account.client.flood_sleep_threshold = 0
+        return added
+
+    def connection_stats(self) -> Dict:
+        """Статистика аккаунтов пула и соединений к DC"""
+        return {
+            'accounts': self.pool.stats(),
+            'dc_pools': {a.name: a.dc_pool.stats() for a in self.pool.accounts},
+            'peer_cache': self.peer_cache.stats(),
+            'transfers': self.transfer_tuner.stats(),
+            'loop': self.loop_monitor.stats() if self.loop_monitor else None,
+        }
+
     async def _code_callback_wrapper(self):
         """Обертка для callback кода"""
         if self.code_callback_func:
@@ -178,96 +3329,855 @@ class AsyncTelegramClient:
         return None
 
     async def get_chat_info(self, chat_input: str):
-        """Получение информации о чате"""
-        try:
-            if chat_input.startswith('https://t.me/'):
-                chat_input = chat_input.replace('https://t.me/', '@')
+        """Получение информации о чате
+
+        Сначала смотрим в постоянный кеш (без сетевого запроса), затем разрешаем
+        по сети и запоминаем результат.
+        """
+        success, result, _ = await self._resolve_chat(chat_input)
+        return success, result
+
+    async def _resolve_chat(self, chat_input: str):
+        """get_chat_info с признаком ответа из кеша: (успех, чат или ошибка, из кеша)"""
+        key = normalize_chat_ref(chat_input)
+        record = self.peer_cache.get(SESSION_NAME, key)
+        entity = PeerCache.to_entity(record) if record else None
+        if entity is not None:
+            if time.time() - record['resolved_at'] > PEER_CACHE_TTL:
+                task = asyncio.ensure_future(self._refresh_peer(key, entity))
+                self._refresh_tasks.add(task)
+                task.add_done_callback(self._refresh_tasks.discard)
+            return True, entity, True
 
-            entity = await self.client.get_entity(chat_input)
-            return True, entity
+        try:
+            kind, _, value = key.partition(':')
+            if kind == 'username':
+                entity = await self.client.get_entity(value)
+            elif kind == 'channel':
+                entity = await self.client.get_entity(PeerChannel(int(value)))
+            elif kind == 'id':
+                entity = await self.client.get_entity(int(value))
+            else:
+                entity = await self.client.get_entity(value)
         except ValueError:
-            try:
-                entity = await self.client.get_entity(int(chat_input))
-                return True, entity
-            except:
-                return False, "Не удалось найти чат. Проверьте ссылку или ID"
+            return False, "Не удалось найти чат. Проверьте ссылку или ID", False
+        except errors.FloodWaitError as e:
+            return False, f"Слишком много запросов разрешения имён, подождите {e.seconds} с", False
         except Exception as e:
-            return False, f"Ошибка: {str(e)}"
+            return False, f"Ошибка: {str(e)}", False
 
-    async def get_all_files(self, entity, limit: int = 25000, selected_extensions: Set[str] = None,
-                            progress_callback=None):
-        """Получение всех файлов из чата"""
-        files = []
-        total_size = 0
-        processed_count = 0
+        self.peer_cache.put(SESSION_NAME, [key], entity)
+        return True, entity, False
 
-        async for message in self.client.iter_messages(entity, limit=limit):
-            if not self.is_connected:
+    async def _refresh_peer(self, key: str, entity):
+        """Фоновое обновление записи кеша: запрос по access hash, без разрешения username"""
+        try:
+            fresh = await self.client.get_entity(entity)
+            self.peer_cache.put(SESSION_NAME, [key], fresh)
+        except Exception as e:
+            print(f"Не удалось обновить чат {key} в кеше: {e}")
+
+    async def resolve_chats(self, chat_inputs: List[str]):
+        """Пакетное разрешение чатов: (список сущностей, {ввод: ошибка})
+
+        Чаты из кеша возвращаются сразу; сетевые разрешения идут по одному с
+        паузой RESOLVE_INTERVAL, чтобы не упереться в лимит на разрешение имён.
+        """
+        entities, failures = [], {}
+        for chat_input in chat_inputs:
+            success, result, cached = await self._resolve_chat(chat_input)
+            if success:
+                if all(result.id != entity.id for entity in entities):
+                    entities.append(result)
+            else:
+                failures[chat_input] = result
+            if not cached:
+                await asyncio.sleep(RESOLVE_INTERVAL)
+        return entities, failures
+
+    def parse_file_message(self, message, selected_extensions: Set[str] = None) -> Optional[FileInfo]:
+        """Информация о файле из сообщения, если он подходит под выбранные расширения"""
+        if not (message.media and isinstance(message.media, MessageMediaDocument)):
+            return None
+
+        doc = message.media.document
+        mime_type = doc.mime_type or ''
+
+        # Определяем расширение
+        extension = None
+        filename = None
+
+        # Ищем имя файла в атрибутах
+        for attr in doc.attributes:
+            if isinstance(attr, DocumentAttributeFilename):
+                filename = attr.file_name
+                _, ext = os.path.splitext(filename.lower())
+                extension = ext
                 break
 
-            processed_count += 1
+        # Если расширение не найдено в имени файла, определяем по MIME типу
+        if not extension and mime_type:
+            extension = MIME_TO_EXT.get(mime_type, '')
 
-            if progress_callback and processed_count % 50 == 0:
-                await progress_callback(processed_count)
+        # Если расширение найдено и оно выбрано пользователем
+        if not extension or (selected_extensions and extension not in selected_extensions):
+            return None
+
+        # Определяем категорию
+        category = EXTENSION_CATEGORIES.get(extension, 'Другие')
 
+        if not filename:
+            filename = f"file_{message.id}{extension}"
+
+        return FileInfo(
+            id=message.id,
+            filename=filename,
+            size_bytes=doc.size,
+            date=message.date,
+            mime_type=mime_type,
+            extension=extension,
+            category=category
+        )
+
+    async def get_all_files(self, entity, limit: int = 25000, selected_extensions: Set[str] = None,
+                            progress_callback=None, filters: ScanFilters = None,
+                            token: CancellationToken = None, captions: Dict[int, str] = None,
+                            checkpoints: ScanCheckpoints = None, from_scratch: bool = False):
+        """Получение всех файлов из чата
+
+        История читается конвейером HistoryReader: следующие страницы уже в пути,
+        пока разбирается текущая. При FloodWait сканирование продолжается с того же
+        места через другой аккаунт пула.
+        progress_callback(processed_count, found_count) вызывается каждые 50 сообщений.
+        Результат - компактный FileCatalog и суммарный размер; после отмены через
+        token возвращается уже найденное. В captions (если передан) собираются
+        подписи найденных файлов для поискового индекса.
+        С checkpoints позиция и найденное сохраняются каждые SCAN_CHECKPOINT_MESSAGES
+        сообщений или SCAN_CHECKPOINT_SECONDS секунд, а прерванное сканирование с теми
+        же параметрами продолжается с точки (сначала догоняются сообщения, пришедшие
+        после его начала); сколько восстановлено - в checkpoints.last_recovered.
+        from_scratch - сбросить точку и сканировать заново.
+        """
+        files = FileCatalog()
+        total_size = 0
+        processed_count = 0
+        offset_id = 0
+        top_id = 0  # самое новое сообщение на момент начала сканирования
+        filters = filters or ScanFilters()
+        reached_date_from = False
+        complete = False
+        reader = HistoryReader()
+
+        chat_id = getattr(entity, 'id', None)
+        params_key = None
+        unsaved = []  # найденное после последней контрольной точки
+        if checkpoints is not None:
+            if captions is None:
+                captions = {}
+            params_key = ScanCheckpoints.params_key(selected_extensions, filters, limit)
+            checkpoints.last_recovered = (0, 0)
+            loop = asyncio.get_running_loop()
+            if from_scratch:
+                await loop.run_in_executor(self.io_executor, checkpoints.finish, chat_id, params_key)
+            state = await loop.run_in_executor(self.io_executor, checkpoints.load, chat_id, params_key)
+            if state:
+                newer, newer_count, top_id = [], 0, state['top_id']
+                if state['top_id']:
+                    newer, newer_count, top_id = await self._with_account(
+                        entity, lambda account, chat: self._scan_newer(account, chat, state['top_id'],
+                                                                       selected_extensions, filters)
+                    )
+                for file_info, caption in newer:
+                    files.append(file_info)
+                    total_size += file_info.size_bytes
+                    unsaved.append(file_info)
+                    if caption:
+                        captions[file_info.id] = caption
+                for file_info, caption in state['files']:
+                    files.append(file_info)
+                    if caption:
+                        captions[file_info.id] = caption
+                offset_id = state['offset_id']
+                processed_count = state['processed'] + newer_count
+                total_size += state['total_size']
+                checkpoints.last_recovered = (len(state['files']), state['processed'])
+                print(f"Сканирование продолжено с контрольной точки: {len(state['files'])} файлов, "
+                      f"{state['processed']} сообщений; новых сообщений: {newer_count}")
+                if progress_callback:
+                    await progress_callback(processed_count, len(files))
+        saved_processed = processed_count
+        saved_at = time.monotonic()
+
+        def save_checkpoint():
+            nonlocal unsaved, saved_processed, saved_at
+            batch, unsaved = unsaved, []
+            checkpoints.save(chat_id, params_key, offset_id, top_id, processed_count, total_size,
+                             batch, captions)
+            saved_processed = processed_count
+            saved_at = time.monotonic()
+
+        try:
+            while (limit is None or processed_count < limit) and not reached_date_from:
+                if token is not None and token.cancelled:
+                    break
+                account = await self.pool.acquire(entity)
+                try:
+                    chat = await account.resolve(entity)
+                    remaining = None if limit is None else limit - processed_count
+                    # Верхняя граница даты уходит в запрос истории, дальше продолжаем по offset_id
+                    offset_date = filters.date_to if not offset_id else None
+                    history = reader.messages(account.client, chat, offset_id=offset_id,
+                                              offset_date=offset_date, limit=remaining)
+                    try:
+                        async for message in history:
+                            if token is not None and token.cancelled:
+                                break
+
+                            # История идёт от новых к старым: дальше сообщения только старше
+                            if filters.date_from is not None and message.date < filters.date_from:
+                                reached_date_from = True
+                                break
+
+                            processed_count += 1
+                            offset_id = message.id
+                            top_id = top_id or message.id
+
+                            if progress_callback and processed_count % 50 == 0:
+                                await progress_callback(processed_count, len(files))
+
+                            try:
+                                file_info = self.parse_file_message(message, selected_extensions)
+                                if file_info and filters.accepts_size(file_info.size_bytes):
+                                    total_size += file_info.size_bytes
+                                    files.append(file_info)
+                                    if captions is not None and message.message:
+                                        captions[file_info.id] = message.message
+                                    if checkpoints is not None:
+                                        unsaved.append(file_info)
+                            except Exception as e:
+                                print(f"Ошибка при обработке сообщения {message.id}: {str(e)}")
+
+                            if checkpoints is not None and (
+                                    processed_count - saved_processed >= SCAN_CHECKPOINT_MESSAGES
+                                    or time.monotonic() - saved_at >= SCAN_CHECKPOINT_SECONDS):
+                                await asyncio.get_running_loop().run_in_executor(self.io_executor,
+                                                                                 save_checkpoint)
+                    finally:
+                        # Отменяем страницы, запрошенные наперёд
+                        await history.aclose()
+                    break
+                except errors.FloodWaitError as e:
+                    reader.on_flood(e.seconds)
+                    self.pool.report_flood(account, e.seconds)
+                finally:
+                    self.pool.release(account)
+            complete = token is None or not token.cancelled
+        except asyncio.CancelledError:
+            if token is None or not token.absorb():
+                raise
+        finally:
+            # Завершённое сканирование убирает точку, прерванное (отмена, ошибка) - сохраняет
+            if checkpoints is not None:
+                try:
+                    if complete:
+                        await asyncio.get_running_loop().run_in_executor(
+                            self.io_executor, checkpoints.finish, chat_id, params_key
+                        )
+                    else:
+                        await asyncio.get_running_loop().run_in_executor(self.io_executor, save_checkpoint)
+                except sqlite3.Error as e:
+                    print(f"Не удалось сохранить контрольную точку сканирования: {e}")
+        return files, total_size
+
+    async def _scan_newer(self, account, chat, min_id: int, selected_extensions, filters: ScanFilters):
+        """Файлы из сообщений новее min_id: ([(FileInfo, подпись)], сколько сообщений, новый верхний id)"""
+        found = []
+        processed = 0
+        top_id = min_id
+        async for message in account.client.iter_messages(chat, min_id=min_id):
+            processed += 1
+            top_id = max(top_id, message.id)
+            if not filters.accepts_date(message.date):
+                continue
             try:
-                if message.media and isinstance(message.media, MessageMediaDocument):
-                    doc = message.media.document
-                    mime_type = doc.mime_type or ''
-
-                    # Определяем расширение
-                    extension = None
-                    filename = None
-
-                    # Ищем имя файла в атрибутах
-                    for attr in doc.attributes:
-                        if isinstance(attr, DocumentAttributeFilename):
-                            filename = attr.file_name
-                            _, ext = os.path.splitext(filename.lower())
-                            extension = ext
-                            break
-
-                    # Если расширение не найдено в имени файла, определяем по MIME типу
-                    if not extension and mime_type:
-                        extension = MIME_TO_EXT.get(mime_type, '')
-
-                    # Если расширение найдено и оно выбрано пользователем
-                    if extension and (not selected_extensions or extension in selected_extensions):
-                        # Определяем категорию
-                        category = EXTENSION_CATEGORIES.get(extension, 'Другие')
-
-                        if not filename:
-                            filename = f"file_{message.id}{extension}"
-
-                        file_size = doc.size
-                        total_size += file_size
-
-                        files.append(FileInfo(
-                            id=message.id,
-                            filename=filename,
-                            size_bytes=file_size,
-                            date=message.date,
-                            mime_type=mime_type,
-                            extension=extension,
-                            category=category
-                        ))
+                file_info = self.parse_file_message(message, selected_extensions)
             except Exception as e:
                 print(f"Ошибка при обработке сообщения {message.id}: {str(e)}")
                 continue
+            if file_info and filters.accepts_size(file_info.size_bytes):
+                found.append((file_info, message.message))
+        return found, processed, top_id
+
+    async def _with_account(self, chat, operation):
+        """Выполнение operation(account, entity) через аккаунт пула
+
+        При FloodWait операция повторяется через другой аккаунт.
+        """
+        while True:
+            account = await self.pool.acquire(chat)
+            try:
+                entity = await account.resolve(chat)
+                return await operation(account, entity)
+            except errors.FloodWaitError as e:
+                self.pool.report_flood(account, e.seconds)
+            finally:
+                self.pool.release(account)
+
+    async def download_file(self, chat, message_id, file_path, progress_callback=None, hasher=None,
+                            shards: TarShardWriter = None):
+        """Загрузка одного файла
+
+        Файл качается через наименее загруженный аккаунт пула; при FloodWait
+        загрузка повторяется через другой аккаунт. Документы известного размера
+        качаются частями с окном одновременных запросов (download_parts).
+        progress_callback(current, total) вызывается по мере получения байтов.
+        Запись идёт через AsyncFileWriter; hasher (StreamHasher) получает данные по мере записи.
+        С shards файл дописывается в tar-шард, file_path - имя внутри шарда.
+        """
+
+        async def operation(account, entity):
+            message = await account.client.get_messages(entity, ids=message_id)
+            if not (message and message.media):
+                return False, "Файл не найден"
+
+            if hasher:
+                hasher.reset()
+            size = message.file.size if message.file else None
+            if shards:
+                writer = ShardMemberWriter(shards, file_path, message_id, self.io_executor, size=size, hasher=hasher)
+            else:
+                writer = AsyncFileWriter(file_path, self.io_executor, size=size, hasher=hasher)
+            await writer.open()
+            try:
+                if isinstance(message.media, MessageMediaDocument) and message.media.document.size:
+                    await self.download_parts(account.client, message.media.document, writer,
+                                              progress_callback)
+                else:
+                    await account.client.download_media(message.media, writer,
+                                                        progress_callback=progress_callback)
+                await writer.close()
+            except BaseException:
+                await writer.abort()
+                raise
+            account.bytes += writer.written
+            return True, ""
+
+        try:
+            return await self._with_account(chat, operation)
+        except Exception as e:
+            return False, str(e)
+
+    async def download_thumbnails(self, chat, message_ids: List[int], cache: ThumbnailCache,
+                                  concurrency: int = THUMB_CONCURRENCY) -> Dict[int, str]:
+        """Пакетная загрузка только миниатюр документов
+
+        Возвращает {id сообщения: путь к миниатюре}; уже скачанные берутся из кеша.
+        """
+        loop = asyncio.get_running_loop()
+        result = {}
+
+        async def operation(account, entity):
+            messages = await account.client.get_messages(entity, ids=message_ids)
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def fetch(message):
+                if not (message and isinstance(message.media, MessageMediaDocument)):
+                    return
+                document = message.media.document
+                if not document.thumbs:
+                    return
+
+                cached = await loop.run_in_executor(self.io_executor, cache.get, document.id)
+                if cached:
+                    result[message.id] = cached
+                    return
+
+                async with semaphore:
+                    data = await account.client.download_media(message, file=bytes, thumb=-1)
+                if data:
+                    account.bytes += len(data)
+                    result[message.id] = await loop.run_in_executor(
+                        self.io_executor, cache.put, document.id, data
+                    )
+
+            await asyncio.gather(*(fetch(message) for message in messages if message and message.id not in result))
+
+        await self._with_account(chat, operation)
+        await loop.run_in_executor(self.io_executor, cache.trim)
+        return result
+
+    @property
+    def is_watching(self) -> bool:
+        return self._watch_stop is not None
+
+    def stop_watch(self):
+        """Остановка режима наблюдения (вызывается из потока event loop)"""
+        if self._watch_stop:
+            self._watch_stop.set()
+
+    async def watch(self, chats, journal: DownloadJournal, download_path: str, options: Dict,
+                    selected_extensions: Set[str] = None, filters: ScanFilters = None, on_event=None):
+        """Режим наблюдения: новые подходящие файлы чатов сразу ставятся в загрузку
+
+        Файлы приходят событиями NewMessage и Album, без опроса истории. Отбор - те же
+        расширения и ScanFilters, что и при сканировании. Каждый чат ведёт свою задачу
+        в журнале: уже скачанное из чата (любой задачей) повторно не качается, а
+        позиция последнего обработанного сообщения хранится в журнале - пропущенное
+        за время отключения (и между запусками) догоняется по истории.
+        on_event(text) получает сообщения о найденных и скачанных файлах.
+        Возвращает количество скачанных файлов после stop_watch().
+        """
+        filters = filters or ScanFilters()
+        stop = self._watch_stop = asyncio.Event()
+        pending = asyncio.Queue()
+        reserved_paths = set()
+        paths_lock = asyncio.Lock()
+        counters = {'downloaded': 0}
+        notify = on_event or print
+
+        def on_postprocess(result):
+            if result['error']:
+                notify(f"⚠️ Постобработка {os.path.basename(result['source'] or '')}: {result['error']}")
+            elif result['steps']:
+                notify(f"📂 {os.path.basename(result['source'])}: {', '.join(result['steps'])}")
+
+        postprocessor = PostProcessor(options.get('postprocess') or {}, download_path, on_result=on_postprocess,
+                                      keep_source=bool(options.get('hash_algorithms')))
+
+        # peer id события -> (чат, задача в журнале, манифест)
+        watched = {}
+        for entity in chats:
+            job_id = journal.watch_job(entity.id, getattr(entity, 'username', None) or str(entity.id),
+                                       download_path, options)
+            manifest = None
+            if options.get('hash_algorithms'):
+                manifest = ManifestWriter(os.path.join(download_path, f"manifest_job{job_id}.jsonl"))
+            watched[utils.get_peer_id(entity)] = (entity, job_id, manifest)
+
+            # Недокачанное в прошлый раз - первым в очередь
+            for file_info in journal.remaining_files(job_id):
+                pending.put_nowait((entity, job_id, manifest, file_info))
+
+        async def accept(peer_id, messages):
+            entity, job_id, manifest = watched[peer_id]
+            messages = [message for message in messages if message]
+            if not messages:
+                return
+            found = []
+            for message in messages:
+                try:
+                    file_info = self.parse_file_message(message, selected_extensions)
+                except Exception as e:
+                    print(f"Ошибка при обработке сообщения {message.id}: {str(e)}")
+                    continue
+                if file_info and filters.accepts_size(file_info.size_bytes) and filters.accepts_date(file_info.date):
+                    found.append(file_info)
+
+            known = journal.known_files(entity.id, job_id, [f.id for f in found])
+            fresh = [{'id': f.id, 'filename': f.filename, 'size': f.size_bytes, 'extension': f.extension,
+                      'state': DownloadJournal.PENDING, 'output_path': None}
+                     for f in found if f.id not in known]
+            if fresh:
+                # Сначала журнал, потом позиция: найденное не теряется при обрыве
+                journal.add_files(job_id, fresh)
+                for file_info in fresh:
+                    notify(f"🆕 {getattr(entity, 'title', entity.id)}: {file_info['filename']} "
+                           f"({format_size(file_info['size'])})")
+                    pending.put_nowait((entity, job_id, manifest, file_info))
+            journal.set_watch_position(entity.id, max(message.id for message in messages))
+
+        async def catch_up(peer_id):
+            entity, job_id, _ = watched[peer_id]
+            position = journal.watch_position(entity.id)
+            if position is None:
+                # Первый запуск: история не качается, наблюдаем с текущего сообщения
+                latest = await self.client.get_messages(entity, limit=1)
+                journal.set_watch_position(entity.id, latest[0].id if latest else 0)
+                return
+            batch = []
+            async for message in self.client.iter_messages(entity, min_id=position, reverse=True):
+                batch.append(message)
+                if len(batch) >= 100:
+                    await accept(peer_id, batch)
+                    batch = []
+            await accept(peer_id, batch)
+
+        async def on_message(event):
+            # Сообщения альбома обрабатываются одним событием Album
+            if event.message.grouped_id:
+                return
+            await accept(event.chat_id, [event.message])
+
+        async def on_album(event):
+            await accept(event.chat_id, event.messages)
+
+        async def download(entity, job_id, manifest, file_info):
+            file_path = file_info['output_path']
+            async with paths_lock:
+                if not file_path or file_info['state'] == DownloadJournal.PENDING:
+                    file_path = await asyncio.get_running_loop().run_in_executor(
+                        self.io_executor, resolve_output_path,
+                        file_info, download_path, options, reserved_paths
+                    )
+                reserved_paths.add(file_path)
+            journal.mark(job_id, file_info['id'], DownloadJournal.IN_FLIGHT, output_path=file_path)
+
+            hasher = StreamHasher(options['hash_algorithms']) if manifest else None
+            try:
+                success, error = await self.download_file(entity, file_info['id'], file_path, hasher=hasher)
+            finally:
+                reserved_paths.discard(file_path)
+            if success:
+                counters['downloaded'] += 1
+                journal.mark(job_id, file_info['id'], DownloadJournal.DONE)
+                if manifest:
+                    manifest.add({
+                        'message_id': file_info['id'],
+                        'chat': entity.id,
+                        'filename': file_info['filename'],
+                        'output_path': os.path.relpath(file_path, download_path),
+                        'size': hasher.size,
+                        **hasher.hexdigests(),
+                        'timestamp': datetime.now().isoformat(),
+                    })
+                notify(f"✅ Скачан: {os.path.basename(file_path)}")
+                await postprocessor.submit(file_path)
+            else:
+                journal.mark(job_id, file_info['id'], DownloadJournal.FAILED, error=error)
+                notify(f"❌ Ошибка при загрузке {file_info['filename']}: {error}")
+
+        async def worker():
+            while True:
+                entity, job_id, manifest, file_info = await pending.get()
+                try:
+                    await download(entity, job_id, manifest, file_info)
+                except Exception as e:
+                    # Ошибка диска или журнала на одном файле не должна останавливать наблюдение
+                    notify(f"❌ Ошибка при загрузке {file_info['filename']}: {e}")
+                    try:
+                        journal.mark(job_id, file_info['id'], DownloadJournal.FAILED, error=str(e))
+                    except sqlite3.Error as journal_error:
+                        print(f"Не удалось отметить ошибку в журнале: {journal_error}")
+
+        entities = [entity for entity, _, _ in watched.values()]
+        self.client.add_event_handler(on_message, events.NewMessage(chats=entities))
+        self.client.add_event_handler(on_album, events.Album(chats=entities))
+        workers = [asyncio.ensure_future(worker()) for _ in range(max(1, self.pool.size))]
+        try:
+            # Обработчики уже стоят, поэтому между догонялкой и событиями нет окна;
+            # пересечения отсекает known_files
+            for peer_id in watched:
+                await catch_up(peer_id)
+            notify(f"👁 Наблюдение за {len(watched)} чат(ами) запущено")
+
+            while not stop.is_set():
+                stopped = asyncio.ensure_future(stop.wait())
+                await asyncio.wait({stopped, self.client.disconnected}, return_when=asyncio.FIRST_COMPLETED)
+                stopped.cancel()
+                if stop.is_set():
+                    break
+
+                # Telethon сам переподключается при коротких обрывах; сюда попадаем,
+                # только если соединение закрыто совсем
+                notify("⚠️ Соединение потеряно, переподключаюсь...")
+                delay = 1
+                while not stop.is_set():
+                    try:
+                        await self.client.connect()
+                        break
+                    except Exception as e:
+                        print(f"Переподключение не удалось: {e}")
+                        await asyncio.sleep(delay)
+                        delay = min(delay * 2, WATCH_RECONNECT_MAX_DELAY)
+                if stop.is_set():
+                    break
+                for peer_id in watched:
+                    await catch_up(peer_id)
+        finally:
+            self.client.remove_event_handler(on_message)
+            self.client.remove_event_handler(on_album)
+            # Прерванные файлы остаются в журнале in_flight и докачиваются при следующем запуске
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            await postprocessor.drain()
+            self._watch_stop = None
+        return counters['downloaded']
+
+    async def download_parts(self, client, document, writer, progress_callback=None):
+        """Загрузка документа частями с окном одновременных запросов
+
+        Размер части выбирается по размеру файла (choose_part_size), окно - по
+        TransferTuner для DC документа. Части приходят в любом порядке, а в writer
+        уходят строго по порядку; вне порядка держится не больше окна частей.
+        Для чужого DC каждая часть занимает соединение из DcSenderPool, поэтому
+        там окно дополнительно ограничено размером пула.
+        """
+        size = document.size
+        dc_id = document.dc_id
+        part_size = choose_part_size(size)
+        parts = -(-size // part_size)
+        tuner = self.transfer_tuner
+        tuner.start(dc_id, part_size)
+        started = time.monotonic()
+
+        async def fetch(index):
+            # Каждая часть - своя задача, поэтому и свой счётчик ожидания соединения
+            setup = [0.0]
+            PART_SETUP_TIME.set(setup)
+            requested = time.monotonic()
+            data = b''
+            # Telethon возвращает соединение чужого DC в пул только в close(), а для
+            # полной части сам его не вызывает - без async with пул иссякает за max_per_dc частей
+            async with client.iter_download(document, offset=index * part_size, request_size=part_size,
+                                            limit=1, file_size=size) as chunks:
+                async for chunk in chunks:
+                    data = chunk
+            tuner.observe(dc_id, len(data), time.monotonic() - requested - setup[0], part_size)
+            return index, data
+
+        in_flight = set()
+        ready = {}  # номер части -> данные, пришедшие раньше предыдущих
+        next_request = next_write = 0
+        written = 0
+        try:
+            while next_write < parts:
+                while next_request < parts and len(in_flight) + len(ready) < tuner.window(dc_id):
+                    in_flight.add(asyncio.ensure_future(fetch(next_request)))
+                    next_request += 1
+
+                done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    index, data = task.result()
+                    if not data:
+                        raise IOError(f"Пустой ответ на часть {index} из {parts}")
+                    ready[index] = data
+
+                while next_write in ready:
+                    data = ready.pop(next_write)
+                    await writer.write(data)
+                    written += len(data)
+                    next_write += 1
+                    if progress_callback:
+                        result = progress_callback(written, size)
+                        if asyncio.iscoroutine(result):
+                            await result
+        finally:
+            for task in in_flight:
+                task.cancel()
+            if in_flight:
+                await asyncio.gather(*in_flight, return_exceptions=True)
+        tuner.finish(dc_id, written, time.monotonic() - started)
+
+    async def run_worker(self, journal: DownloadJournal, worker_id: str = None, download_path: str = None,
+                         concurrency: int = None, on_event=None) -> Dict[str, int]:
+        """Воркер распределённой загрузки: файлы берутся в аренду из общего хранилища задач
+
+        Одновременно качается до concurrency файлов (по умолчанию - по два на аккаунт пула);
+        аренда продлевается каждые HEARTBEAT_INTERVAL секунд. Ошибка возвращает файл
+        в очередь, после LEASE_MAX_ATTEMPTS попыток он помечается failed. Если аренду
+        успели передать другому воркеру, своя копия удаляется. Воркер завершается,
+        когда в распределённых задачах не осталось файлов; при отмене незаконченные
+        файлы сразу возвращаются в очередь.
+        В общей папке воркеры не видят пути друг друга, поэтому в имя файла входит
+        id сообщения, а качается он во временный файл со своим для воркера именем и
+        встаёт на место только после подтверждения в хранилище.
+        download_path - своя папка воркера вместо папки из задачи.
+        """
+        worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        worker_tag = re.sub(r'[^\w.-]', '_', worker_id)
+        concurrency = concurrency or 2 * max(1, self.pool.size)
+        notify = on_event or print
+        counters = {'downloaded': 0, 'failed': 0}
+        chats = {}         # chat_ref -> сущность (или None, если чат недоступен этому аккаунту)
+        manifests = {}     # job_id -> ManifestWriter
+        postprocessors = {}
+        reserved_paths = set()
+        paths_lock = asyncio.Lock()
+
+        async def store(method, *args):
+            # Хранилище на общем томе может ждать блокировку до 30 с - не в потоке цикла
+            return await asyncio.get_running_loop().run_in_executor(self.io_executor, method, *args)
+
+        def on_postprocess(result):
+            if result['error']:
+                notify(f"⚠️ Постобработка {os.path.basename(result['source'] or '')}: {result['error']}")
+
+        async def download(file_info):
+            job_id, message_id = file_info['job_id'], file_info['id']
+            options = file_info['options']
+            job_path = download_path or file_info['download_path']
+
+            chat_ref = file_info['chat_ref']
+            if chat_ref not in chats:
+                success, entity = await self.get_chat_info(chat_ref)
+                chats[chat_ref] = entity if success else None
+            entity = chats[chat_ref]
+            if entity is None:
+                await store(journal.release, worker_id, job_id, message_id,
+                            f"Чат {chat_ref} недоступен воркеру {worker_id}")
+                counters['failed'] += 1
+                return
+
+            async with paths_lock:
+                file_path = await asyncio.get_running_loop().run_in_executor(
+                    self.io_executor, resolve_output_path,
+                    {**file_info, 'filename': f"{message_id}_{file_info['filename']}"},
+                    job_path, options, reserved_paths
+                )
+                reserved_paths.add(file_path)
+            staging_path = f"{file_path}.{worker_tag}"
+            if job_id not in manifests:
+                manifests[job_id] = (ManifestWriter(os.path.join(job_path, f"manifest_job{job_id}.jsonl"))
+                                     if options.get('hash_algorithms') else None)
+                postprocessors[job_id] = PostProcessor(options.get('postprocess') or {}, job_path,
+                                                       on_result=on_postprocess,
+                                                       keep_source=manifests[job_id] is not None)
+            manifest = manifests[job_id]
+
+            try:
+                hasher = StreamHasher(options['hash_algorithms']) if manifest else None
+                success, error = await self.download_file(entity, message_id, staging_path, hasher=hasher)
+            finally:
+                reserved_paths.discard(file_path)
+            if not success:
+                state = await store(journal.release, worker_id, job_id, message_id, error)
+                counters['failed'] += 1
+                notify(f"❌ {file_info['filename']}: {error}"
+                       f"{' (попытки исчерпаны)' if state == DownloadJournal.FAILED else ''}")
+                return
+
+            if not await store(journal.complete, worker_id, job_id, message_id, file_path):
+                # Аренда истекла и файл уже у другого воркера - удаляем только свою копию
+                await store(os.remove, staging_path)
+                notify(f"⚠️ {file_info['filename']}: аренда потеряна, копия удалена")
+                return
+            await store(os.replace, staging_path, file_path)
+            counters['downloaded'] += 1
+            if manifest:
+                manifest.add({
+                    'message_id': message_id,
+                    'chat': file_info['chat_id'],
+                    'filename': file_info['filename'],
+                    'output_path': os.path.relpath(file_path, job_path),
+                    'size': hasher.size,
+                    **hasher.hexdigests(),
+                    'worker': worker_id,
+                    'timestamp': datetime.now().isoformat(),
+                })
+            notify(f"✅ Скачан: {os.path.basename(file_path)}")
+            await postprocessors[job_id].submit(file_path)
+
+        async def process(file_info):
+            try:
+                await download(file_info)
+            except Exception as e:
+                # Неожиданная ошибка не должна держать аренду до конца работы воркера
+                await store(journal.release, worker_id, file_info['job_id'], file_info['id'], str(e))
+                counters['failed'] += 1
+                print(f"Ошибка воркера на {file_info['filename']}: {e}")
+
+        async def heartbeat():
+            while True:
+                await asyncio.sleep(HEARTBEAT_INTERVAL)
+                await asyncio.get_running_loop().run_in_executor(
+                    self.io_executor, journal.heartbeat, worker_id, LEASE_SECONDS,
+                    counters['downloaded'], counters['failed']
+                )
 
-        return files, total_size
+        notify(f"Воркер {worker_id}: до {concurrency} файлов одновременно")
+        await store(journal.heartbeat, worker_id)
+        beat = asyncio.ensure_future(heartbeat())
+        running = set()
+        try:
+            while True:
+                if len(running) < concurrency:
+                    for file_info in await store(journal.claim, worker_id, concurrency - len(running)):
+                        running.add(asyncio.ensure_future(process(file_info)))
+                if not running:
+                    if not await store(journal.has_distributed_work):
+                        break
+                    # Остальное в аренде у других воркеров: ждём возврата или окончания
+                    await asyncio.sleep(WORKER_POLL_INTERVAL)
+                    continue
+                _, running = await asyncio.wait(running, timeout=WORKER_POLL_INTERVAL,
+                                                return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            beat.cancel()
+            for task in running:
+                task.cancel()
+            await asyncio.gather(beat, *running, return_exceptions=True)
+            await store(journal.release_worker, worker_id)
+            await store(journal.heartbeat, worker_id, LEASE_SECONDS, counters['downloaded'], counters['failed'])
+            for postprocessor in postprocessors.values():
+                await postprocessor.drain()
+        return counters
+
+    @staticmethod
+    async def read_range(client, media, offset: int, length: int, file_size: int = None) -> bytes:
+        """Чтение диапазона байтов документа без загрузки файла целиком"""
+        request_size = RANGE_REQUEST_SIZE
+        start = offset - offset % request_size
+        chunks = -(-(offset + length - start) // request_size)
+        data = bytearray()
+        # async with возвращает соединение чужого DC в пул, даже если диапазон кончился до конца файла
+        async with client.iter_download(media, offset=start, request_size=request_size,
+                                        limit=chunks, file_size=file_size) as parts:
+            async for chunk in parts:
+                data += chunk
+        return bytes(data[offset - start:offset - start + length])
+
+    async def inspect_archive(self, chat, message_id, cache: 'ArchiveIndex' = None):
+        """Оглавление ZIP-архива по хвосту файла (EOCD и центральный каталог)
+
+        Читаются только килобайты с конца документа; результат кешируется по id документа.
+        """
+        chat_id = getattr(chat, 'id', None)
+        if cache:
+            cached = cache.get(chat_id, message_id)
+            if cached:
+                return True, cached
+
+        async def operation(account, entity):
+            message = await account.client.get_messages(entity, ids=message_id)
+            if not (message and isinstance(message.media, MessageMediaDocument)):
+                return None
+            document = message.media.document
+            size = document.size
+            fetched = 0
+
+            async def fetch(offset, length):
+                nonlocal fetched
+                fetched += length
+                return await self.read_range(account.client, message.media, offset, length, size)
+
+            tail_length = min(size, ZIP_TAIL_SIZE)
+            tail = await fetch(size - tail_length, tail_length)
+            members = await read_zip_directory(tail, size - tail_length, fetch)
+            account.bytes += fetched
+            return {
+                'document_id': document.id,
+                'chat_id': chat_id,
+                'message_id': message_id,
+                'name': message.file.name if message.file else None,
+                'size': size,
+                'fetched_bytes': fetched,
+                'members': members,
+            }
 
-    async def download_file(self, chat, message_id, file_path):
-        """Загрузка одного файла"""
         try:
-            message = await self.client.get_messages(chat, ids=message_id)
-            if message and message.media:
-                await self.client.download_media(message.media, file_path)
-                return True, ""
-            return False, "Файл не найден"
+            listing = await self._with_account(chat, operation)
+        except ValueError as e:
+            return False, f"Не удалось прочитать архив: {e}"
         except Exception as e:
             return False, str(e)
 
+        if listing is None:
+            return False, "Файл не найден"
+        if cache:
+            cache.store(listing)
+        return True, listing
+
 
 class ExtensionSelector:
     """Виджет для выбора расширений файлов"""
@@ -424,16 +4334,44 @@ class TelegramDownloaderGUI:
         # Инициализация переменных
         self.client = AsyncTelegramClient()
         self.selected_files = []
-        self.all_files = []
+        self.all_files = FileCatalog()
+        self.sort_keys: List[Tuple[str, bool]] = []  # (колонка таблицы, по убыванию)
         self.total_size_mb = 0
         self.file_count = 0
         self.current_chat = None
+        self.download_chat = None  # чат текущей загрузки (задача из журнала может быть не из current_chat)
         self.is_connected = False
         self.is_scanning = False
         self.is_downloading = False
+        self.download_progress = None
+        self.download_job_id = None
+        self.download_paused = False
+        self.download_resume_event = None
+
+        # Фоновые задачи: id -> Job; у сканирования и загрузки свои ссылки для отмены
+        self.jobs: Dict[int, Job] = {}
+        self.scan_job = None
+        self.download_job = None
+        self.watch_job = None
+
+        # Журнал задач загрузки
+        self.journal = DownloadJournal()
+
+        # Кеш оглавлений архивов
+        self.archive_index = ArchiveIndex()
+
+        # Кеш миниатюр для предпросмотра
+        self.thumbnail_cache = ThumbnailCache()
+
+        # Полнотекстовый индекс файлов всех просканированных чатов и задачи из поиска в очереди
+        self.search_index = SearchIndex()
+        self.queued_jobs = deque()
+
+        # Контрольные точки прерванных сканирований (переживают перезапуск)
+        self.scan_checkpoints = ScanCheckpoints()
 
         # Настройки
-        self.settings_file = 'tg_downloader_settings.json'
+        self.settings_file = SETTINGS_FILE
         self.settings = {}
 
         # Инициализация селектора расширений
@@ -448,12 +4386,17 @@ class TelegramDownloaderGUI:
         # Настройка прокрутки колесиком мыши
         self.setup_mouse_wheel_scroll()
 
+        # Незавершённые задачи из прошлых запусков
+        unfinished = self.journal.unfinished_jobs()
+        if unfinished:
+            self.resume_job_btn.config(state='normal')
+
         # Для Windows настраиваем event loop policy
         if sys.platform == 'win32':
             asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
-        # СОЗДАЁМ LOOP ОДИН РАЗ
-        self.loop = asyncio.new_event_loop()
+        # СОЗДАЁМ LOOP ОДИН РАЗ (реализация - из настроек, по умолчанию uvloop, если есть)
+        self.loop, self.loop_backend = create_event_loop(self.settings.get('event_loop', 'auto'))
         asyncio.set_event_loop(self.loop)
 
         # Запускаем loop в отдельном потоке
@@ -466,6 +4409,21 @@ class TelegramDownloaderGUI:
         self.debug_queue = queue.Queue()
         self.start_debug_monitor()
 
+        # Блокирующие вызовы в потоке цикла останавливают все загрузки - следим за ними
+        self.loop_monitor = LoopMonitor(on_stall=self._on_loop_stall)
+        self.loop_monitor.start(self.loop)
+        self.client.loop_monitor = self.loop_monitor
+        self.root.after(1000, self._refresh_loop_health)
+
+        self.crypto_backend = detect_crypto_backend()
+        self.debug_log(f"Event loop: {self.loop_backend}, расшифровка MTProto: {self.crypto_backend}")
+        if self.crypto_backend == 'python':
+            self.debug_log("Ускоренная криптография не найдена: установите cryptg, "
+                           "иначе загрузка упрётся в CPU", "WARNING")
+
+        # Авторизованная сессия уже есть - подключаемся сразу, не дожидаясь кнопки
+        self._start_warm_connect()
+
     def debug_log(self, message, level="INFO"):
         """Запись отладочного сообщения"""
         timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
@@ -475,6 +4433,23 @@ class TelegramDownloaderGUI:
         # Также выводим в консоль для удобства
         print(full_message)
 
+    def _on_loop_stall(self, seconds, stack):
+        """Цикл заблокирован дольше порога (вызывается из сторожевого потока)"""
+        self.debug_log(f"Event loop заблокирован на {seconds * 1000:.0f} мс, стек потока цикла:", "WARNING")
+        if stack:
+            self.debug_log(stack.rstrip(), "TRACEBACK")
+
+    def _refresh_loop_health(self):
+        """Перцентили задержки цикла в панели дебага, раз в секунду"""
+        if hasattr(self, 'loop_health_label'):
+            stats = self.loop_monitor.stats()
+            self.loop_health_label.config(
+                text=f"Задержка цикла p50 {stats['p50_ms']:.1f} / p95 {stats['p95_ms']:.1f} / "
+                     f"p99 {stats['p99_ms']:.1f} мс, блокировок {stats['slow_callbacks']}",
+                foreground='red' if stats['p99_ms'] >= stats['threshold_ms'] else 'black'
+            )
+        self.root.after(1000, self._refresh_loop_health)
+
     def start_debug_monitor(self):
         """Запуск мониторинга отладочных сообщений"""
 
@@ -491,51 +4466,97 @@ class TelegramDownloaderGUI:
 
         self.root.after(100, check_queue)
 
-    def run_async_task(self, async_func, *args):
-        """Запускает асинхронную функцию с правильным управлением event loop"""
+    def run_async_task(self, async_func, *args) -> Job:
+        """Запускает асинхронную функцию как отслеживаемую задачу
+
+        Функция получает токен отмены первым аргументом и возвращает типизированный
+        результат (ScanResult, DownloadResult, ...). Задачи идут параллельно;
+        Job.cancel() прерывает задачу на текущем запросе.
+        """
+        job = Job(async_func.__name__)
 
         async def wrapper():
+            job.token.bind(asyncio.current_task())
             try:
-                self.debug_log(f"Запуск асинхронной задачи: {async_func.__name__}")
-                result = await async_func(*args)
-                self.debug_log(f"Задача {async_func.__name__} завершена успешно")
-                self.root.after(0, self._on_async_complete, *result)
+                self.debug_log(f"Запуск асинхронной задачи #{job.id}: {job.name}")
+                result = await async_func(job.token, *args)
+                self.debug_log(f"Задача #{job.id} {job.name} завершена за {time.monotonic() - job.started:.2f} с")
+                self.root.after(0, self._on_async_complete, job, result)
+                return result
+            except asyncio.CancelledError:
+                # Отмена, которую задача не поглотила сама, не дошла бы до интерфейса
+                self.debug_log(f"Задача #{job.id} {job.name} отменена")
+                self.root.after(0, self._on_job_cancelled, job)
+                raise
             except Exception as e:
-                error_msg = f"Ошибка в задаче {async_func.__name__}: {str(e)}"
+                error_msg = f"Ошибка в задаче {job.name}: {str(e)}"
                 self.debug_log(error_msg, "ERROR")
                 self.debug_log(traceback.format_exc(), "TRACEBACK")
-                self.root.after(0, self._on_async_error, str(e))
-
-        asyncio.run_coroutine_threadsafe(wrapper(), self.loop)
-
-    def _on_async_complete(self, *args):
-        """Обработка завершения асинхронной задачи"""
-        self.debug_log(f"_on_async_complete вызван с аргументами: {args}")
-
-        if len(args) == 2:
-            if args[0] == "success":
-                # Это результат загрузки чата
-                self._on_chat_load_success(args[1])
-            elif args[0] == "error":
-                # Это ошибка загрузки чата
-                self._on_chat_load_error(args[1])
-            elif args[0] == "estimate":
-                # Это оценка размера
-                self._on_estimate_complete(args[1], args[2])
-            elif args[0] == "scan":
-                # Это результат сканирования
-                self._on_scan_complete(args[1], args[2], args[3])
-            elif isinstance(args[0], bool):
-                # Это результат подключения
-                self._on_connect_complete(args[0], args[1])
-        elif len(args) == 4 and args[0] == "scan_progress":
-            # Это прогресс сканирования
-            self._on_scan_progress(args[1], args[2], args[3])
-
-    def _on_async_error(self, error):
+                self.root.after(0, self._on_async_error, job, str(e))
+            finally:
+                self.jobs.pop(job.id, None)
+
+        self.jobs[job.id] = job
+        job.future = asyncio.run_coroutine_threadsafe(wrapper(), self.loop)
+        return job
+
+    def _on_async_complete(self, job, result):
+        """Обработка результата асинхронной задачи по его типу"""
+        self.debug_log(f"Результат задачи #{job.id} {job.name}: {type(result).__name__}")
+
+        handlers = {
+            ConnectResult: lambda r: self._on_connect_complete(r.success, r.message),
+            WarmConnectResult: self._on_warm_connect_complete,
+            ChatResult: lambda r: (self._on_chat_load_success(r.chat_name) if r.success
+                                   else self._on_chat_load_error(r.error)),
+            EstimateResult: lambda r: self._on_estimate_complete(r.file_count, r.total_mb),
+            ScanResult: lambda r: self._on_scan_complete(r.files, len(r.files), r.total_mb, r.cancelled,
+                                                         r.recovered_files, r.recovered_messages),
+            DownloadResult: lambda r: self._on_download_complete(r.downloaded, r.total, r.cancelled),
+            ThumbnailsResult: lambda r: self._on_thumbnails_ready(r.thumbs),
+            ArchiveResult: lambda r: (self._on_archive_inspected(r.listing) if r.success
+                                      else self._on_archive_error(r.error)),
+            ResumeResult: self._on_resume_ready,
+            WatchResult: lambda r: self._on_watch_stopped(r.downloaded),
+            BenchmarkResult: self._on_benchmark_complete,
+        }
+        handler = handlers.get(type(result))
+        if handler is None:
+            self.debug_log(f"Нет обработчика для результата {result!r}", "WARNING")
+            return
+        handler(result)
+
+    def _on_job_cancelled(self, job):
+        """Задача прервана отменой без результата: возвращаем её кнопки в исходное состояние"""
+        if job is self.scan_job:
+            self._reset_scan_ui("Сканирование остановлено")
+        elif job is self.download_job:
+            self.is_downloading = False
+            self.download_job = None
+            self.download_paused = False
+            self.start_download_btn.config(state='normal')
+            self.pause_download_btn.config(state='disabled', text="Приостановить")
+            self.cancel_download_btn.config(state='disabled')
+            self.status_label.config(text="Загрузка отменена")
+            self._drop_queued_jobs("загрузка отменена")
+            if self.journal.unfinished_jobs():
+                self.resume_job_btn.config(state='normal')
+
+    def _on_async_error(self, job, error):
         """Обработка ошибки асинхронной задачи"""
-        self.debug_log(f"_on_async_error: {error}", "ERROR")
-        messagebox.showerror("Асинхронная ошибка", f"Ошибка: {error}")
+        self.debug_log(f"_on_async_error (#{job.id} {job.name}): {error}", "ERROR")
+        if job is self.scan_job:
+            self._reset_scan_ui("Ошибка сканирования")
+        elif job is self.download_job:
+            self._on_download_error(error)
+            return
+        self._show_error(f"Ошибка: {error}")
+
+    def _show_error(self, message):
+        """Ошибка фоновой операции вне задач (экспорт, проверка манифеста)"""
+        self.debug_log(message, "ERROR")
+        self.status_label.config(text=message)
+        messagebox.showerror("Асинхронная ошибка", message)
 
     def setup_mouse_wheel_scroll(self):
         """Настройка прокрутки колесиком мыши для всех виджетов"""
@@ -651,6 +4672,7 @@ class TelegramDownloaderGUI:
             ("API Hash:", "api_hash_var", True),
             ("Номер телефона:", "phone_var", True),
             ("Пароль 2FA (если есть):", "password_var", False),
+            ("Доп. сессии (через ,):", "pool_sessions_var", False),
         ]
 
         self.entries = []  # Список для хранения ссылок на поля ввода
@@ -873,6 +4895,11 @@ class TelegramDownloaderGUI:
                                    command=self.scan_files, state='disabled')
         self.scan_btn.pack(side='left', padx=5)
 
+        # Остановленное сканирование продолжается с контрольной точки; эта кнопка её сбрасывает
+        self.rescan_btn = ttk.Button(btn_frame, text="🔄 Заново",
+                                     command=lambda: self.scan_files(from_scratch=True), state='disabled')
+        self.rescan_btn.pack(side='left', padx=5)
+
         self.stop_scan_btn = ttk.Button(btn_frame, text="⏹️ Остановить",
                                         command=self.stop_scanning, state='disabled')
         self.stop_scan_btn.pack(side='left', padx=5)
@@ -914,6 +4941,9 @@ class TelegramDownloaderGUI:
         # Добавляем поддержку вставки для поля поиска
         self.setup_context_menu(self.search_entry)
 
+        ttk.Button(search_frame, text="🌐 Во всех чатах",
+                   command=self.open_global_search).pack(side='left', padx=5)
+
         # Фильтр по категориям
         category_frame = ttk.Frame(filter_frame)
         category_frame.pack(fill='x', pady=5)
@@ -926,6 +4956,25 @@ class TelegramDownloaderGUI:
         self.category_combo.pack(side='left', padx=10)
         self.category_combo.bind('<<ComboboxSelected>>', lambda e: self.filter_files())
 
+        # Фильтры сканирования: применяются при запросе истории, а не к таблице
+        range_frame = ttk.Frame(filter_frame)
+        range_frame.pack(fill='x', pady=5)
+
+        ttk.Label(range_frame, text="Дата с:").pack(side='left')
+        self.scan_date_from_var = tk.StringVar()
+        ttk.Entry(range_frame, textvariable=self.scan_date_from_var, width=12).pack(side='left', padx=5)
+        ttk.Label(range_frame, text="по:").pack(side='left')
+        self.scan_date_to_var = tk.StringVar()
+        ttk.Entry(range_frame, textvariable=self.scan_date_to_var, width=12).pack(side='left', padx=5)
+
+        ttk.Label(range_frame, text="Размер от:").pack(side='left', padx=(15, 0))
+        self.scan_min_size_var = tk.StringVar()
+        ttk.Entry(range_frame, textvariable=self.scan_min_size_var, width=8).pack(side='left', padx=5)
+        ttk.Label(range_frame, text="до:").pack(side='left')
+        self.scan_max_size_var = tk.StringVar()
+        ttk.Entry(range_frame, textvariable=self.scan_max_size_var, width=8).pack(side='left', padx=5)
+        ttk.Label(range_frame, text="МБ (даты - ГГГГ-ММ-ДД, применяются при сканировании)").pack(side='left')
+
         # Таблица файлов с двойной прокруткой
         table_frame = ttk.Frame(self.files_frame)
         table_frame.pack(fill='both', expand=True, padx=20, pady=10)
@@ -941,6 +4990,8 @@ class TelegramDownloaderGUI:
         self.files_tree.heading('Тип', text='Тип')
         self.files_tree.heading('Категория', text='Категория')
         self.files_tree.heading('Дата', text='Дата')
+        # Клик по заголовку - сортировка, Shift+клик - дополнительный ключ
+        self.files_tree.bind('<Button-1>', self._on_tree_heading_click)
 
         self.files_tree.column('Выбор', width=50, anchor='center')
         self.files_tree.column('Имя файла', width=300)
@@ -974,6 +5025,15 @@ class TelegramDownloaderGUI:
         ttk.Button(select_frame, text="Инвертировать выбор",
                    command=self.invert_selection).pack(side='left', padx=5)
 
+        ttk.Button(select_frame, text="💾 Экспорт",
+                   command=self.export_file_catalog).pack(side='right', padx=5)
+        ttk.Button(select_frame, text="🖼 Превью",
+                   command=self.preview_thumbnails).pack(side='right', padx=5)
+        ttk.Button(select_frame, text="🔎 Поиск по архивам",
+                   command=self.search_archives).pack(side='right', padx=5)
+        ttk.Button(select_frame, text="📦 Содержимое архива",
+                   command=self.inspect_selected_archive).pack(side='right', padx=5)
+
         # Подсветка выбранных файлов
         self.files_tree.tag_configure('selected', background='#e0f7fa')
 
@@ -1024,6 +5084,65 @@ class TelegramDownloaderGUI:
         ttk.Checkbutton(settings_frame, text="Перезаписывать существующие файлы",
                         variable=self.overwrite_files_var).pack(anchor='w', pady=5)
 
+        # Для чатов с огромным числом мелких файлов: шарды вместо отдельных файлов
+        self.shard_output_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(settings_frame,
+                        text=f"Упаковывать в tar-шарды до {format_size(SHARD_MAX_BYTES)} ({SHARD_DIR}, с индексом)",
+                        variable=self.shard_output_var).pack(anchor='w', pady=5)
+
+        # Контрольные суммы считаются на лету при записи и попадают в манифест задачи
+        hash_frame = ttk.Frame(settings_frame)
+        hash_frame.pack(fill='x', pady=5)
+
+        self.hash_files_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(hash_frame, text="Считать SHA-256 и вести манифест",
+                        variable=self.hash_files_var).pack(side='left')
+
+        self.hash_blake3_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(hash_frame, text="+ BLAKE3" if blake3 else "+ BLAKE3 (не установлен)",
+                        variable=self.hash_blake3_var,
+                        state='normal' if blake3 else 'disabled').pack(side='left', padx=10)
+
+        # Постобработка: распаковка архивов и пользовательская команда в пуле процессов
+        post_frame = ttk.Frame(settings_frame)
+        post_frame.pack(fill='x', pady=5)
+
+        self.postprocess_extract_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(post_frame, text="Распаковывать zip/tar и .gz/.bz2/.xz",
+                        variable=self.postprocess_extract_var).pack(side='left')
+
+        ttk.Label(post_frame, text="куда:").pack(side='left', padx=(10, 0))
+        self.postprocess_layout_var = tk.StringVar(value='subfolder')
+        ttk.Combobox(post_frame, textvariable=self.postprocess_layout_var, values=POSTPROCESS_LAYOUTS,
+                     state='readonly', width=10).pack(side='left', padx=5)
+
+        self.postprocess_delete_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(post_frame, text="Удалять архив после распаковки",
+                        variable=self.postprocess_delete_var).pack(side='left', padx=10)
+
+        hook_frame = ttk.Frame(settings_frame)
+        hook_frame.pack(fill='x', pady=5)
+
+        ttk.Label(hook_frame, text="Команда после загрузки:").pack(side='left')
+        self.postprocess_command_var = tk.StringVar()
+        self.postprocess_command_entry = ttk.Entry(hook_frame, textvariable=self.postprocess_command_var, width=40)
+        self.postprocess_command_entry.pack(side='left', padx=10, fill='x', expand=True)
+        self.setup_context_menu(self.postprocess_command_entry)
+        ttk.Label(hook_frame, text="({path}, {dir})").pack(side='left')
+
+        # Режим наблюдения: новые файлы из чатов скачиваются сами
+        watch_frame = ttk.LabelFrame(self.download_frame, text="Режим наблюдения", padding=10)
+        watch_frame.pack(fill='x', padx=20, pady=5)
+
+        ttk.Label(watch_frame, text="Доп. чаты (через ,):").pack(side='left')
+        self.watch_chats_var = tk.StringVar()
+        self.watch_chats_entry = ttk.Entry(watch_frame, textvariable=self.watch_chats_var, width=40)
+        self.watch_chats_entry.pack(side='left', padx=10, fill='x', expand=True)
+        self.setup_context_menu(self.watch_chats_entry)
+
+        self.watch_btn = ttk.Button(watch_frame, text="👁 Наблюдать", command=self.toggle_watch)
+        self.watch_btn.pack(side='right')
+
         # Информация о загрузке
         info_frame = ttk.LabelFrame(self.download_frame, text="Информация о загрузке", padding=15)
         info_frame.pack(fill='x', padx=20, pady=10)
@@ -1045,6 +5164,16 @@ class TelegramDownloaderGUI:
         self.progress_label = ttk.Label(progress_frame, text="0% (0/0)")
         self.progress_label.pack()
 
+        # Побайтовый прогресс текущего файла
+        self.file_progress_bar = ttk.Progressbar(progress_frame, length=400, mode='determinate')
+        self.file_progress_bar.pack(fill='x', pady=5)
+
+        self.file_progress_label = ttk.Label(progress_frame, text="")
+        self.file_progress_label.pack()
+
+        self.speed_label = ttk.Label(progress_frame, text="Скорость: -- | Осталось: --:--")
+        self.speed_label.pack()
+
         # Лог загрузки
         log_frame = ttk.LabelFrame(self.download_frame, text="Лог загрузки", padding=10)
         log_frame.pack(fill='both', expand=True, padx=20, pady=10)
@@ -1075,9 +5204,16 @@ class TelegramDownloaderGUI:
                                               state='disabled')
         self.cancel_download_btn.pack(side='left', padx=5)
 
+        self.resume_job_btn = ttk.Button(button_frame, text="Продолжить незавершённую",
+                                         command=self.resume_unfinished_download,
+                                         state='disabled')
+        self.resume_job_btn.pack(side='left', padx=5)
+
         # Кнопка открытия папки
         ttk.Button(button_frame, text="Открыть папку загрузки",
                    command=self.open_download_folder).pack(side='right', padx=5)
+        ttk.Button(button_frame, text="Проверить по манифесту",
+                   command=self.verify_download_manifest).pack(side='right', padx=5)
 
     def setup_debug_tab(self):
         """Вкладка дебага"""
@@ -1094,6 +5230,20 @@ class TelegramDownloaderGUI:
                    command=self.export_debug_log).pack(side='left', padx=5)
         ttk.Button(control_frame, text="Тестовое сообщение",
                    command=self.test_debug_message).pack(side='left', padx=5)
+        ttk.Button(control_frame, text="Статистика соединений",
+                   command=self.show_connection_stats).pack(side='left', padx=5)
+        ttk.Button(control_frame, text="Бенчмарк",
+                   command=self.run_benchmark).pack(side='left', padx=5)
+
+        ttk.Label(control_frame, text="Event loop:").pack(side='left', padx=(15, 5))
+        self.event_loop_var = tk.StringVar(value='auto')
+        loop_combo = ttk.Combobox(control_frame, textvariable=self.event_loop_var,
+                                  values=EVENT_LOOP_BACKENDS, width=8, state='readonly')
+        loop_combo.pack(side='left')
+        loop_combo.bind('<<ComboboxSelected>>', self._on_event_loop_selected)
+
+        self.loop_health_label = ttk.Label(control_frame, text="Задержка цикла: -")
+        self.loop_health_label.pack(side='left', padx=(15, 5))
 
         # Панель фильтров
         filter_frame = ttk.LabelFrame(self.debug_frame, text="Фильтры", padding=10)
@@ -1183,11 +5333,20 @@ class TelegramDownloaderGUI:
         self.phone = phone
         self.password = password
 
+        # Дополнительные авторизованные сессии для пула
+        self.pool_sessions = [name.strip() for name in self.pool_sessions_var.get().split(',') if name.strip()]
+        self.settings['pool_sessions'] = self.pool_sessions_var.get().strip()
+        self._save_settings()
+
         # Запускаем асинхронную задачу
         self.run_async_task(self._async_connect)
 
-    async def _async_connect(self):
+    async def _async_connect(self, token):
         """Асинхронное подключение"""
+        # Подключение, открытое при запуске по сохранённой сессии, используем повторно
+        if self.client.is_connected and self.client.api_id == self.api_id:
+            return ConnectResult(True, "Уже подключено по сохранённой сессии")
+
         # Создаем клиента
         self.client.create_client(self.api_id, self.api_hash)
 
@@ -1201,7 +5360,79 @@ class TelegramDownloaderGUI:
             code_callback
         )
 
-        return success, message
+        if success and self.pool_sessions:
+            added = await self.client.add_pool_sessions(self.pool_sessions)
+            self.debug_log(f"Пул сессий: подключено {len(added)} доп. аккаунтов: {', '.join(added) or 'нет'}")
+            message += f"\nАккаунтов в пуле: {self.client.pool.size}"
+
+        return ConnectResult(success, message)
+
+    def _start_warm_connect(self):
+        """Фоновое подключение при запуске по сохранённой авторизованной сессии"""
+        api_id = str(self.settings.get('api_id', '')).strip()
+        api_hash = self.settings.get('api_hash', '')
+        if not (api_id.isdigit() and api_hash and os.path.exists(f"{SESSION_NAME}.session")):
+            return
+
+        self.debug_log("Найдена сохранённая сессия, подключаюсь в фоне")
+        self.connection_status.config(text="⏳ Подключаюсь по сохранённой сессии...", foreground='orange')
+        self.connect_btn.config(state='disabled')
+        self.api_id = int(api_id)
+        self.api_hash = api_hash
+        pool_sessions = [name.strip() for name in self.settings.get('pool_sessions', '').split(',') if name.strip()]
+        self.run_async_task(self._async_warm_connect, pool_sessions,
+                            self.settings.get('last_chat', ''), self.settings.get('recent_dcs', []))
+
+    async def _async_warm_connect(self, token, pool_sessions, last_chat, recent_dcs):
+        """Подключение, доп. сессии пула и разрешение последнего чата"""
+        started = time.monotonic()
+        self.client.create_client(self.api_id, self.api_hash)
+        success, message = await self.client.warm_connect(recent_dcs)
+        if not success:
+            return WarmConnectResult(False, message, elapsed=time.monotonic() - started)
+
+        # Доп. сессии и последний чат - параллельно: чат обычно берётся из кеша
+        async def add_pool():
+            if pool_sessions:
+                await self.client.add_pool_sessions(pool_sessions)
+
+        async def resolve_last_chat():
+            if not last_chat:
+                return None
+            ok, entity = await self.client.get_chat_info(last_chat)
+            return entity if ok else None
+
+        _, chat = await asyncio.gather(add_pool(), resolve_last_chat())
+        chat_name = ''
+        if chat is not None:
+            self.current_chat = chat
+            chat_name = getattr(chat, 'title', getattr(chat, 'username', 'Неизвестно'))
+        return WarmConnectResult(True, message, chat_name, time.monotonic() - started)
+
+    def _on_warm_connect_complete(self, result):
+        """Результат фонового подключения при запуске"""
+        self.debug_log(f"Фоновое подключение: {result.message} за {result.elapsed:.2f} с")
+        self.connect_btn.config(state='normal')
+        if not result.success:
+            self.connection_status.config(text="❌ Не подключено", foreground='red')
+            return
+
+        self.is_connected = True
+        self.connection_status.config(text="✅ Подключено", foreground='green')
+        self.load_chat_btn.config(state='normal')
+        self.disconnect_btn.config(state='normal')
+        self.draw_connection_indicator(True)
+        if result.chat_name:
+            if not self.chat_link_var.get().strip():
+                self.chat_link_var.set(self.settings.get('last_chat', ''))
+            self._on_chat_load_success(result.chat_name)
+
+    def _remember_recent_dcs(self):
+        """Запоминаем файловые DC для прогрева при следующем запуске"""
+        dcs = self.client.recent_dcs()
+        if dcs and dcs != self.settings.get('recent_dcs'):
+            self.settings['recent_dcs'] = dcs
+            self._save_settings()
 
     def _on_connect_complete(self, success, message):
         """Обработка завершения подключения"""
@@ -1269,6 +5500,8 @@ class TelegramDownloaderGUI:
 
         if self.client.is_connected:
             # Здесь нужно реализовать отключение
+            for job in list(self.jobs.values()):
+                job.cancel()
             self.is_connected = False
             self.client.is_connected = False
             self.connection_status.config(text="❌ Не подключено", foreground='red')
@@ -1302,16 +5535,16 @@ class TelegramDownloaderGUI:
         # Запускаем асинхронную задачу
         self.run_async_task(self._async_load_chat, chat_link)
 
-    async def _async_load_chat(self, chat_link):
+    async def _async_load_chat(self, token, chat_link):
         """Асинхронная загрузка информации о чате"""
         success, result = await self.client.get_chat_info(chat_link)
 
         if success:
             self.current_chat = result
             chat_name = getattr(result, 'title', getattr(result, 'username', 'Неизвестно'))
-            return "success", chat_name
+            return ChatResult(True, chat_name=chat_name)
         else:
-            return "error", result
+            return ChatResult(False, error=result)
 
     def _on_chat_load_success(self, chat_name):
         """Обработка успешной загрузки чата"""
@@ -1319,9 +5552,16 @@ class TelegramDownloaderGUI:
 
         self.chat_info_label.config(text=f"✅ Чат: {chat_name}")
         self.scan_btn.config(state='normal')
+        self.rescan_btn.config(state='normal')
         self.load_chat_btn.config(state='normal')
         self.status_label.config(text="Готов")
 
+        # Последний чат разрешается заранее при следующем запуске
+        chat_link = self.chat_link_var.get().strip()
+        if chat_link and self.settings.get('last_chat') != chat_link:
+            self.settings['last_chat'] = chat_link
+            self._save_settings()
+
         # Запрашиваем предварительную оценку размера
         self.estimate_size()
 
@@ -1346,19 +5586,20 @@ class TelegramDownloaderGUI:
         # Запускаем асинхронную задачу
         self.run_async_task(self._async_estimate_size)
 
-    async def _async_estimate_size(self):
+    async def _async_estimate_size(self, token):
         """Асинхронная оценка размера"""
         selected_extensions = self.extension_selector.get_selected_extensions()
         files, total_size = await self.client.get_all_files(
             self.current_chat,
             limit=100,
-            selected_extensions=selected_extensions
+            selected_extensions=selected_extensions,
+            token=token
         )
 
         total_mb = total_size / (1024 * 1024)
         file_count = len(files)
 
-        return "estimate", file_count, total_mb
+        return EstimateResult(file_count, total_mb)
 
     def _on_estimate_complete(self, file_count, total_mb):
         """Обработка завершения оценки размера"""
@@ -1373,9 +5614,9 @@ class TelegramDownloaderGUI:
                 text="📊 Файлы выбранных типов не найдены"
             )
 
-    def scan_files(self):
-        """Сканирование файлов в чате"""
-        self.debug_log("Начало сканирования файлов")
+    def scan_files(self, from_scratch=False):
+        """Сканирование файлов в чате (from_scratch - без продолжения с контрольной точки)"""
+        self.debug_log(f"Начало сканирования файлов{' заново' if from_scratch else ''}")
 
         if not self.current_chat:
             error_msg = "Сначала загрузите чат"
@@ -1383,6 +5624,14 @@ class TelegramDownloaderGUI:
             messagebox.showerror("Ошибка", error_msg)
             return
 
+        try:
+            filters = self._get_scan_filters()
+        except ValueError as e:
+            error_msg = f"Некорректный фильтр: {e}"
+            self.debug_log(error_msg, "ERROR")
+            messagebox.showerror("Ошибка", error_msg)
+            return
+
         # Получаем выбранные расширения
         selected_extensions = self.extension_selector.get_selected_extensions()
         if not selected_extensions:
@@ -1394,56 +5643,106 @@ class TelegramDownloaderGUI:
         # Обновляем интерфейс
         self.is_scanning = True
         self.scan_btn.config(state='disabled')
+        self.rescan_btn.config(state='disabled')
         self.stop_scan_btn.config(state='normal')
         self.status_label.config(text="Сканирую файлы...")
         self.scan_progress_label.config(text="Обработано: 0 сообщений")
 
         # Очищаем список файлов
-        self.all_files = []
+        self.all_files = FileCatalog()
         self.files_tree.delete(*self.files_tree.get_children())
 
         # Запускаем асинхронную задачу
-        self.run_async_task(self._async_scan_files, selected_extensions)
+        # Tk-переменные читаются только в потоке GUI
+        self.scan_job = self.run_async_task(self._async_scan_files, selected_extensions, filters, from_scratch,
+                                            self.chat_link_var.get().strip())
+
+    def _get_scan_filters(self) -> ScanFilters:
+        """Фильтры сканирования из полей вкладки файлов"""
+        min_size = self.scan_min_size_var.get().strip().replace(',', '.')
+        max_size = self.scan_max_size_var.get().strip().replace(',', '.')
+        filters = ScanFilters(
+            date_from=parse_date_bound(self.scan_date_from_var.get()),
+            date_to=parse_date_bound(self.scan_date_to_var.get(), end_of_day=True),
+            min_size=int(float(min_size) * 1024 * 1024) if min_size else None,
+            max_size=int(float(max_size) * 1024 * 1024) if max_size else None,
+        )
+        if filters.date_from and filters.date_to and filters.date_from >= filters.date_to:
+            raise ValueError("начальная дата позже конечной")
+        return filters
 
-    async def _async_scan_files(self, selected_extensions):
+    async def _async_scan_files(self, token, selected_extensions, filters=None, from_scratch=False, chat_ref=''):
         """Асинхронное сканирование файлов"""
 
-        async def progress_callback(processed_count):
+        async def progress_callback(processed_count, found_count):
             # Отправляем промежуточные результаты
             if processed_count % 100 == 0:
-                self.root.after(0, self._on_scan_progress, "scan_progress", processed_count, len(self.all_files), 0)
+                self.root.after(0, self._on_scan_progress, processed_count, found_count, 0)
 
+        captions = {}
         files, total_size = await self.client.get_all_files(
             self.current_chat,
             limit=25000,
             selected_extensions=selected_extensions,
-            progress_callback=progress_callback
+            progress_callback=progress_callback,
+            filters=filters,
+            token=token,
+            captions=captions,
+            checkpoints=self.scan_checkpoints,
+            from_scratch=from_scratch
         )
 
         self.all_files = files
         total_mb = total_size / (1024 * 1024)
 
-        return "scan", files, len(files), total_mb
+        # Найденное (и после остановки тоже) попадает в глобальный поиск
+        chat = self.current_chat
+        indexed = await asyncio.get_running_loop().run_in_executor(
+            self.client.io_executor, self.search_index.index_chat,
+            chat.id, getattr(chat, 'title', None) or getattr(chat, 'username', None) or str(chat.id),
+            chat_ref, files, captions
+        )
+        self.debug_log(f"В поисковый индекс добавлено {indexed} файлов")
+
+        recovered_files, recovered_messages = self.scan_checkpoints.last_recovered
+        return ScanResult(files, total_mb, cancelled=token.cancelled,
+                          recovered_files=recovered_files, recovered_messages=recovered_messages)
 
     def _on_scan_progress(self, processed_count, found_files, total_mb):
         """Обработка прогресса сканирования"""
         self.scan_progress_label.config(text=f"Обработано: {processed_count} сообщений, найдено: {found_files} файлов")
 
-    def _on_scan_complete(self, files, file_count, total_mb):
-        """Обработка завершения сканирования"""
-        self.debug_log(f"Сканирование завершено: найдено {file_count} файлов, {total_mb:.2f} MB")
-
+    def _reset_scan_ui(self, status):
+        """Возврат кнопок сканирования в исходное состояние"""
         self.is_scanning = False
+        self.scan_job = None
         self.scan_btn.config(state='normal')
+        self.rescan_btn.config(state='normal')
         self.stop_scan_btn.config(state='disabled')
         self.scan_progress_label.config(text="")
-        self.status_label.config(text="Сканирование завершено")
+        self.status_label.config(text=status)
+
+    def _on_scan_complete(self, files, file_count, total_mb, cancelled=False,
+                          recovered_files=0, recovered_messages=0):
+        """Обработка завершения сканирования (после остановки - с уже найденными файлами)"""
+        self.debug_log(f"Сканирование {'остановлено' if cancelled else 'завершено'}: "
+                       f"найдено {file_count} файлов, {total_mb:.2f} MB")
+        self.debug_log(f"Каталог в памяти: {format_size(files.memory_usage())}")
+        status = "Сканирование остановлено" if cancelled else "Сканирование завершено"
+        if recovered_messages:
+            self.debug_log(f"Восстановлено из контрольной точки: {recovered_files} файлов, "
+                           f"{recovered_messages} сообщений")
+            status += f" (из контрольной точки: {recovered_files} файлов, {recovered_messages} сообщений)"
+        if cancelled:
+            self.debug_log("Позиция сохранена, повторное сканирование продолжит с неё")
+
+        self._reset_scan_ui(status)
 
         # Обновляем статистику
         self.total_files_label.config(text=f"Всего файлов: {file_count}")
         self.total_size_label.config(text=f"Общий размер: {total_mb:.1f} MB")
 
-        # Заполняем таблицу файлами
+        # Заполняем таблицу файлами (порядок задаст _apply_file_view)
         for file in files:
             size_mb = file.size_bytes / (1024 * 1024)
             date_str = file.date.strftime("%Y-%m-%d %H:%M")
@@ -1453,29 +5752,27 @@ class TelegramDownloaderGUI:
             if len(display_name) > 50:
                 display_name = display_name[:47] + "..."
 
-            item_id = self.files_tree.insert("", "end", values=(
+            # iid строки - id сообщения (теги заняты подсветкой выбора)
+            self.files_tree.insert("", "end", iid=str(file.id), values=(
                 "☐",
                 display_name,
                 f"{size_mb:.1f} MB",
                 file.extension,
                 file.category,
                 date_str
-            ), tags=(str(file.id),))
+            ))
 
+        self._apply_file_view()
         self._update_selection_count()
 
     def stop_scanning(self):
-        """Остановка сканирования"""
+        """Остановка сканирования: задача прерывается на текущем запросе истории"""
         self.debug_log("Остановка сканирования файлов")
 
-        self.is_scanning = False
-        self.client.is_connected = False  # Это прервет цикл сканирования
-        self.status_label.config(text="Сканирование остановлено")
-        self.scan_btn.config(state='normal')
+        if self.scan_job:
+            self.scan_job.cancel()
         self.stop_scan_btn.config(state='disabled')
-
-        # Восстанавливаем соединение
-        self.client.is_connected = True
+        self.status_label.config(text="Останавливаю сканирование...")
 
     # ========== МЕТОДЫ ДЛЯ РАБОТЫ С ФАЙЛАМИ ==========
 
@@ -1521,20 +5818,16 @@ class TelegramDownloaderGUI:
         for item in self.files_tree.get_children():
             if self.files_tree.set(item, 'Выбор') == '☑':
                 selected += 1
-                # Получаем размер из таблицы
-                size_str = self.files_tree.set(item, 'Размер')
-                if 'MB' in size_str:
-                    try:
-                        size_mb = float(size_str.replace(' MB', ''))
-                        total_size += size_mb
-                    except:
-                        pass
+                # Размер берём из каталога, а не из отформатированной строки таблицы
+                file = self.all_files.get(int(item))
+                if file:
+                    total_size += file.size_bytes
 
         self.selected_count_label.config(text=f"Выбрано: {selected}")
 
         # Обновляем информацию в вкладке загрузки
         self.download_info_label.config(text=f"Выбрано файлов: {selected}")
-        self.download_size_label.config(text=f"Общий размер: {total_size:.1f} MB")
+        self.download_size_label.config(text=f"Общий размер: {format_size(total_size)}")
 
         # Активируем кнопку загрузки если есть выбранные файлы
         if selected > 0:
@@ -1544,20 +5837,414 @@ class TelegramDownloaderGUI:
 
     def filter_files(self):
         """Фильтрация файлов по поиску и категории"""
+        self._apply_file_view()
+
+    def open_global_search(self):
+        """Окно поиска по всем просканированным чатам с загрузкой найденного"""
+        stats = self.search_index.stats()
+        window = tk.Toplevel(self.root)
+        window.title(f"Поиск по всем чатам ({stats['files']} файлов в {stats['chats']} чатах)")
+        window.geometry("1000x600")
+
+        query_frame = ttk.Frame(window, padding=10)
+        query_frame.pack(fill='x')
+        query_var = tk.StringVar(value=self.search_var.get())
+        query_entry = ttk.Entry(query_frame, textvariable=query_var, width=50)
+        query_entry.pack(side='left', fill='x', expand=True)
+        self.setup_context_menu(query_entry)
+        ttk.Label(query_frame, text='слова ищутся по началу, "фраза" - целиком').pack(side='left', padx=10)
+
+        facet_frame = ttk.Frame(window, padding=(10, 0))
+        facet_frame.pack(fill='x')
+        facet_vars = {}
+        for key, label, width in (('extensions', "Расширения:", 15), ('min_size', "Размер от, МБ:", 8),
+                                  ('max_size', "до:", 8), ('date_from', "Дата с:", 12), ('date_to', "по:", 12)):
+            ttk.Label(facet_frame, text=label).pack(side='left', padx=(10, 0))
+            facet_vars[key] = tk.StringVar()
+            ttk.Entry(facet_frame, textvariable=facet_vars[key], width=width).pack(side='left', padx=5)
+
+        status_label = ttk.Label(window, text="", padding=(10, 5))
+        status_label.pack(fill='x')
+
+        columns = ('Чат', 'Имя файла', 'Размер', 'Дата', 'Подпись')
+        tree = ttk.Treeview(window, columns=columns, show='headings', selectmode='extended')
+        for column, width in zip(columns, (150, 330, 80, 120, 280)):
+            tree.heading(column, text=column)
+            tree.column(column, width=width)
+        tree.pack(fill='both', expand=True, padx=10)
+        results = {}
+
+        def run_search(event=None):
+            try:
+                extensions = ['.' + ext.strip().lstrip('.').lower()
+                              for ext in facet_vars['extensions'].get().replace(',', ' ').split() if ext.strip('.')]
+                min_size = facet_vars['min_size'].get().strip().replace(',', '.')
+                max_size = facet_vars['max_size'].get().strip().replace(',', '.')
+                facets = {
+                    'extensions': extensions or None,
+                    'min_size': int(float(min_size) * 1024 * 1024) if min_size else None,
+                    'max_size': int(float(max_size) * 1024 * 1024) if max_size else None,
+                    'date_from': parse_date_bound(facet_vars['date_from'].get()),
+                    'date_to': parse_date_bound(facet_vars['date_to'].get(), end_of_day=True),
+                }
+            except ValueError as e:
+                messagebox.showerror("Ошибка", f"Неверный фильтр: {e}", parent=window)
+                return
+
+            started = time.perf_counter()
+            try:
+                rows = self.search_index.search(query_var.get(), **facets)
+                counts = self.search_index.facet_counts(query_var.get(), **facets)
+            except sqlite3.OperationalError as e:
+                status_label.config(text=f"Ошибка запроса: {e}")
+                return
+            elapsed = (time.perf_counter() - started) * 1000
+
+            results.clear()
+            tree.delete(*tree.get_children())
+            for row in rows:
+                item = f"{row['chat_id']}:{row['id']}"
+                results[item] = row
+                tree.insert('', 'end', iid=item, values=(
+                    row['chat_title'],
+                    row['filename'],
+                    format_size(row['size']),
+                    row['date'].astimezone().strftime("%Y-%m-%d %H:%M") if row['date'] else '',
+                    (row['caption'] or '').replace('\n', ' ')[:100],
+                ))
+            total = sum(counts.values())
+            top = ', '.join(f"{ext or '?'}: {count}" for ext, count in list(counts.items())[:8])
+            status_label.config(text=f"Найдено {total} (показано {len(rows)}) за {elapsed:.0f} мс   {top}")
+            self.debug_log(f"Глобальный поиск {query_var.get()!r}: {total} файлов за {elapsed:.1f} мс")
+
+        def queue_selected():
+            chosen = [results[item] for item in tree.selection()]
+            if not chosen:
+                messagebox.showerror("Ошибка", "Выберите файлы в результатах", parent=window)
+                return
+            self._queue_search_downloads(chosen)
+
+        query_entry.bind('<Return>', run_search)
+        button_frame = ttk.Frame(window, padding=10)
+        button_frame.pack(fill='x')
+        ttk.Button(button_frame, text="🔍 Найти", command=run_search).pack(side='left')
+        ttk.Button(button_frame, text="⬇ Скачать выбранные", command=queue_selected).pack(side='left', padx=10)
+        query_entry.focus_set()
+        if query_var.get():
+            run_search()
+
+    def _queue_search_downloads(self, rows):
+        """Задачи загрузки из результатов поиска: по одной на чат, запускаются по очереди"""
+        if not self.is_connected:
+            messagebox.showerror("Ошибка", "Сначала подключитесь к Telegram")
+            return
+        download_path = self.download_path_var.get()
+        if not download_path or not os.path.exists(download_path):
+            messagebox.showerror("Ошибка", "Выберите корректную папку для загрузки")
+            return
+
+        by_chat = {}
+        for row in rows:
+            by_chat.setdefault((row['chat_id'], row['chat_ref']), []).append(
+                {'id': row['id'], 'filename': row['filename'], 'size': row['size'], 'extension': row['extension']}
+            )
+        options = self._download_options()
+        for (chat_id, chat_ref), files in by_chat.items():
+            job_id = self.journal.create_job(chat_id, chat_ref or str(chat_id), download_path, files, options)
+            self.queued_jobs.append(job_id)
+            self.debug_log(f"Задача #{job_id} из поиска: {len(files)} файлов из чата {chat_ref or chat_id}")
+
+        self.log_text.insert(tk.END, f"В очереди {len(rows)} файлов из {len(by_chat)} чат(ов)\n")
+        if not self.is_downloading:
+            self._start_next_queued_job()
+
+    def _on_tree_heading_click(self, event):
+        """Сортировка по клику на заголовок колонки (Shift - добавить ключ)"""
+        if self.files_tree.identify_region(event.x, event.y) != 'heading':
+            return
+        column = self.files_tree.column(self.files_tree.identify_column(event.x), 'id')
+        if column not in TREE_SORT_COLUMNS:
+            return
+
+        positions = {name: index for index, (name, _) in enumerate(self.sort_keys)}
+        if event.state & 0x0001:
+            # Shift: добавляем ключ или меняем его направление
+            if column in positions:
+                index = positions[column]
+                self.sort_keys[index] = (column, not self.sort_keys[index][1])
+            else:
+                self.sort_keys.append((column, False))
+        elif len(self.sort_keys) == 1 and column in positions:
+            self.sort_keys = [(column, not self.sort_keys[0][1])]
+        else:
+            self.sort_keys = [(column, False)]
+
+        self.debug_log("Сортировка: " + ", ".join(
+            f"{name} {'↓' if descending else '↑'}" for name, descending in self.sort_keys))
+        self._update_sort_headings()
+        self._apply_file_view()
+
+    def _update_sort_headings(self):
+        """Стрелки направления и номера ключей в заголовках таблицы"""
+        positions = {name: (index, descending) for index, (name, descending) in enumerate(self.sort_keys)}
+        for column in TREE_SORT_COLUMNS:
+            text = column
+            if column in positions:
+                index, descending = positions[column]
+                text += " ▼" if descending else " ▲"
+                if len(self.sort_keys) > 1:
+                    text += str(index + 1)
+            self.files_tree.heading(column, text=text)
+
+    def _apply_file_view(self):
+        """Порядок и видимость строк таблицы по сортировке и фильтрам
+
+        Строки не пересоздаются: готовый порядок передаётся в таблицу одним
+        вызовом set_children, скрытые фильтром строки при этом отсоединяются.
+        """
+        catalog = self.all_files
         search_text = self.search_var.get().lower()
         selected_category = self.category_var.get()
 
-        for item in self.files_tree.get_children():
-            filename = self.files_tree.set(item, 'Имя файла').lower()
-            category = self.files_tree.set(item, 'Категория')
+        started = time.perf_counter()
+        keys = [(TREE_SORT_COLUMNS[column], descending) for column, descending in self.sort_keys]
+        if not keys:
+            order = range(len(catalog))
+        elif any(column is None for column, _ in keys):
+            # Отметка выбора живёт в таблице, а не в каталоге - такой порядок не кешируем
+            checked = {int(item) for item in self.files_tree.tag_has('selected')}
+            ids = catalog.ids
+            functions = []
+            for column, descending in keys:
+                if column is None:
+                    sign = -1 if descending else 1
+                    functions.append(lambda index, sign=sign: sign * (ids[index] in checked))
+                else:
+                    functions.append(catalog.sort_key(column, descending))
+            order = sorted(range(len(catalog)), key=lambda index: tuple(f(index) for f in functions))
+        else:
+            order = catalog.sort_permutation(keys)
+
+        category_code = None
+        if selected_category != "Все":
+            category_code = catalog.categories.lookup(selected_category)
+            if category_code is None:
+                order = ()
+
+        ids = catalog.ids
+        category_codes = catalog.category_codes
+        visible = []
+        for index in order:
+            if category_code is not None and category_codes[index] != category_code:
+                continue
+            if search_text and search_text not in catalog.filename_at(index).lower():
+                continue
+            visible.append(str(ids[index]))
+
+        self.files_tree.set_children('', *visible)
+        self.debug_log(f"Таблица: {len(visible)} из {len(catalog)} строк "
+                       f"за {(time.perf_counter() - started) * 1000:.0f} мс")
+
+    def export_file_catalog(self):
+        """Экспорт результатов сканирования в CSV, JSONL или Parquet"""
+        if not self.all_files:
+            messagebox.showerror("Ошибка", "Сначала отсканируйте чат")
+            return
+
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=".csv",
+            filetypes=[("CSV", "*.csv"), ("JSON Lines", "*.jsonl"), ("Parquet", "*.parquet")],
+            initialfile=f"catalog_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+        )
+        if not file_path:
+            return
+
+        files = self.all_files
+        chat_id = getattr(self.current_chat, 'id', None)
+        self.debug_log(f"Экспорт каталога ({len(files)} файлов) в {file_path}")
+        self.status_label.config(text="Экспорт каталога...")
+
+        def worker():
+            try:
+                started = time.monotonic()
+                count = export_catalog(files, file_path, chat_id=chat_id)
+                self.root.after(0, self._on_export_complete, file_path, count, time.monotonic() - started)
+            except Exception as e:
+                self.root.after(0, self._show_error, f"Ошибка экспорта: {e}")
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    def _on_export_complete(self, file_path, count, elapsed):
+        """Завершение экспорта каталога"""
+        self.debug_log(f"Экспортировано {count} строк в {file_path} за {elapsed:.2f} с")
+        self.status_label.config(text=f"Экспортировано: {count}")
+        messagebox.showinfo("Экспорт", f"Экспортировано {count} файлов\n{file_path}")
+
+    def preview_thumbnails(self):
+        """Предпросмотр миниатюр отмеченных (или видимых) файлов"""
+        items = [item for item in self.files_tree.get_children()
+                 if self.files_tree.set(item, 'Выбор') == '☑']
+        if not items:
+            items = list(self.files_tree.get_children())
+        items = items[:PREVIEW_MAX_ITEMS]
+        if not items:
+            messagebox.showerror("Ошибка", "Нет файлов для предпросмотра")
+            return
+
+        message_ids = [int(item) for item in items]
+        self.debug_log(f"Загрузка миниатюр для {len(message_ids)} файлов")
+        self.status_label.config(text="Загружаю миниатюры...")
+        self.run_async_task(self._async_download_thumbnails, message_ids)
 
-            match_search = not search_text or search_text in filename
-            match_category = selected_category == "Все" or category == selected_category
+    async def _async_download_thumbnails(self, token, message_ids):
+        """Асинхронная загрузка миниатюр"""
+        thumbs = await self.client.download_thumbnails(self.current_chat, message_ids, self.thumbnail_cache)
+        return ThumbnailsResult(thumbs)
 
-            if match_search and match_category:
-                self.files_tree.attached(item)
+    def _on_thumbnails_ready(self, thumbs):
+        """Окно предпросмотра миниатюр; клик по миниатюре отмечает файл"""
+        self.debug_log(f"Получено миниатюр: {len(thumbs)}")
+        self.status_label.config(text="Готов")
+        if not thumbs:
+            messagebox.showinfo("Превью", "У выбранных файлов нет миниатюр")
+            return
+
+        items = set(self.files_tree.get_children())
+        catalog = self.all_files
+
+        window = tk.Toplevel(self.root)
+        window.title(f"Превью ({len(thumbs)})")
+        window.geometry("900x600")
+        if ImageTk is None:
+            ttk.Label(window, text="Для показа изображений установите Pillow",
+                      foreground='orange').pack(anchor='w', padx=10, pady=5)
+
+        canvas = tk.Canvas(window)
+        scrollbar = ttk.Scrollbar(window, orient='vertical', command=canvas.yview)
+        grid = ttk.Frame(canvas)
+        grid.bind("<Configure>", lambda e: canvas.configure(scrollregion=canvas.bbox("all")))
+        canvas.create_window((0, 0), window=grid, anchor='nw')
+        canvas.configure(yscrollcommand=scrollbar.set)
+        canvas.pack(side='left', fill='both', expand=True)
+        scrollbar.pack(side='right', fill='y')
+
+        window.images = []  # ссылки на PhotoImage, иначе их соберёт GC
+        for index, (message_id, path) in enumerate(thumbs.items()):
+            cell = ttk.Frame(grid, padding=5)
+            cell.grid(row=index // 5, column=index % 5, sticky='n')
+
+            if ImageTk is not None:
+                try:
+                    image = Image.open(path)
+                    image.thumbnail((160, 160))
+                    photo = ImageTk.PhotoImage(image)
+                    window.images.append(photo)
+                    picture = ttk.Label(cell, image=photo)
+                except Exception as e:
+                    picture = ttk.Label(cell, text=f"[{e}]", width=20)
             else:
-                self.files_tree.detach(item)
+                picture = ttk.Label(cell, text="[миниатюра]", width=20)
+            picture.pack()
+
+            file = catalog.get(message_id)
+            name = file.filename if file else str(message_id)
+            ttk.Label(cell, text=name if len(name) <= 24 else name[:21] + "...").pack()
+
+            item = str(message_id)
+            if item in items:
+                picture.bind('<Button-1>', lambda e, i=item: self._toggle_file_item(i))
+
+    def _toggle_file_item(self, item):
+        """Переключить отметку файла в таблице"""
+        checked = self.files_tree.set(item, 'Выбор') != '☑'
+        self.files_tree.set(item, 'Выбор', '☑' if checked else '☐')
+        self.files_tree.item(item, tags=('selected',) if checked else ())
+        self._update_selection_count()
+
+    def inspect_selected_archive(self):
+        """Оглавление выделенного ZIP-архива без его загрузки"""
+        item = self.files_tree.focus()
+        if not item:
+            messagebox.showerror("Ошибка", "Выделите ZIP-архив в таблице")
+            return
+        if self.files_tree.set(item, 'Тип') != '.zip':
+            messagebox.showerror("Ошибка", "Просмотр содержимого доступен только для .zip")
+            return
+
+        message_id = int(item)
+        self.debug_log(f"Чтение оглавления архива из сообщения {message_id}")
+        self.status_label.config(text="Читаю оглавление архива...")
+        self.run_async_task(self._async_inspect_archive, message_id)
+
+    async def _async_inspect_archive(self, token, message_id):
+        """Асинхронное чтение оглавления архива"""
+        success, result = await self.client.inspect_archive(self.current_chat, message_id, self.archive_index)
+        if success:
+            return ArchiveResult(True, listing=result)
+        return ArchiveResult(False, error=result)
+
+    def _on_archive_inspected(self, listing):
+        """Показ оглавления архива"""
+        source = "из кеша" if listing.get('cached') else f"прочитано {format_size(listing['fetched_bytes'])}"
+        self.debug_log(f"Оглавление {listing['name']}: {len(listing['members'])} файлов, {source}")
+        self.status_label.config(text="Готов")
+
+        rows = [(m['name'], format_size(m['size']), format_size(m['compressed_size']))
+                for m in listing['members'] if not m['is_dir']]
+        self._show_table_window(
+            f"{listing['name']} ({format_size(listing['size'])}, {source})",
+            ('Имя', 'Размер', 'Сжатый'), rows
+        )
+
+    def _on_archive_error(self, error):
+        """Ошибка чтения оглавления архива"""
+        self.debug_log(f"Ошибка чтения архива: {error}", "ERROR")
+        self.status_label.config(text="Ошибка чтения архива")
+        messagebox.showerror("Ошибка", error)
+
+    def search_archives(self):
+        """Поиск файла по всем проиндексированным архивам"""
+        query = simpledialog.askstring("Поиск по архивам", "Имя файла внутри архива:", parent=self.root)
+        if not query:
+            return
+
+        results = self.archive_index.search(query)
+        self.debug_log(f"Поиск по архивам '{query}': {len(results)} совпадений")
+        rows = [(r['archive'] or '', r['message_id'], r['name'], format_size(r['size'])) for r in results]
+        self._show_table_window(f"Поиск по архивам: {query}", ('Архив', 'Сообщение', 'Имя', 'Размер'), rows)
+
+    def _show_table_window(self, title, columns, rows):
+        """Окно с таблицей и фильтром по тексту"""
+        window = tk.Toplevel(self.root)
+        window.title(title)
+        window.geometry("800x500")
+
+        filter_var = tk.StringVar()
+        entry = ttk.Entry(window, textvariable=filter_var)
+        entry.pack(fill='x', padx=10, pady=5)
+        self.setup_context_menu(entry)
+
+        frame = ttk.Frame(window)
+        frame.pack(fill='both', expand=True, padx=10, pady=5)
+        tree = ttk.Treeview(frame, columns=columns, show='headings')
+        for column in columns:
+            tree.heading(column, text=column)
+        tree.column(columns[0], width=300)
+        scrollbar = ttk.Scrollbar(frame, orient='vertical', command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        tree.pack(side='left', fill='both', expand=True)
+        scrollbar.pack(side='right', fill='y')
+
+        def refresh(*_):
+            text = filter_var.get().lower()
+            tree.delete(*tree.get_children())
+            for row in rows:
+                if not text or any(text in str(value).lower() for value in row):
+                    tree.insert('', 'end', values=row)
+
+        entry.bind('<KeyRelease>', refresh)
+        refresh()
+        ttk.Label(window, text=f"Всего: {len(rows)}").pack(anchor='w', padx=10, pady=5)
 
     # ========== МЕТОДЫ ДЛЯ ЗАГРУЗКИ ==========
 
@@ -1577,13 +6264,18 @@ class TelegramDownloaderGUI:
         """Начало загрузки файлов"""
         self.debug_log("Начало загрузки файлов")
 
-        # Получаем выбранные файлы
+        # Получаем выбранные файлы (полные имена берём из результатов сканирования)
         selected_files = []
         for item in self.files_tree.get_children():
             if self.files_tree.set(item, 'Выбор') == '☑':
-                file_id = int(self.files_tree.item(item, 'tags')[0])
-                filename = self.files_tree.set(item, 'Имя файла').split('...')[0]  # Убираем ...
-                selected_files.append({'id': file_id, 'filename': filename})
+                file_id = int(item)
+                file = self.all_files.get(file_id)
+                if file:
+                    selected_files.append({'id': file_id, 'filename': file.filename,
+                                           'size': file.size_bytes, 'extension': file.extension})
+                else:
+                    filename = self.files_tree.set(item, 'Имя файла').split('...')[0]  # Убираем ...
+                    selected_files.append({'id': file_id, 'filename': filename})
 
         if not selected_files:
             error_msg = "Выберите файлы для загрузки"
@@ -1600,20 +6292,12 @@ class TelegramDownloaderGUI:
             return
 
         # Подтверждение перед загрузкой
-        total_size = 0
-        for item in self.files_tree.get_children():
-            if self.files_tree.set(item, 'Выбор') == '☑':
-                size_str = self.files_tree.set(item, 'Размер')
-                if 'MB' in size_str:
-                    try:
-                        total_size += float(size_str.replace(' MB', ''))
-                    except:
-                        pass
+        total_size = sum(f.get('size', 0) for f in selected_files)
 
         confirm = messagebox.askyesno(
             "Подтверждение",
             f"Начать загрузку {len(selected_files)} файлов?\n"
-            f"Общий размер: {total_size:.1f} MB\n\n"
+            f"Общий размер: {format_size(total_size)}\n\n"
             f"Папка: {download_path}\n"
             f"Префикс: {self.file_prefix_var.get() or 'Нет'}"
         )
@@ -1622,115 +6306,348 @@ class TelegramDownloaderGUI:
             self.debug_log("Пользователь отменил загрузку")
             return
 
+        # Настройки фиксируем в журнале, чтобы продолжение шло с теми же параметрами
+        job_id = self.journal.create_job(
+            getattr(self.current_chat, 'id', None),
+            self.chat_link_var.get().strip(),
+            download_path,
+            selected_files,
+            self._download_options()
+        )
+        self.debug_log(f"Создана задача загрузки #{job_id}")
+
+        self.log_text.delete(1.0, tk.END)
+        self.log_text.insert(tk.END, "Начинаю загрузку...\n")
+        self._begin_download(job_id)
+
+    def _download_options(self) -> Dict:
+        """Параметры сохранения файлов из вкладки загрузки"""
+        if self.postprocess_delete_var.get() and self.hash_files_var.get():
+            self.debug_log("Исходники после распаковки не удаляются: они нужны для проверки по манифесту",
+                           "WARNING")
+        return {
+            'prefix': self.file_prefix_var.get(),
+            'create_subfolders': self.create_subfolders_var.get(),
+            'overwrite': self.overwrite_files_var.get(),
+            'output_mode': 'shards' if self.shard_output_var.get() else 'files',
+            'hash_algorithms': ((['sha256'] + (['blake3'] if blake3 and self.hash_blake3_var.get() else []))
+                                if self.hash_files_var.get() else []),
+            'postprocess': {
+                'steps': ['extract', 'decompress'] if self.postprocess_extract_var.get() else [],
+                'layout': self.postprocess_layout_var.get(),
+                'delete_source': self.postprocess_delete_var.get(),
+                'command': self.postprocess_command_var.get().strip(),
+            },
+        }
+
+    def _begin_download(self, job_id, chat=None):
+        """Запуск (или продолжение) задачи загрузки из журнала
+
+        chat - чат задачи, если он не совпадает с current_chat (задачи из поиска и журнала).
+        """
+        remaining = self.journal.remaining_files(job_id)
+        if not remaining:
+            self.journal.set_status(job_id, 'done')
+            if self.queued_jobs:
+                self._start_next_queued_job()
+                return
+            messagebox.showinfo("Информация", "Все файлы задачи уже скачаны")
+            return
+        self.download_chat = chat or self.current_chat
+
         # Обновляем интерфейс
         self.is_downloading = True
+        self.download_paused = False
+        self.download_job_id = job_id
+        self.journal.set_status(job_id, 'active')
         self.start_download_btn.config(state='disabled')
-        self.pause_download_btn.config(state='normal')
+        self.resume_job_btn.config(state='disabled')
+        self.pause_download_btn.config(state='normal', text="Приостановить")
         self.cancel_download_btn.config(state='normal')
         self.progress_bar['value'] = 0
         self.progress_label.config(text="0% (0/0)")
-        self.log_text.delete(1.0, tk.END)
-        self.log_text.insert(tk.END, "Начинаю загрузку...\n")
+        self.file_progress_bar['value'] = 0
+        self.file_progress_label.config(text="")
+
+        # Прогресс создаётся до запуска задачи, чтобы GUI сразу мог его опрашивать
+        self.download_progress = TransferProgress(
+            total_bytes=sum(f['size'] for f in remaining),
+            total_files=len(remaining)
+        )
+        self._poll_download_progress()
 
         # Запускаем загрузку в отдельном потоке
-        self.run_async_task(self._async_download_files, selected_files, download_path)
+        self.download_job = self.run_async_task(self._async_download_files, job_id)
+
+    async def _async_download_files(self, token, job_id):
+        """Асинхронная загрузка файлов задачи
+
+        Файлы разбираются воркерами - по одному на аккаунт пула сессий.
+        Отмена через token прерывает файлы на текущем запросе; они остаются
+        в журнале незавершёнными.
+        """
+        job = self.journal.get_job(job_id)
+        download_path = job['download_path']
+        options = job['options']
+        remaining = self.journal.remaining_files(job_id)
+
+        total_files = len(remaining)
+        counters = {'downloaded': 0}
+        reserved_paths = set()
+        paths_lock = asyncio.Lock()
+
+        # Событие паузы: пока оно сброшено, загрузка стоит, не теряя состояния
+        resume_event = asyncio.Event()
+        if not self.download_paused:
+            resume_event.set()
+        self.download_resume_event = resume_event
+
+        # В режиме шардов хеши попадают в индекс шардов, а постобработки нет - нет и файлов
+        shards = None
+        if options.get('output_mode') == 'shards':
+            shards = await asyncio.get_running_loop().run_in_executor(
+                self.client.io_executor, TarShardWriter,
+                os.path.join(download_path, SHARD_DIR), SHARD_MAX_BYTES, getattr(self.download_chat, 'id', None)
+            )
 
-    async def _async_download_files(self, selected_files, download_path):
-        """Асинхронная загрузка файлов"""
-        prefix = self.file_prefix_var.get()
-        create_subfolders = self.create_subfolders_var.get()
-        overwrite = self.overwrite_files_var.get()
+        manifest = None
+        if options.get('hash_algorithms') and not shards:
+            manifest = ManifestWriter(os.path.join(download_path, f"manifest_job{job_id}.jsonl"))
+
+        # Распаковка и прочая обработка идут в пуле процессов параллельно с загрузкой
+        postprocessor = PostProcessor({} if shards else options.get('postprocess') or {}, download_path,
+                                      on_result=self._on_postprocess_result, keep_source=manifest is not None)
+        if postprocessor.enabled:
+            self.debug_log(f"Постобработка: шаги {postprocessor.steps}, раскладка {postprocessor.layout}, "
+                           f"процессов {postprocessor.workers}")
+
+        pending = asyncio.Queue()
+        for file_info in remaining:
+            pending.put_nowait(file_info)
+
+        workers = max(1, min(self.client.pool.size, total_files))
+        self.debug_log(f"Задача #{job_id}: загрузка {total_files} файлов в {download_path}, воркеров: {workers}")
+
+        async def worker():
+            while self.is_downloading:
+                await resume_event.wait()
+                if not self.is_downloading:
+                    break
+                try:
+                    file_info = pending.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                await self._download_job_file(job_id, file_info, download_path, options,
+                                              resume_event, reserved_paths, paths_lock, counters, manifest,
+                                              postprocessor, shards)
 
-        total_files = len(selected_files)
-        downloaded = 0
+        try:
+            await asyncio.gather(*(worker() for _ in range(workers)))
+        except asyncio.CancelledError:
+            if not token.absorb():
+                raise
+        finally:
+            if shards:
+                report = await asyncio.get_running_loop().run_in_executor(self.client.io_executor, shards.close)
+                self._log_shard_report(report)
+
+        if token.cancelled:
+            self.debug_log("Загрузка прервана пользователем")
+            postprocessor.shutdown()
+        elif postprocessor.enabled:
+            self.root.after(0, self._add_log_message, "⏳ Завершение постобработки...\n")
+            results = await postprocessor.drain()
+            failed = sum(1 for result in results if result['error'])
+            self.debug_log(f"Постобработка завершена: {len(results)} файлов, с ошибками: {failed}")
+
+        self.download_resume_event = None
+
+        # Задача закрывается, только если скачаны все файлы
+        stats = self.journal.stats(job_id)
+        if not any(count for state, count in stats.items() if state != DownloadJournal.DONE):
+            self.journal.set_status(job_id, 'done')
+
+        return DownloadResult(job_id, counters['downloaded'], total_files, cancelled=token.cancelled)
+
+    async def _download_job_file(self, job_id, file_info, download_path, options,
+                                 resume_event, reserved_paths, paths_lock, counters, manifest=None,
+                                 postprocessor=None, shards=None):
+        """Загрузка одного файла задачи с отметками в журнале
+
+        С shards файл дописывается в tar-шард; в журнал идёт имя внутри шарда.
+        """
+        progress = self.download_progress
+        key = file_info['id']
+
+        async def on_progress(current, total):
+            progress.update_file(current, total, key=key)
+            if not resume_event.is_set():
+                await resume_event.wait()
 
-        self.debug_log(f"Начало загрузки {total_files} файлов в {download_path}")
+        try:
+            # Файл, прерванный в прошлый раз, качается заново с нуля, но по тому же пути:
+            # иначе рядом со старой копией появился бы файл с суффиксом _1
+            file_path = file_info['output_path']
+            if shards:
+                # Имена в шарде уникальны по id сообщения - файловую систему не трогаем
+                file_path = shard_member_name(file_info, options)
+            else:
+                async with paths_lock:
+                    if not file_path or file_path in reserved_paths:
+                        # makedirs/exists - в потоке ввода-вывода, не в event loop
+                        file_path = await asyncio.get_running_loop().run_in_executor(
+                            self.client.io_executor, resolve_output_path,
+                            file_info, download_path, options, reserved_paths
+                        )
+                    reserved_paths.add(file_path)
+            self.journal.mark(job_id, file_info['id'], DownloadJournal.IN_FLIGHT, output_path=file_path)
+
+            # Скачиваем файл
+            hashed = manifest or (shards and options.get('hash_algorithms'))
+            hasher = StreamHasher(options['hash_algorithms']) if hashed else None
+            progress.start_file(os.path.basename(file_path), file_info['size'], key=key)
+            success, error = await self.client.download_file(
+                self.download_chat, file_info['id'], file_path,
+                progress_callback=on_progress,
+                hasher=hasher,
+                shards=shards
+            )
+            progress.finish_file(success, key=key)
 
-        for i, file_info in enumerate(selected_files):
             if not self.is_downloading:
-                self.debug_log("Загрузка прервана пользователем")
-                break
+                # Отмена посреди файла: файл остаётся в журнале незавершённым
+                self.journal.mark(job_id, file_info['id'], DownloadJournal.PENDING)
+                return
 
-            try:
-                # Получаем информацию о расширении файла из списка
-                extension = None
-                for file in self.all_files:
-                    if file.id == file_info['id']:
-                        extension = file.extension
-                        break
+            if success:
+                counters['downloaded'] += 1
+                self.journal.mark(job_id, file_info['id'], DownloadJournal.DONE)
+                if manifest:
+                    manifest.add({
+                        'message_id': file_info['id'],
+                        'chat': getattr(self.download_chat, 'id', None),
+                        'filename': file_info['filename'],
+                        'output_path': os.path.relpath(file_path, download_path),
+                        'size': hasher.size,
+                        **hasher.hexdigests(),
+                        'timestamp': datetime.now().isoformat(),
+                    })
+                log_msg = f"✅ Скачан: {os.path.basename(file_path)}\n"
+                self.root.after(0, self._add_log_message, log_msg)
+                self.debug_log(f"Файл скачан: {os.path.basename(file_path)}")
+                if postprocessor:
+                    await postprocessor.submit(file_path)
+            else:
+                self.journal.mark(job_id, file_info['id'], DownloadJournal.FAILED, error=error)
+                log_msg = f"❌ Ошибка при загрузке {file_info['filename']}: {error}\n"
+                self.root.after(0, self._add_log_message, log_msg)
+                self.debug_log(f"Ошибка загрузки файла {file_info['filename']}: {error}", "ERROR")
 
-                # Создаем имя файла с префиксом
-                filename = f"{prefix}{file_info['filename']}" if prefix else file_info['filename']
+            # Небольшая задержка чтобы не перегружать сервер
+            await asyncio.sleep(0.5)
 
-                # Определяем путь для сохранения
-                if create_subfolders and extension:
-                    category = EXTENSION_CATEGORIES.get(extension, 'Другие')
-                    category_path = os.path.join(download_path, category)
-                    os.makedirs(category_path, exist_ok=True)
-                    file_path = os.path.join(category_path, filename)
-                else:
-                    file_path = os.path.join(download_path, filename)
-
-                # Проверяем существование файла
-                if os.path.exists(file_path) and not overwrite:
-                    # Добавляем номер к имени файла
-                    base, ext = os.path.splitext(file_path)
-                    counter = 1
-                    while os.path.exists(f"{base}_{counter}{ext}"):
-                        counter += 1
-                    file_path = f"{base}_{counter}{ext}"
-
-                # Скачиваем файл
-                success, error = await self.client.download_file(self.current_chat, file_info['id'], file_path)
-
-                if success:
-                    downloaded += 1
-                    log_msg = f"✅ Скачан: {os.path.basename(file_path)}\n"
-                    self.root.after(0, self._add_log_message, log_msg)
-                    self.debug_log(f"Файл скачан: {os.path.basename(file_path)}")
-                else:
-                    log_msg = f"❌ Ошибка при загрузке {filename}: {error}\n"
-                    self.root.after(0, self._add_log_message, log_msg)
-                    self.debug_log(f"Ошибка загрузки файла {filename}: {error}", "ERROR")
+        except asyncio.CancelledError:
+            # Отмена посреди файла: файл остаётся в журнале незавершённым
+            progress.finish_file(False, key=key)
+            self.journal.mark(job_id, file_info['id'], DownloadJournal.PENDING)
+            raise
+        except Exception as e:
+            progress.finish_file(False, key=key)
+            self.journal.mark(job_id, file_info['id'], DownloadJournal.FAILED, error=str(e))
+            log_msg = f"❌ Ошибка при загрузке {file_info['filename']}: {str(e)}\n"
+            self.root.after(0, self._add_log_message, log_msg)
+            self.debug_log(f"Исключение при загрузке файла {file_info['filename']}: {str(e)}", "ERROR")
+
+    def _log_shard_report(self, report):
+        """Итог упаковки в шарды (вызывается в потоке event loop)"""
+        if not report['files']:
+            return
+        log_msg = (f"📦 Упаковано {report['files']} файлов ({format_size(report['bytes'])}) "
+                   f"в {report['shards']} шард(ов)\n")
+        self.root.after(0, self._add_log_message, log_msg)
+        self.debug_log(
+            f"Шарды: файлов {report['files']}, дописывание {report['append_seconds']:.2f} с; "
+            f"отдельный файл стоил бы {report['per_file_overhead'] * 1000:.2f} мс - сэкономлено "
+            f"~{report['seconds_saved']:.1f} с и {report['inodes_saved']} inode"
+        )
 
-                # Обновляем прогресс
-                progress = (i + 1) / total_files * 100
-                self.root.after(0, self._update_progress, progress, i + 1, total_files)
+    def _on_postprocess_result(self, result):
+        """Результат постобработки файла (вызывается в потоке event loop)"""
+        if not result['steps'] and not result['error']:
+            return
+        name = os.path.basename(result['source'] or '')
+        if result['error']:
+            log_msg = f"⚠️ Постобработка {name}: {result['error']}\n"
+            self.debug_log(f"Ошибка постобработки {name}: {result['error']}", "ERROR")
+        else:
+            log_msg = f"📂 {name}: {', '.join(result['steps'])} ({len(result['outputs'])} файлов)\n"
+        self.root.after(0, self._add_log_message, log_msg)
 
-                # Небольшая задержка чтобы не перегружать сервер
-                await asyncio.sleep(0.5)
+    def _poll_download_progress(self):
+        """Периодический опрос побайтового прогресса загрузки"""
+        if not self.download_progress:
+            return
+        self._update_progress(self.download_progress.snapshot())
+        if self.is_downloading:
+            self.root.after(250, self._poll_download_progress)
 
-            except Exception as e:
-                log_msg = f"❌ Ошибка при загрузке {file_info['filename']}: {str(e)}\n"
-                self.root.after(0, self._add_log_message, log_msg)
-                self.debug_log(f"Исключение при загрузке файла {file_info['filename']}: {str(e)}", "ERROR")
+    def _update_progress(self, snapshot):
+        """Обновление прогресса загрузки"""
+        self.progress_bar['value'] = snapshot['percent']
+        self.progress_label.config(
+            text=f"{snapshot['percent']:.1f}% ({snapshot['done_files']}/{snapshot['total_files']}) — "
+                 f"{format_size(snapshot['transferred_bytes'])} из {format_size(snapshot['total_bytes'])}"
+        )
 
-        # Завершаем загрузку
-        self.root.after(0, self._on_download_complete, downloaded, total_files)
+        self.file_progress_bar['value'] = snapshot['file_percent']
+        if snapshot['file_name']:
+            self.file_progress_label.config(
+                text=f"{snapshot['file_name']}: {format_size(snapshot['file_bytes'])} "
+                     f"из {format_size(snapshot['file_total'])} ({snapshot['file_percent']:.1f}%)"
+            )
+        else:
+            self.file_progress_label.config(text="")
 
-    def _update_progress(self, progress, current, total):
-        """Обновление прогресса загрузки"""
-        self.progress_bar['value'] = progress
-        self.progress_label.config(text=f"{progress:.1f}% ({current}/{total})")
+        self.speed_label.config(
+            text=f"Скорость: {format_size(snapshot['speed'])}/с | Осталось: {format_eta(snapshot['eta'])}"
+        )
 
     def _add_log_message(self, message):
         """Добавление сообщения в лог"""
         self.log_text.insert(tk.END, message)
         self.log_text.see(tk.END)
 
-    def _on_download_complete(self, downloaded, total):
+    def _on_download_complete(self, downloaded, total, cancelled=False):
         """Обработка завершения загрузки"""
-        self.debug_log(f"Загрузка завершена: {downloaded} из {total} файлов")
+        self.debug_log(f"Загрузка {'отменена' if cancelled else 'завершена'}: {downloaded} из {total} файлов")
 
         self.is_downloading = False
+        self.download_job = None
+        self.download_paused = False
+        self._remember_recent_dcs()
+        if self.download_progress:
+            self._update_progress(self.download_progress.snapshot())
         self.start_download_btn.config(state='normal')
-        self.pause_download_btn.config(state='disabled')
+        self.pause_download_btn.config(state='disabled', text="Приостановить")
         self.cancel_download_btn.config(state='disabled')
+        if self.journal.unfinished_jobs():
+            self.resume_job_btn.config(state='normal')
+
+        if cancelled:
+            self.log_text.insert(tk.END, f"\nЗагрузка отменена. Скачано: {downloaded} из {total} файлов\n")
+            self.status_label.config(text="Загрузка отменена")
+            self._drop_queued_jobs("загрузка отменена")
+            return
 
         message = f"Загрузка завершена!\nСкачано: {downloaded} из {total} файлов"
         self.log_text.insert(tk.END, f"\n{message}\n")
         self.status_label.config(text="Загрузка завершена")
 
+        # Задачи из глобального поиска идут одна за другой без подтверждений
+        if self.queued_jobs:
+            self._start_next_queued_job()
+            return
+
         messagebox.showinfo("Успех", message)
 
     def _on_download_error(self, error):
@@ -1738,6 +6655,7 @@ class TelegramDownloaderGUI:
         self.debug_log(f"Ошибка загрузки: {error}", "ERROR")
 
         self.is_downloading = False
+        self.download_job = None
         self.start_download_btn.config(state='normal')
         self.pause_download_btn.config(state='disabled')
         self.cancel_download_btn.config(state='disabled')
@@ -1745,15 +6663,36 @@ class TelegramDownloaderGUI:
         self.log_text.insert(tk.END, f"\n❌ Ошибка загрузки: {error}\n")
         self.status_label.config(text="Ошибка загрузки")
 
+        # Ошибка одной задачи из поиска не останавливает остальные
+        if self.queued_jobs:
+            self._start_next_queued_job()
+            return
+
         messagebox.showerror("Ошибка", f"Ошибка при загрузке: {error}")
 
+    def _set_download_paused(self, paused):
+        """Пауза/продолжение загрузки без остановки задачи"""
+        self.download_paused = paused
+        event = self.download_resume_event
+        if event:
+            self.loop.call_soon_threadsafe(event.clear if paused else event.set)
+
     def pause_download(self):
-        """Приостановка загрузки"""
+        """Приостановка (или продолжение) загрузки"""
+        if self.download_paused:
+            self.debug_log("Продолжение загрузки")
+            self._set_download_paused(False)
+            self.journal.set_status(self.download_job_id, 'active')
+            self.pause_download_btn.config(text="Приостановить")
+            self.log_text.insert(tk.END, "▶️ Загрузка продолжена\n")
+            self.status_label.config(text="Загрузка...")
+            return
+
         self.debug_log("Приостановка загрузки")
 
-        self.is_downloading = False
-        self.pause_download_btn.config(state='disabled')
-        self.start_download_btn.config(state='normal')
+        self._set_download_paused(True)
+        self.journal.set_status(self.download_job_id, 'paused')
+        self.pause_download_btn.config(text="Продолжить")
         self.log_text.insert(tk.END, "⏸️ Загрузка приостановлена\n")
         self.status_label.config(text="Загрузка приостановлена")
 
@@ -1762,12 +6701,196 @@ class TelegramDownloaderGUI:
         self.debug_log("Отмена загрузки")
 
         self.is_downloading = False
+        if self.download_job_id is not None:
+            self.journal.set_status(self.download_job_id, 'cancelled')
+        # Отмена прерывает и текущие запросы, и ожидание на паузе
+        if self.download_job:
+            self.download_job.cancel()
         self.start_download_btn.config(state='normal')
-        self.pause_download_btn.config(state='disabled')
+        self.pause_download_btn.config(state='disabled', text="Приостановить")
         self.cancel_download_btn.config(state='disabled')
         self.log_text.insert(tk.END, "⏹️ Загрузка отменена\n")
         self.status_label.config(text="Загрузка отменена")
 
+    def resume_unfinished_download(self):
+        """Продолжение последней незавершённой задачи из журнала"""
+        if self.is_downloading:
+            return
+
+        jobs = self.journal.unfinished_jobs()
+        if not jobs:
+            messagebox.showinfo("Информация", "Незавершённых задач нет")
+            self.resume_job_btn.config(state='disabled')
+            return
+
+        if not self.is_connected:
+            messagebox.showerror("Ошибка", "Сначала подключитесь к Telegram")
+            return
+
+        job = jobs[0]
+        stats = self.journal.stats(job['id'])
+        remaining = sum(count for state, count in stats.items() if state != DownloadJournal.DONE)
+        if not messagebox.askyesno(
+                "Продолжение загрузки",
+                f"Задача #{job['id']} от {job['created_at'][:16]}\n"
+                f"Осталось файлов: {remaining} из {sum(stats.values())}\n"
+                f"Папка: {job['download_path']}\n\nПродолжить?"):
+            return
+
+        self.log_text.delete(1.0, tk.END)
+        self.log_text.insert(tk.END, f"Продолжаю задачу #{job['id']}...\n")
+        self._start_job(job)
+
+    def _start_job(self, job):
+        """Запуск задачи из журнала; чат задачи при необходимости получается заново
+
+        current_chat (и таблица файлов) не меняется: задача качается из своего чата.
+        """
+        if self.current_chat is not None and getattr(self.current_chat, 'id', None) == job['chat_id']:
+            self._begin_download(job['id'])
+        else:
+            self.resume_job_btn.config(state='disabled')
+            self.run_async_task(self._async_prepare_resume, job)
+
+    def _start_next_queued_job(self):
+        """Следующая задача из очереди глобального поиска"""
+        while self.queued_jobs and not self.is_downloading:
+            job = self.journal.get_job(self.queued_jobs.popleft())
+            if job:
+                self.log_text.insert(tk.END, f"\nЗадача #{job['id']} из поиска ({job['chat_ref']})...\n")
+                self._start_job(job)
+                return
+
+    def _drop_queued_jobs(self, reason):
+        """Снятие очереди задач из поиска; сами задачи остаются в журнале незавершёнными"""
+        if not self.queued_jobs:
+            return
+        ids = ', '.join(f"#{job_id}" for job_id in self.queued_jobs)
+        self.queued_jobs.clear()
+        self.debug_log(f"Очередь задач из поиска снята ({reason}): {ids}")
+        self.log_text.insert(tk.END, f"Очередь из поиска снята ({reason}), задачи {ids} можно продолжить позже\n")
+        if self.journal.unfinished_jobs():
+            self.resume_job_btn.config(state='normal')
+
+    async def _async_prepare_resume(self, token, job):
+        """Повторное получение чата задачи перед продолжением"""
+        success, result = await self.client.get_chat_info(job['chat_ref'] or str(job['chat_id']))
+        if not success:
+            return ResumeResult(job['id'], error=result)
+        return ResumeResult(job['id'], chat=result)
+
+    def _on_resume_ready(self, result):
+        """Чат задачи получен - продолжаем загрузку; не получен - переходим к следующей задаче"""
+        if result.error:
+            self.debug_log(f"Задача #{result.job_id}: чат недоступен: {result.error}", "ERROR")
+            self.log_text.insert(tk.END, f"❌ Задача #{result.job_id}: чат недоступен: {result.error}\n")
+            if self.journal.unfinished_jobs():
+                self.resume_job_btn.config(state='normal')
+            if self.queued_jobs:
+                self._start_next_queued_job()
+            else:
+                messagebox.showerror("Ошибка", result.error)
+            return
+        self.debug_log(f"Продолжение задачи #{result.job_id}")
+        self._begin_download(result.job_id, result.chat)
+
+    def toggle_watch(self):
+        """Запуск/остановка режима наблюдения за текущим и дополнительными чатами"""
+        if self.client.is_watching:
+            self.debug_log("Остановка режима наблюдения")
+            self.watch_btn.config(state='disabled')
+            self.loop.call_soon_threadsafe(self.client.stop_watch)
+            return
+
+        if not self.is_connected:
+            messagebox.showerror("Ошибка", "Сначала подключитесь к Telegram")
+            return
+        download_path = self.download_path_var.get()
+        if not download_path or not os.path.exists(download_path):
+            messagebox.showerror("Ошибка", "Выберите корректную папку для загрузки")
+            return
+        extra_chats = [ref.strip() for ref in self.watch_chats_var.get().split(',') if ref.strip()]
+        if not self.current_chat and not extra_chats:
+            messagebox.showerror("Ошибка", "Загрузите чат или укажите чаты для наблюдения")
+            return
+        try:
+            filters = self._get_scan_filters()
+        except ValueError as e:
+            messagebox.showerror("Ошибка", f"Неверный фильтр: {e}")
+            return
+
+        self.watch_btn.config(text="⏹ Остановить наблюдение")
+        self.log_text.insert(tk.END, "Запуск режима наблюдения...\n")
+        self.watch_job = self.run_async_task(self._async_watch, extra_chats, download_path, self._download_options(),
+                            set(self.extension_selector.get_selected_extensions()), filters)
+
+    async def _async_watch(self, token, extra_chats, download_path, options, extensions, filters):
+        """Асинхронный режим наблюдения до остановки пользователем"""
+        chats = [self.current_chat] if self.current_chat else []
+        resolved, failures = await self.client.resolve_chats(extra_chats)
+        for ref, error in failures.items():
+            self.root.after(0, self._add_log_message, f"❌ {ref}: {error}\n")
+        chats += [entity for entity in resolved if all(entity.id != chat.id for chat in chats)]
+        if not chats:
+            return WatchResult(0)
+
+        def on_event(text):
+            self.debug_log(text)
+            self.root.after(0, self._add_log_message, text + "\n")
+
+        try:
+            downloaded = await self.client.watch(chats, self.journal, download_path, options,
+                                                 selected_extensions=extensions, filters=filters,
+                                                 on_event=on_event)
+        finally:
+            self.root.after(0, self.watch_btn.config, {'text': "👁 Наблюдать", 'state': 'normal'})
+        return WatchResult(downloaded)
+
+    def _on_watch_stopped(self, downloaded):
+        """Обработка остановки режима наблюдения"""
+        self.debug_log(f"Режим наблюдения остановлен, скачано файлов: {downloaded}")
+        self.watch_job = None
+        self.log_text.insert(tk.END, f"\nНаблюдение остановлено. Скачано: {downloaded}\n")
+        self.log_text.see(tk.END)
+
+    def verify_download_manifest(self):
+        """Проверка скачанных файлов по манифесту задачи"""
+        manifest_path = filedialog.askopenfilename(
+            title="Выберите манифест",
+            initialdir=self.download_path_var.get(),
+            filetypes=[("Манифест", "manifest_*.jsonl"), ("JSONL", "*.jsonl"), ("All files", "*.*")]
+        )
+        if not manifest_path:
+            return
+
+        self.debug_log(f"Проверка по манифесту: {manifest_path}")
+        self.status_label.config(text="Проверка файлов по манифесту...")
+
+        def worker():
+            try:
+                results = verify_manifest(manifest_path)
+                self.root.after(0, self._on_verify_complete, manifest_path, results)
+            except Exception as e:
+                self.root.after(0, self._show_error, f"Ошибка проверки манифеста: {e}")
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    def _on_verify_complete(self, manifest_path, results):
+        """Итоги проверки по манифесту"""
+        bad = [r for r in results if r['status'] != 'ok']
+        for result in bad:
+            self.debug_log(f"Проверка: {result['output_path']} - {result['status']}", "WARNING")
+
+        message = (f"Проверено файлов: {len(results)}\n"
+                   f"В порядке: {len(results) - len(bad)}\n"
+                   f"С ошибками: {len(bad)}")
+        self.debug_log(f"Проверка {os.path.basename(manifest_path)} завершена: {len(bad)} ошибок")
+        self.status_label.config(text="Проверка завершена")
+        if bad:
+            messagebox.showwarning("Проверка", message)
+        else:
+            messagebox.showinfo("Проверка", message)
+
     def open_download_folder(self):
         """Открытие папки загрузки"""
         path = self.download_path_var.get()
@@ -1803,6 +6926,8 @@ class TelegramDownloaderGUI:
         self.settings['api_hash'] = self.api_hash_var.get()
         self.settings['phone'] = self.phone_var.get()
         self.settings['download_path'] = self.download_path_var.get()
+        self.settings['watch_chats'] = self.watch_chats_var.get().strip()
+        self.settings['postprocess'] = self._download_options()['postprocess']
 
         self._save_settings()
         messagebox.showinfo("Сохранено", "Настройки сохранены")
@@ -1830,8 +6955,17 @@ class TelegramDownloaderGUI:
                 self.api_id_var.set(self.settings.get('api_id', ''))
                 self.api_hash_var.set(self.settings.get('api_hash', ''))
                 self.phone_var.set(self.settings.get('phone', ''))
+                self.pool_sessions_var.set(self.settings.get('pool_sessions', ''))
                 self.download_path_var.set(self.settings.get('download_path',
                                                              os.path.join(os.path.expanduser("~"), "Downloads")))
+                self.watch_chats_var.set(self.settings.get('watch_chats', ''))
+                self.event_loop_var.set(self.settings.get('event_loop', 'auto'))
+                self.client.transfer_tuner.max_window = int(self.settings.get('transfer_window', TRANSFER_WINDOW_MAX))
+                postprocess = self.settings.get('postprocess', {})
+                self.postprocess_extract_var.set(bool(postprocess.get('steps')))
+                self.postprocess_layout_var.set(postprocess.get('layout', 'subfolder'))
+                self.postprocess_delete_var.set(postprocess.get('delete_source', False))
+                self.postprocess_command_var.set(postprocess.get('command', ''))
 
                 # Загружаем расширения
                 if 'extensions' in self.settings:
@@ -1879,6 +7013,81 @@ class TelegramDownloaderGUI:
                 self.debug_log(error_msg, "ERROR")
                 messagebox.showerror("Ошибка", error_msg)
 
+    def show_connection_stats(self):
+        """Вывод статистики пула сессий и соединений к DC"""
+        stats = self.client.connection_stats()
+        for account in stats['accounts']:
+            self.debug_log(
+                f"Сессия {account['name']}: запросов {account['requests']}, "
+                f"в работе {account['in_flight']}, скачано {format_size(account['bytes'])}, "
+                f"FloodWait {account['flood_waits']} (осталось {account['flood_remaining']:.0f} с)"
+            )
+        transfers = stats['transfers']
+        parts = ', '.join(f"{format_size(size)}: {count}" for size, count in transfers['part_sizes'].items())
+        self.debug_log(f"Загрузка частями: окно до {transfers['max_window']}, части по файлам - {parts or 'нет'}")
+        for dc_id, dc in transfers['dcs'].items():
+            rtt = f"{dc['rtt'] * 1000:.0f} мс (мин. {dc['min_rtt'] * 1000:.0f} мс)" if dc['rtt'] is not None else "-"
+            speed = f"{format_size(dc['throughput'])}/с" if dc['throughput'] else "-"
+            self.debug_log(f"DC{dc_id}: окно {dc['window']} (расширено {dc['grown']}, сужено {dc['shrunk']}), "
+                           f"RTT части {rtt}, скорость {speed}, частей {dc['parts']}")
+        loop = stats['loop']
+        if loop:
+            self.debug_log(f"Event loop: задержка p50 {loop['p50_ms']:.1f}, p95 {loop['p95_ms']:.1f}, "
+                           f"p99 {loop['p99_ms']:.1f}, макс. {loop['max_ms']:.0f} мс ({loop['samples']} замеров); "
+                           f"колбэков дольше {loop['threshold_ms']:.0f} мс: {loop['slow_callbacks']}")
+            for stall in loop['stalls'][-3:]:
+                where = stall['stack'].strip().splitlines()[-2:] if stall['stack'] else []
+                self.debug_log(f"  {datetime.fromtimestamp(stall['at']).strftime('%H:%M:%S')} "
+                               f"{stall['duration'] * 1000:.0f} мс: {' '.join(line.strip() for line in where)}")
+        cache = stats['peer_cache']
+        self.debug_log(f"Кеш чатов: {cache['peers']} записей, попаданий {cache['hits']}, промахов {cache['misses']}")
+        for name, dc_stats in stats['dc_pools'].items():
+            dcs = ', '.join(f"DC{dc}: {v['open']} откр./{v['idle']} своб." for dc, v in dc_stats['dcs'].items())
+            self.debug_log(
+                f"Соединения {name}: попаданий {dc_stats['hits']}, промахов {dc_stats['misses']} "
+                f"({dc_stats['hit_rate']:.0%}), экспортов авторизации {dc_stats['exports']}, "
+                f"закрыто по простою {dc_stats['expired']}; {dcs or 'нет'}"
+            )
+
+    def _on_event_loop_selected(self, event=None):
+        """Смена реализации event loop (применяется при следующем запуске)"""
+        self.settings['event_loop'] = self.event_loop_var.get()
+        self._save_settings()
+        self.debug_log(f"Event loop '{self.event_loop_var.get()}' будет использован после перезапуска "
+                       f"(сейчас: {self.loop_backend})")
+
+    def run_benchmark(self):
+        """Замер накладных расходов event loop и скорости расшифровки"""
+        self.debug_log("Запуск бенчмарка event loop и расшифровки...")
+        self.run_async_task(self._async_benchmark)
+
+    async def _async_benchmark(self, token):
+        """Асинхронный бенчмарк: цикл меряется в своём потоке, расшифровка - в пуле потоков"""
+        loop_stats = await benchmark_event_loop()
+        decrypt_mbps = await asyncio.get_running_loop().run_in_executor(
+            self.client.io_executor, benchmark_decryption
+        )
+        return BenchmarkResult(self.loop_backend, self.crypto_backend,
+                               loop_stats['switch_us'], loop_stats['task_us'], decrypt_mbps)
+
+    def _on_benchmark_complete(self, result):
+        """Вывод результатов бенчмарка во вкладку дебага"""
+        self.debug_log(f"Event loop ({result.loop_backend}): переключение {result.switch_us:.2f} мкс, "
+                       f"запуск задачи {result.task_us:.2f} мкс")
+        if result.decrypt_mbps is None:
+            self.debug_log("Расшифровка: модуль telethon.crypto недоступен", "WARNING")
+            return
+        self.debug_log(f"Расшифровка AES-IGE ({result.crypto_backend}): {result.decrypt_mbps:.1f} МБ/с на ядро")
+
+        # Сравниваем с последней скоростью загрузки, если она есть
+        if self.download_progress:
+            speed_mbps = self.download_progress.snapshot()['speed'] / (1024 * 1024)
+            if speed_mbps and speed_mbps > result.decrypt_mbps * 0.7:
+                self.debug_log(f"Загрузка ({speed_mbps:.1f} МБ/с) близка к пределу расшифровки - "
+                               f"упор в CPU", "WARNING")
+        if result.crypto_backend == 'python':
+            self.debug_log("Для ускорения расшифровки установите cryptg", "WARNING")
+
     def test_debug_message(self):
         """Тестовое сообщение для проверки работы дебага"""
         self.debug_log("Тестовое информационное сообщение")
@@ -1894,8 +7103,192 @@ class TelegramDownloaderGUI:
             self.debug_log(traceback.format_exc(), "TRACEBACK")
 
 
+async def run_headless(args) -> int:
+    """Headless-режим: подключение по сохранённой сессии, сканирование и экспорт каталога,
+    публикация задачи для воркеров (--publish), воркер (--worker)
+    или наблюдение за чатами (--watch) до Ctrl+C
+    """
+    if not os.path.exists(SETTINGS_FILE):
+        print(f"Нет файла настроек {SETTINGS_FILE}: сначала подключитесь через GUI")
+        return 1
+    with open(SETTINGS_FILE, 'r', encoding='utf-8') as f:
+        settings = json.load(f)
+
+    client = AsyncTelegramClient()
+    client.transfer_tuner.max_window = args.window or int(settings.get('transfer_window', TRANSFER_WINDOW_MAX))
+    client.create_client(int(settings['api_id']), settings['api_hash'])
+    success, message = await client.connect(settings.get('phone', ''))
+    if not success:
+        print(message)
+        return 1
+
+    loop_monitor = LoopMonitor(
+        on_stall=lambda seconds, stack: print(f"Event loop заблокирован на {seconds * 1000:.0f} мс:\n{stack}")
+    )
+    loop_monitor.start(asyncio.get_running_loop())
+    client.loop_monitor = loop_monitor
+    try:
+        pool_sessions = [name.strip() for name in settings.get('pool_sessions', '').split(',') if name.strip()]
+        if pool_sessions:
+            await client.add_pool_sessions(pool_sessions)
+
+        extensions = set(args.extensions or settings.get('extensions', []))
+        filters = ScanFilters(
+            date_from=parse_date_bound(args.date_from),
+            date_to=parse_date_bound(args.date_to, end_of_day=True),
+            min_size=int(args.min_size * 1024 * 1024) if args.min_size else None,
+            max_size=int(args.max_size * 1024 * 1024) if args.max_size else None,
+        )
+
+        if args.worker:
+            journal = DownloadJournal(args.store, shared=True)
+            try:
+                counters = await client.run_worker(journal, worker_id=args.worker_id, download_path=args.output)
+            finally:
+                journal.close()
+            print(f"Воркер завершён: скачано {counters['downloaded']}, ошибок {counters['failed']}")
+            return 0
+
+        if args.watch:
+            chats, failures = await client.resolve_chats(args.watch)
+            for ref, error in failures.items():
+                print(f"{ref}: {error}")
+            if failures:
+                return 1
+            download_path = args.output or settings.get('download_path') or '.'
+            os.makedirs(download_path, exist_ok=True)
+            options = {'create_subfolders': True, 'hash_algorithms': ['sha256'],
+                       'postprocess': settings.get('postprocess', {})}
+            journal = DownloadJournal()
+            try:
+                downloaded = await client.watch(chats, journal, download_path, options,
+                                                selected_extensions=extensions, filters=filters)
+            finally:
+                journal.close()
+            print(f"Наблюдение остановлено, скачано файлов: {downloaded}")
+            return 0
+
+        success, chat = await client.get_chat_info(args.chat)
+        if not success:
+            print(chat)
+            return 1
+
+        async def progress_callback(processed_count, found_count):
+            if processed_count % 1000 == 0:
+                print(f"Обработано сообщений: {processed_count}, найдено файлов: {found_count}")
+
+        captions = {}
+        checkpoints = ScanCheckpoints()
+        try:
+            files, total_size = await client.get_all_files(
+                chat,
+                limit=args.limit or None,
+                selected_extensions=extensions,
+                progress_callback=progress_callback,
+                filters=filters,
+                captions=captions,
+                checkpoints=checkpoints,
+                from_scratch=args.rescan
+            )
+        finally:
+            checkpoints.close()
+        recovered_files, recovered_messages = checkpoints.last_recovered
+        if recovered_messages:
+            print(f"Восстановлено из контрольной точки: {recovered_files} файлов, {recovered_messages} сообщений")
+        print(f"Найдено файлов: {len(files)} ({format_size(total_size)})")
+        search_index = SearchIndex()
+        try:
+            search_index.index_chat(chat.id, getattr(chat, 'title', None) or args.chat, args.chat, files, captions)
+        finally:
+            search_index.close()
+
+        if args.export:
+            count = export_catalog(files, args.export, args.format, chat_id=chat.id)
+            print(f"Экспортировано {count} строк в {args.export}")
+
+        if args.publish:
+            download_path = args.output or settings.get('download_path') or '.'
+            options = {'create_subfolders': True, 'hash_algorithms': ['sha256'],
+                       'postprocess': settings.get('postprocess', {})}
+            journal = DownloadJournal(args.store, shared=True)
+            try:
+                job_id = journal.publish_job(
+                    chat.id, args.chat, download_path,
+                    [{'id': f.id, 'filename': f.filename, 'size': f.size_bytes, 'extension': f.extension}
+                     for f in files],
+                    options
+                )
+            finally:
+                journal.close()
+            print(f"Задача {job_id} опубликована в {args.store}: {len(files)} файлов для воркеров")
+        return 0
+    finally:
+        loop_monitor.stop()
+        await client.client.disconnect()
+
+
 def main():
     """Основная функция"""
+    parser = argparse.ArgumentParser(description="Telegram File Downloader PRO")
+    parser.add_argument('--verify', metavar='MANIFEST',
+                        help="проверить скачанные файлы по манифесту и выйти")
+    parser.add_argument('--extract-shards', metavar='SHARD_DIR',
+                        help="извлечь файлы из tar-шардов (по --ids или все) в --output и выйти")
+    parser.add_argument('--ids', nargs='+', metavar='MESSAGE_ID',
+                        help="id сообщений для --extract-shards")
+    parser.add_argument('--chat', help="чат для headless-сканирования (ссылка, @username или id)")
+    parser.add_argument('--export', metavar='PATH',
+                        help="выгрузить каталог файлов чата (csv, jsonl, parquet)")
+    parser.add_argument('--format', choices=EXPORT_FORMATS,
+                        help="формат выгрузки (по умолчанию - по расширению файла)")
+    parser.add_argument('--limit', type=int, default=25000,
+                        help="сколько сообщений сканировать (0 - без ограничения)")
+    parser.add_argument('--rescan', action='store_true',
+                        help="сканировать заново, не продолжая с контрольной точки")
+    parser.add_argument('--extensions', nargs='*',
+                        help="расширения файлов, например .zip .pdf (по умолчанию - из настроек)")
+    parser.add_argument('--date-from', help="файлы не старше даты (ГГГГ-ММ-ДД)")
+    parser.add_argument('--date-to', help="файлы не новее даты (ГГГГ-ММ-ДД, включительно)")
+    parser.add_argument('--min-size', type=float, help="минимальный размер файла, МБ")
+    parser.add_argument('--max-size', type=float, help="максимальный размер файла, МБ")
+    parser.add_argument('--watch', nargs='+', metavar='CHAT',
+                        help="наблюдать за чатами и сразу скачивать новые подходящие файлы")
+    parser.add_argument('--loop', choices=EVENT_LOOP_BACKENDS, default='auto',
+                        help="реализация event loop для headless-режима")
+    parser.add_argument('--window', type=int, metavar='N',
+                        help=f"предел одновременных запросов частей на файл (по умолчанию {TRANSFER_WINDOW_MAX})")
+    parser.add_argument('--output', metavar='DIR',
+                        help="папка загрузки для --watch, --publish и --worker (по умолчанию - из настроек "
+                             "или из задачи)")
+    parser.add_argument('--publish', action='store_true',
+                        help="опубликовать файлы просканированного чата (--chat) как задачу для воркеров")
+    parser.add_argument('--worker', action='store_true',
+                        help="воркер: качать файлы опубликованных задач, пока они не закончатся")
+    parser.add_argument('--store', metavar='DB', default='tg_downloader_jobs.db',
+                        help="общее хранилище задач для --publish/--worker (SQLite, можно на общем томе)")
+    parser.add_argument('--worker-id', help="имя воркера (по умолчанию - хост:pid)")
+    args = parser.parse_args()
+
+    if args.extract_shards:
+        output_dir = args.output or '.'
+        ids = [int(message_id) for message_id in args.ids] if args.ids else None
+        extracted = extract_from_shards(args.extract_shards, output_dir, ids)
+        print(f"Извлечено файлов: {len(extracted)} в {output_dir}")
+        sys.exit(0 if ids is None or len(extracted) == len(ids) else 1)
+
+    if args.verify:
+        results = verify_manifest(args.verify)
+        bad = [r for r in results if r['status'] != 'ok']
+        for result in bad:
+            print(f"{result['status']}: {result['output_path']}")
+        print(f"Проверено: {len(results)}, с ошибками: {len(bad)}")
+        sys.exit(1 if bad else 0)
+
+    if args.chat or args.watch or args.worker:
+        if sys.platform == 'win32':
+            asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+        sys.exit(run_with_loop(run_headless(args), args.loop))
+
     root = tk.Tk()
     app = TelegramDownloaderGUI(root)
     root.mainloop()